@@ -62,6 +62,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'data_manager.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -144,4 +145,143 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
-LOGOUT_REDIRECT_URL = '/accounts/login/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/accounts/login/'
+
+# Dataset list
+# Datasets per page; the list uses keyset (cursor) pagination.
+DATASET_LIST_PAGE_SIZE = 24
+
+
+# Dataset analysis
+# Maximum number of points a scatter/line chart sends to the browser;
+# larger series are downsampled (stratified for scatters, LTTB for lines).
+CHART_MAX_POINTS = 2000
+
+# Analysis results are cached per dataset, keyed by file checksum, the
+# dataset's analysis generation and the analysis version: an LRU in-process
+# tier in front of a shared file tier. The file tier is not LRU: when full,
+# it deletes a random 1/CULL_FREQUENCY of its entries.
+# Payloads above ANALYSIS_CACHE_MAX_ENTRY_BYTES (pickled) are not cached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analysis_memory': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analysis',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 64, 'CULL_FREQUENCY': 4},
+    },
+    'analysis': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'analysis'),
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 1000, 'CULL_FREQUENCY': 4},
+    },
+}
+ANALYSIS_CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+
+
+# Dataset ingestion
+# Uploads are processed by `python manage.py run_ingestion_worker`. Set
+# INGESTION_RUN_INLINE to process them inside the upload request instead.
+INGESTION_RUN_INLINE = False
+INGESTION_MAX_ATTEMPTS = 3
+INGESTION_RETRY_DELAY = 30  # seconds, doubled after each failed attempt
+# Excel workbooks are streamed sheet by sheet, each into its own columnar
+# table; up to this many sheets are parsed in parallel worker processes.
+EXCEL_SHEET_WORKERS = 4
+# JSON lines and top-level JSON arrays are parsed incrementally in batches of
+# JSON_BATCH_ROWS records; nested objects become dotted columns (a.b.c) up
+# to JSON_FLATTEN_DEPTH levels deep, deeper values and lists are kept as text.
+JSON_BATCH_ROWS = 10_000
+JSON_FLATTEN_DEPTH = 3
+# Column profiles are computed by a pool of this many threads; None uses one
+# thread per CPU core and 1 profiles columns one after another.
+PROFILE_WORKERS = None
+# The search index holds dataset names, descriptions, column names and, for
+# categorical columns, up to this many of their most frequent values.
+SEARCH_VALUES_PER_COLUMN = 10
+# Async views hand pandas work (previews, row counts) to a pool of this many
+# worker processes so it never blocks the event loop; 0 runs it in threads.
+ASYNC_CPU_WORKERS = 2
+# Analyses that are not cached reserve their estimated memory (from the row
+# count and stored dtypes) out of ANALYSIS_MEMORY_BUDGET bytes per server
+# process, and each user runs at most ANALYSIS_MAX_PER_USER at once. Others
+# wait up to ANALYSIS_QUEUE_TIMEOUT seconds, then run on a sample of at most
+# ANALYSIS_SAMPLE_ROWS rows that fits, or are turned away.
+ANALYSIS_MEMORY_BUDGET = 1024 ** 3
+ANALYSIS_MAX_PER_USER = 2
+ANALYSIS_QUEUE_TIMEOUT = 10
+ANALYSIS_SAMPLE_ROWS = 100_000
+# Tables of at least APPROX_MIN_ROWS rows are profiled at ingestion with
+# mergeable sketches (quantiles, distinct counts, top values, with error
+# bounds) instead of being loaded whole, and get a persisted random sample
+# of APPROX_SAMPLE_ROWS rows. Their analysis is built from the sample and
+# the sketches unless exact results are requested (?exact=1).
+APPROX_MIN_ROWS = 1_000_000
+APPROX_SAMPLE_ROWS = 50_000
+# Downloads are streamed without being stored; only Range requests, which
+# resume a transfer, write the export next to the columnar cache. Stored
+# exports beyond EXPORT_STORE_MAX_BYTES in total are deleted, least
+# recently used first.
+EXPORT_STORE_MAX_BYTES = 1024 ** 3
+
+
+# Uploads
+# Multipart uploads are streamed to disk next to MEDIA_ROOT/datasets/ instead
+# of being buffered in memory; large files go through the chunked upload API.
+FILE_UPLOAD_HANDLERS = [
+    'data_manager.upload_handlers.DatasetFileUploadHandler',
+]
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024  # files above this use the chunked API
+MAX_UPLOAD_SIZE = 10 * 1024 ** 3  # largest file the chunked API accepts
+
+
+# User activity
+# Activity events are buffered in-process and written in batches by a
+# background thread. Events that do not fit in the queue, or whose insert
+# fails, are spilled to ACTIVITY_SPILL_FILE and replayed later.
+ACTIVITY_LOG_ASYNC = True
+ACTIVITY_BATCH_SIZE = 200
+ACTIVITY_FLUSH_INTERVAL = 2.0  # seconds
+ACTIVITY_QUEUE_SIZE = 10000
+ACTIVITY_SPILL_FILE = os.path.join(BASE_DIR, '.cache', 'activity_spill.jsonl')
+
+# `python manage.py rollup_activity` (run it from cron, e.g. every 15 minutes)
+# maintains the hourly/daily rollups the activity dashboard reads, and moves
+# raw rows older than ACTIVITY_RAW_RETENTION_DAYS into ACTIVITY_ARCHIVE_DIR.
+ACTIVITY_RAW_RETENTION_DAYS = 90
+ACTIVITY_HOURLY_ROLLUP_RETENTION_DAYS = 30
+ACTIVITY_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive', 'activity')
+
+
+# Metabase embedding
+# The active MetabaseConfig is memoized per process (dropped on save/delete
+# and after the TTL), and signed embed URLs are reused until fewer than
+# METABASE_TOKEN_REFRESH_MARGIN seconds of their one-hour lifetime remain.
+METABASE_CONFIG_CACHE_TTL = 60
+METABASE_TOKEN_REFRESH_MARGIN = 5 * 60
+
+
+# Profiling
+# With PROFILING_ENABLED, responses carry a Server-Timing header with the
+# time spent per phase (parse, query, aggregate, render, db, ...) and each
+# request is logged to the 'data_manager.profiling' logger. Requests picked
+# by PROFILING_SAMPLE_RATE, or sent by staff with an `X-Profile: 1` header,
+# are run under cProfile; stats go to PROFILING_OUTPUT_DIR.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_OUTPUT_DIR = os.path.join(BASE_DIR, 'profiles')
+
+
+# Django REST framework
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+}
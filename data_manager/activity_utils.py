@@ -1,9 +1,226 @@
-from .models import UserActivity
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityRollup, Dataset, MetabaseDashboard, UserActivity
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_ROLLUP_LOOKBACK = timedelta(hours=2)
+
+
+class ActivitySink:
+    """
+    In-process buffer that writes activity events in batches
+
+    Events are put on a bounded queue and a daemon thread inserts them with
+    one ``bulk_create`` whenever ``batch_size`` events are waiting or
+    ``flush_interval`` seconds have passed. When the queue is full, or an
+    insert fails, events are appended to a JSON-lines spill file and
+    replayed on a later flush; without a spill file they are dropped.
+    Whatever is still buffered is written when the interpreter exits.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_queue_size=DEFAULT_QUEUE_SIZE, spill_path=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = Path(spill_path) if spill_path else None
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.spilled = 0
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def put(self, event):
+        """Queue an event without blocking the caller"""
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self._spill([event])
+
+    def _ensure_thread(self):
+        # A forked worker inherits the object but not the thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='activity-sink', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Collect until the batch is full or the flush interval is over
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            close_old_connections()
+
+    def _drain(self, limit=None):
+        events = []
+        while limit is None or len(events) < limit:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def flush(self):
+        """Write every buffered and spilled event now, from the calling thread"""
+        self._write(self._drain())
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _write(self, events):
+        with self._flush_lock:
+            events = self._take_spilled() + events
+            if not events:
+                return
+            try:
+                insert_events(events)
+            except Exception:
+                logger.exception("Could not write %s activity events", len(events))
+                self._spill(events)
+
+    def _spill(self, events):
+        if self.spill_path is None:
+            self.dropped += len(events)
+            logger.warning("Dropped %s activity event(s)", len(events))
+            return
+        with self._spill_lock:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as fh:
+                for event in events:
+                    fh.write(json.dumps(event, cls=DjangoJSONEncoder) + '\n')
+            self.spilled += len(events)
+
+    def _take_spilled(self):
+        """Read and remove the spill file; another process may own it too"""
+        if self.spill_path is None or not self.spill_path.exists():
+            return []
+        replay_path = self.spill_path.with_name(f"{self.spill_path.name}.{os.getpid()}.replay")
+        with self._spill_lock:
+            try:
+                os.replace(self.spill_path, replay_path)
+            except FileNotFoundError:
+                return []
+        events = []
+        with open(replay_path, encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                event['timestamp'] = parse_datetime(event['timestamp'])
+                events.append(event)
+        replay_path.unlink()
+        return events
+
+
+def insert_events(events):
+    """
+    Insert activity events with a single bulk INSERT
+
+    Events whose user has been deleted in the meantime are skipped, and
+    references to deleted datasets or dashboards are cleared, matching the
+    foreign keys' on_delete behaviour.
+    """
+    dataset_ids = {event['dataset_id'] for event in events if event['dataset_id']}
+    dashboard_ids = {event['dashboard_id'] for event in events if event['dashboard_id']}
+    user_ids = {event['user_id'] for event in events}
+    existing_datasets = set(Dataset.objects.filter(pk__in=dataset_ids).values_list('pk', flat=True))
+    existing_dashboards = set(
+        MetabaseDashboard.objects.filter(pk__in=dashboard_ids).values_list('pk', flat=True)
+    )
+    existing_users = set(
+        get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True)
+    )
+
+    UserActivity.objects.bulk_create([
+        UserActivity(
+            user_id=event['user_id'],
+            action=event['action'],
+            dataset_id=event['dataset_id'] if event['dataset_id'] in existing_datasets else None,
+            dashboard_id=event['dashboard_id'] if event['dashboard_id'] in existing_dashboards else None,
+            details=event['details'],
+            timestamp=event['timestamp'],
+        )
+        for event in events if event['user_id'] in existing_users
+    ], batch_size=500)
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_activity_sink():
+    """The process-wide ActivitySink, created from settings on first use"""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = ActivitySink(
+                batch_size=getattr(settings, 'ACTIVITY_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                flush_interval=getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                max_queue_size=getattr(settings, 'ACTIVITY_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+                spill_path=getattr(settings, 'ACTIVITY_SPILL_FILE', None),
+            )
+            atexit.register(_sink.shutdown)
+        return _sink
+
+
+def flush_activity():
+    """Write all buffered activity now, e.g. before reading it back in tests"""
+    if _sink is not None:
+        _sink.flush()
+
 
 def track_activity(user, action, dataset=None, dashboard=None, **kwargs):
     """
     Record user activity
-    
+
+    With ``ACTIVITY_LOG_ASYNC`` enabled the event is handed to the
+    background sink and written later in a batch; otherwise it is inserted
+    immediately.
+
     Args:
         user: User performing the action
         action: String from UserActivity.ACTION_CHOICES
@@ -11,10 +228,240 @@ def track_activity(user, action, dataset=None, dashboard=None, **kwargs):
         dashboard: Optional MetabaseDashboard instance
         **kwargs: Additional details to store in the JSON field
     """
-    UserActivity.objects.create(
+    if not getattr(settings, 'ACTIVITY_LOG_ASYNC', False):
+        UserActivity.objects.create(
+            user=user,
+            action=action,
+            dataset=dataset,
+            dashboard=dashboard,
+            details=kwargs
+        )
+        return
+
+    get_activity_sink().put({
+        'user_id': user.pk,
+        'action': action,
+        'dataset_id': dataset.pk if dataset else None,
+        'dashboard_id': dashboard.pk if dashboard else None,
+        'details': kwargs,
+        'timestamp': timezone.now(),
+    })
+
+
+async def atrack_activity(user, action, dataset=None, dashboard=None, **kwargs):
+    """Async version of track_activity(), for async views"""
+    if getattr(settings, 'ACTIVITY_LOG_ASYNC', False):
+        # Only queues the event, without touching the database
+        track_activity(user, action, dataset=dataset, dashboard=dashboard, **kwargs)
+        return
+    await UserActivity.objects.acreate(
         user=user,
         action=action,
         dataset=dataset,
         dashboard=dashboard,
         details=kwargs
-    )
\ No newline at end of file
+    )
+
+
+def _rollup_rows(period, groups, last_activity_id):
+    return [
+        ActivityRollup(period=period, bucket_start=row['bucket'], user_id=row['user_id'], action=row['action'],
+                       dataset_id=row['dataset_id'], count=row['total'], last_activity_id=last_activity_id)
+        for row in groups
+    ]
+
+
+def _merge_late_events(late, day_start, last_activity_id):
+    """
+    Add events written after their bucket was rolled up to the existing rollups
+
+    Their buckets are not recomputed from the raw rows, because the rows
+    counted earlier may have been archived since. Days from ``day_start`` on
+    are re-summed from the hourly rollups by the caller.
+    """
+    merged = 0
+    for period, trunc in (('HOUR', TruncHour), ('DAY', TruncDay)):
+        groups = list(
+            late.annotate(bucket=trunc('timestamp'))
+            .values('bucket', 'user_id', 'action', 'dataset_id')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        if period == 'DAY':
+            groups = [row for row in groups if row['bucket'] < day_start]
+        if not groups:
+            continue
+        existing = {
+            (rollup.bucket_start, rollup.user_id, rollup.action, rollup.dataset_id): rollup
+            for rollup in ActivityRollup.objects.filter(period=period,
+                                                        bucket_start__in={row['bucket'] for row in groups})
+        }
+        updated, created = [], []
+        for row in groups:
+            rollup = existing.get((row['bucket'], row['user_id'], row['action'], row['dataset_id']))
+            if rollup is None:
+                created.extend(_rollup_rows(period, [row], last_activity_id))
+            else:
+                rollup.count += row['total']
+                rollup.last_activity_id = last_activity_id
+                updated.append(rollup)
+        ActivityRollup.objects.bulk_update(updated, ['count', 'last_activity_id'], batch_size=500)
+        ActivityRollup.objects.bulk_create(created, batch_size=500)
+        if period == 'HOUR':
+            merged = len(updated) + len(created)
+    return merged
+
+
+def rollup_activity(lookback=DEFAULT_ROLLUP_LOOKBACK):
+    """
+    Bring the hourly and daily activity rollups up to date
+
+    Buckets from the newest hourly rollup minus ``lookback`` onwards are
+    recomputed from the raw rows, so events written late by the batching
+    sink are still counted. Events written even later, such as those
+    replayed from the sink's spill file after an outage, are recognised by
+    an id above the highest one rolled up before and added to their older
+    buckets. Daily rollups are summed from the hourly ones and never read
+    the raw table.
+
+    Returns:
+        Number of hourly rollup rows written
+    """
+    last = ActivityRollup.objects.filter(period='HOUR').aggregate(
+        bucket=Max('bucket_start'), activity_id=Max('last_activity_id')
+    )
+    # Rows inserted while this runs are left for the next run
+    last_activity_id = UserActivity.objects.aggregate(last=Max('id'))['last']
+    if last_activity_id is None:
+        return 0
+    events = UserActivity.objects.filter(id__lte=last_activity_id)
+    if last['bucket'] is None:
+        start = events.aggregate(first=Min('timestamp'))['first']
+    else:
+        start = last['bucket'] - lookback
+    start = start.replace(minute=0, second=0, microsecond=0)
+    day_start = start.replace(hour=0)
+
+    hourly = (
+        events.filter(timestamp__gte=start)
+        .annotate(bucket=TruncHour('timestamp'))
+        .values('bucket', 'user_id', 'action', 'dataset_id')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        merged = 0
+        # Rollups written before ids were recorded give no way to tell late rows apart
+        if last['activity_id'] is not None:
+            late = events.filter(id__gt=last['activity_id'], timestamp__lt=start)
+            merged = _merge_late_events(late, day_start, last_activity_id)
+        ActivityRollup.objects.filter(period='HOUR', bucket_start__gte=start).delete()
+        written = ActivityRollup.objects.bulk_create(_rollup_rows('HOUR', hourly, last_activity_id), batch_size=500)
+
+        daily = (
+            ActivityRollup.objects.filter(period='HOUR', bucket_start__gte=day_start)
+            .annotate(bucket=TruncDay('bucket_start'))
+            .values('bucket', 'user_id', 'action', 'dataset_id')
+            .annotate(total=Sum('count'))
+            .order_by()
+        )
+        ActivityRollup.objects.filter(period='DAY', bucket_start__gte=day_start).delete()
+        ActivityRollup.objects.bulk_create(_rollup_rows('DAY', daily, last_activity_id), batch_size=500)
+    return len(written) + merged
+
+
+def archive_activity(before, archive_dir=None, lookback=DEFAULT_ROLLUP_LOOKBACK, batch_size=5000):
+    """
+    Remove raw activity rows older than ``before``
+
+    Rows are only removed once rollup_activity() has counted them and will
+    no longer recompute their bucket, i.e. before the newest hourly rollup
+    minus ``lookback``. Rows written after the last rollup stay, whatever
+    their timestamp, until a rollup has counted them. With an
+    ``archive_dir`` they are first written to a gzipped JSON-lines file
+    there.
+
+    Returns:
+        Number of rows removed
+    """
+    last = ActivityRollup.objects.filter(period='HOUR').aggregate(
+        bucket=Max('bucket_start'), activity_id=Max('last_activity_id')
+    )
+    if last['bucket'] is None or last['activity_id'] is None:
+        return 0
+    before = min(before, last['bucket'] - lookback)
+    old_rows = UserActivity.objects.filter(timestamp__lt=before, id__lte=last['activity_id']).order_by('pk')
+    if not old_rows.exists():
+        return 0
+
+    archive = None
+    if archive_dir:
+        archive_path = Path(archive_dir) / f"activity_before_{before:%Y%m%dT%H%M%S}.jsonl.gz"
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        archive = gzip.open(archive_path, 'at', encoding='utf-8')
+
+    removed = 0
+    try:
+        while True:
+            batch = list(old_rows.values(
+                'id', 'user_id', 'action', 'dataset_id', 'dashboard_id', 'details', 'timestamp'
+            )[:batch_size])
+            if not batch:
+                break
+            if archive:
+                for row in batch:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                archive.flush()
+            UserActivity.objects.filter(pk__in=[row['id'] for row in batch]).delete()
+            removed += len(batch)
+    finally:
+        if archive:
+            archive.close()
+    return removed
+
+
+def prune_hourly_rollups(before):
+    """Delete hourly rollups older than ``before``; daily rollups are kept"""
+    deleted, _ = ActivityRollup.objects.filter(period='HOUR', bucket_start__lt=before).delete()
+    return deleted
+
+
+def get_activity_summary(user, days=30, everyone=False):
+    """
+    Activity figures for the activity dashboard, read from the daily rollups
+
+    Args:
+        user: Requesting user
+        days: Number of days to cover
+        everyone: Summarise all activity instead of the user's datasets
+
+    Returns:
+        dict with per-action daily series, top datasets and the user's own
+        action totals
+    """
+    since = (timezone.now() - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    daily = ActivityRollup.objects.filter(period='DAY', bucket_start__gte=since)
+    scoped = daily if everyone else daily.filter(dataset__owner=user)
+
+    labels = [(since + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+    series = {}
+    for row in scoped.values('bucket_start', 'action').annotate(total=Sum('count')).order_by():
+        values = series.setdefault(row['action'], [0] * days)
+        values[(row['bucket_start'] - since).days] += row['total']
+
+    top_datasets = list(
+        scoped.filter(dataset__isnull=False)
+        .values('dataset_id', 'dataset__name')
+        .annotate(total=Sum('count'))
+        .order_by('-total')[:10]
+    )
+    own_actions = dict(
+        daily.filter(user=user).values_list('action').annotate(total=Sum('count')).order_by()
+    )
+    return {
+        'labels': labels,
+        'series': series,
+        'top_datasets': top_datasets,
+        'own_actions': own_actions,
+        'last_updated': ActivityRollup.objects.filter(period='HOUR').aggregate(last=Max('bucket_start'))['last'],
+    }
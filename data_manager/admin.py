@@ -1,12 +1,55 @@
 from django.contrib import admin
-from .models import Dataset, DataColumn, MetabaseConfig, MetabaseDashboard, UserActivity
+from django.db.models import Count
+from .models import ActivityRollup, Dataset, DataColumn, DatasetSheet, IngestionJob, MetabaseConfig, MetabaseDashboard, UserActivity
 
-admin.site.register(Dataset)
-admin.site.register(DataColumn)
+@admin.register(Dataset)
+class DatasetAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'file_type', 'status', 'is_public', 'upload_date', 'column_count')
+    list_filter = ('status', 'file_type', 'is_public')
+    list_select_related = ('owner',)
+    search_fields = ('name', 'owner__username')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(column_count=Count('columns'))
+
+    @admin.display(ordering='column_count')
+    def column_count(self, obj):
+        return obj.column_count
+
+@admin.register(DataColumn)
+class DataColumnAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'kind', 'data_type', 'position')
+    list_filter = ('kind',)
+    list_select_related = ('dataset',)
+    search_fields = ('name', 'dataset__name')
+    raw_id_fields = ('dataset',)
+
+@admin.register(DatasetSheet)
+class DatasetSheetAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'position', 'row_count')
+    list_select_related = ('dataset',)
+    search_fields = ('name', 'dataset__name')
+    raw_id_fields = ('dataset',)
 
 @admin.register(UserActivity)
 class UserActivityAdmin(admin.ModelAdmin):
     list_display = ('user', 'action', 'dataset', 'dashboard', 'timestamp')
     list_filter = ('action', 'user', 'timestamp')
+    list_select_related = ('user', 'dataset', 'dashboard')
     search_fields = ('user__username', 'dataset__name', 'dashboard__title')
-    date_hierarchy = 'timestamp'
\ No newline at end of file
+    date_hierarchy = 'timestamp'
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ('dataset', 'status', 'progress', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('dataset__name',)
+    readonly_fields = ('started_at', 'finished_at', 'worker', 'error')
+    list_select_related = ('dataset',)
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('period', 'bucket_start', 'user', 'action', 'dataset', 'count')
+    list_filter = ('period', 'action')
+    list_select_related = ('user', 'dataset')
+    date_hierarchy = 'bucket_start'
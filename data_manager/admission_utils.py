@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .schema_utils import get_stored_schema
+
+DEFAULT_MEMORY_BUDGET = 1024 ** 3
+
+# Average in-memory size of a text value (object pointer plus a short str)
+TEXT_VALUE_BYTES = 64
+
+# In-memory size of a loaded file relative to its size on disk, used until
+# its columns and row count are known
+FILE_EXPANSION = {'CSV': 4, 'JSON': 3, 'EXCEL': 12}
+
+# Sampled analyses read at least this many rows, or are not worth running
+MIN_SAMPLE_ROWS = 1000
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job can neither run nor wait any longer for memory or a slot"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Job rejected ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def value_bytes(dtype):
+    """Estimated bytes per value of a column with the given stored dtype"""
+    name = str(dtype)
+    if name.startswith('datetime64'):
+        return 8
+    if name in ('bool', 'boolean'):
+        return 1 if name == 'bool' else 2
+    if name.startswith(('int', 'Int', 'uint', 'UInt', 'float', 'Float')):
+        # Nullable (capitalized) dtypes carry a one-byte mask per value
+        return np.dtype(name.lower()).itemsize + (name[0].isupper())
+    if name == 'category':
+        return 4
+    return TEXT_VALUE_BYTES
+
+
+def estimate_memory(dataset, schema=None, columns=None):
+    """
+    Estimate the memory taken by loading a dataset, or some of its columns
+
+    Uses the row count and stored dtypes recorded at ingestion; before
+    those exist the file size is scaled by FILE_EXPANSION.
+
+    Args:
+        dataset: Dataset instance
+        schema: Optional {column: dtype}; read from the database when omitted
+        columns: Optional subset of the columns that will be loaded
+
+    Returns:
+        Estimated size in bytes
+    """
+    if schema is None:
+        schema = get_stored_schema(dataset)
+    names = list(schema) if columns is None else list(columns)
+    if schema and dataset.row_count is not None:
+        return dataset.row_count * sum(value_bytes(schema.get(name, 'str')) for name in names)
+    size = os.path.getsize(dataset.file.path)
+    share = len(names) / len(schema) if schema and columns is not None else 1
+    return int(size * FILE_EXPANSION.get(dataset.file_type, 4) * share)
+
+
+class Admission:
+    """A granted reservation; ``sample_rows`` is set when the job must run on a sample"""
+
+    def __init__(self, user_id, reserved, sample_rows=None):
+        self.user_id = user_id
+        self.reserved = reserved
+        self.sample_rows = sample_rows
+
+
+class AdmissionController:
+    """
+    Memory budget and per-user concurrency limit for heavy jobs of this process
+
+    Each job reserves its estimated memory before it starts. A job that
+    does not fit waits up to ``ANALYSIS_QUEUE_TIMEOUT`` seconds for running
+    jobs to finish; one that would never fit, or is still waiting when the
+    timeout expires, is degraded to a sample of the rows sized to the
+    memory left. Jobs are only rejected when not even a sample of
+    MIN_SAMPLE_ROWS rows fits, or when the user still has
+    ``ANALYSIS_MAX_PER_USER`` jobs running.
+
+    The budget is per process; size ``ANALYSIS_MEMORY_BUDGET`` for the
+    number of server processes sharing the machine.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._reserved = 0
+        self._running = Counter()
+        self._queued = 0
+        self._stats = Counter()
+
+    def _sample(self, estimate, rows, available):
+        """(sample_rows, reservation) of a sample fitting in ``available`` bytes, or (None, None)"""
+        if not rows or estimate <= 0:
+            return None, None
+        per_row = estimate / rows
+        sample_rows = min(int(available / per_row), getattr(settings, 'ANALYSIS_SAMPLE_ROWS', 100_000), rows)
+        if sample_rows < min(MIN_SAMPLE_ROWS, rows):
+            return None, None
+        return sample_rows, int(sample_rows * per_row)
+
+    def acquire(self, user_id, estimate, rows=None):
+        """
+        Reserve memory and a concurrency slot for a job, waiting if needed
+
+        Args:
+            user_id: Owner of the job, for the per-user limit
+            estimate: Estimated memory of the full job, in bytes
+            rows: Row count of the data, needed to size a sample
+
+        Returns:
+            Admission, to pass to release()
+
+        Raises:
+            AdmissionRejected
+        """
+        budget = getattr(settings, 'ANALYSIS_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET)
+        per_user = getattr(settings, 'ANALYSIS_MAX_PER_USER', 2)
+        timeout = getattr(settings, 'ANALYSIS_QUEUE_TIMEOUT', 10)
+        sample_rows, reservation = None, estimate
+        if budget and estimate > budget:
+            sample_rows, reservation = self._sample(estimate, rows, budget)
+            if sample_rows is None:
+                self._reject('memory', timeout)
+
+        def user_slot_free():
+            return not per_user or self._running[user_id] < per_user
+
+        def fits():
+            return user_slot_free() and (not budget or self._reserved + reservation <= budget)
+
+        with self._condition:
+            if not fits():
+                self._queued += 1
+                self._stats['queued'] += 1
+                self._stats['peak_queue_depth'] = max(self._stats['peak_queue_depth'], self._queued)
+                started = time.monotonic()
+                try:
+                    admitted = self._condition.wait_for(fits, timeout)
+                finally:
+                    self._queued -= 1
+                    self._stats['wait_ms'] += int((time.monotonic() - started) * 1000)
+                if not admitted:
+                    if not user_slot_free():
+                        self._reject('user_limit', timeout)
+                    sample_rows, reservation = self._sample(estimate, rows, budget - self._reserved)
+                    if sample_rows is None:
+                        self._reject('memory', timeout)
+            self._reserved += reservation
+            self._running[user_id] += 1
+            self._stats['admitted'] += 1
+            if sample_rows is not None:
+                self._stats['sampled'] += 1
+        return Admission(user_id, reservation, sample_rows)
+
+    def _reject(self, reason, retry_after):
+        with self._condition:
+            self._stats[f'rejected_{reason}'] += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def release(self, admission):
+        with self._condition:
+            self._reserved -= admission.reserved
+            self._running[admission.user_id] -= 1
+            if not self._running[admission.user_id]:
+                del self._running[admission.user_id]
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        Current load and counters since the process started
+
+        Returns:
+            dict with running, queued, reserved_bytes, budget_bytes and the
+            admitted, queued_total, sampled, rejected_memory,
+            rejected_user_limit, peak_queue_depth and wait_ms counters
+        """
+        with self._condition:
+            return {
+                'running': sum(self._running.values()),
+                'queued': self._queued,
+                'reserved_bytes': self._reserved,
+                'budget_bytes': getattr(settings, 'ANALYSIS_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET),
+                'admitted': self._stats['admitted'],
+                'queued_total': self._stats['queued'],
+                'sampled': self._stats['sampled'],
+                'rejected_memory': self._stats['rejected_memory'],
+                'rejected_user_limit': self._stats['rejected_user_limit'],
+                'peak_queue_depth': self._stats['peak_queue_depth'],
+                'wait_ms': self._stats['wait_ms'],
+            }
+
+    def reset_stats(self):
+        with self._condition:
+            self._stats.clear()
+
+
+controller = AdmissionController()
+
+
+@contextmanager
+def admit(user_id, estimate, rows=None):
+    """Hold an admission of the process-wide controller for the duration of a block"""
+    admission = controller.acquire(user_id, estimate, rows)
+    try:
+        yield admission
+    finally:
+        controller.release(admission)
+
+
+def get_admission_stats():
+    return controller.stats()
+
+
+def reset_admission_stats():
+    controller.reset_stats()
@@ -0,0 +1,184 @@
+import math
+
+import pyarrow.parquet as pq
+from django.conf import settings
+
+from .admission_utils import admit, estimate_memory
+from .cache_utils import get_cached_analysis, set_cached_analysis
+from .chart_utils import build_chart, plan_charts
+from .ingestion_utils import store_column_profiles
+from .models import DataColumn
+from .profile_utils import profile_dataframe
+from .query_utils import get_sample_path, normalize_query, read_sample, referenced_columns, run_query
+from .sketch_utils import Z_99
+from .storage_utils import ensure_cache, load_dataframe
+from .timing_utils import phase
+
+
+def _is_profiled(columns):
+    return bool(columns) and all(column.is_profiled for column in columns)
+
+
+def _has_exact_profiles(columns):
+    return _is_profiled(columns) and not any(column.is_approximate for column in columns)
+
+
+def use_approximation(dataset):
+    """Whether the analysis of a dataset defaults to approximate mode (see build_analysis())"""
+    return dataset.row_count is not None and dataset.row_count >= getattr(settings, 'APPROX_MIN_ROWS', 1_000_000)
+
+
+def _scale_totals(result, spec, factor):
+    """Scale sums and counts computed on a sample up to the whole table"""
+    for item in normalize_query(spec)['aggregates']:
+        if item['func'] in ('sum', 'count'):
+            result[item['as']] = result[item['as']] * factor
+    return result
+
+
+def estimate_analysis_memory(dataset, columns):
+    """
+    Peak memory of build_analysis(), in bytes
+
+    Datasets without exact profiles are loaded whole; otherwise the largest
+    chart query is the peak, as each one reads only the columns it references.
+    """
+    schema = {column.name: column.data_type for column in columns}
+    if not _has_exact_profiles(columns):
+        return estimate_memory(dataset, schema)
+    charts = plan_charts(columns)
+    return max((estimate_memory(dataset, schema, referenced_columns(normalize_query(chart['query'])))
+                for chart in charts.values()), default=0)
+
+
+def build_analysis(dataset, columns=None, sample_rows=None, approximate=False):
+    """
+    Compute everything the analysis page shows for a dataset
+
+    In approximate mode the charts come from the persisted random sample
+    (see query_utils.get_sample_path()), with sums and counts scaled up to
+    the whole table, and the statistics from the stored profiles, which
+    for large datasets are sketch estimates (see sketch_utils). Otherwise
+    sketch-estimated profiles are first recomputed exactly.
+
+    Args:
+        dataset: Dataset instance
+        columns: Optional list of the dataset's DataColumn rows, already fetched
+        sample_rows: Build the charts (and missing profiles, which are then
+            not stored) from an evenly spaced sample of this many rows
+        approximate: Build from the persisted sample and stored profiles only
+
+    Returns:
+        dict with column_types, numeric_columns, categorical_columns, stats,
+        chart_data, sample (None, or the sample and total
+        row counts), approximate (None, or the sample and total row counts
+        and the margin, in percentage points, of shares read off the charts
+        at 99% confidence) and approximate_profiles; only plain Python
+        values, so the result can be cached (see cache_utils.ANALYSIS_VERSION)
+    """
+    # Column types and statistics come from the profiles stored at upload
+    if columns is None:
+        columns = list(dataset.columns.all())
+    sampled_profiles = not _is_profiled(columns) and bool(sample_rows or approximate)
+    if sampled_profiles:
+        with phase('load'):
+            if approximate:
+                df = pq.read_table(get_sample_path(dataset)).to_pandas()
+            else:
+                df = read_sample(pq.ParquetFile(ensure_cache(dataset)), sample_rows).to_pandas()
+        columns = [DataColumn(dataset=dataset, **profile) for profile in profile_dataframe(df)]
+    elif not _has_exact_profiles(columns) and not (sample_rows or approximate):
+        store_column_profiles(dataset, load_dataframe(dataset))
+        columns = list(dataset.columns.all())
+
+    # Basic dataset info
+    column_types = {column.name: column.data_type for column in columns}
+    numeric_columns = [column.name for column in columns if column.kind == 'NUMERIC']
+    categorical_columns = [column.name for column in columns if column.kind == 'CATEGORICAL']
+    profiles = {column.name: column for column in columns}
+
+    # Summary statistics for numeric columns
+    stats = {}
+    for col in numeric_columns:
+        profile = profiles[col]
+        stats[col] = {
+            'mean': profile.mean if profile.count else 0,
+            'min': profile.min_value if profile.count else 0,
+            'max': profile.max_value if profile.count else 0,
+        }
+
+    # Prepare data for charts; each chart is a declarative query that
+    # reads only the columns it references from the columnar cache
+    charts = plan_charts(columns)
+    approximation = None
+    if approximate:
+        sampled = pq.ParquetFile(get_sample_path(dataset)).metadata.num_rows
+        total = dataset.row_count if dataset.row_count is not None else sampled
+        approximation = {'sample_rows': sampled, 'total_rows': total,
+                         'share_margin': 100 * Z_99 * 0.5 / math.sqrt(sampled) if sampled else None}
+    chart_data = {}
+    for name, chart in charts.items():
+        with phase('query'):
+            result = run_query(dataset, chart['query'], sample_rows=sample_rows, use_sample=approximate).to_pandas()
+            if approximation and approximation['sample_rows']:
+                result = _scale_totals(result, chart['query'], total / sampled)
+        with phase('chart'):
+            chart_data[name] = build_chart(chart, result)
+
+    # Distribution chart from the stored quartiles
+    if len(numeric_columns) >= 2:
+        chart_data['distribution'] = {
+            'labels': numeric_columns[:5],  # First 5 numeric columns
+            'stats': {
+                col: {
+                    'min': profiles[col].min_value,
+                    'q1': profiles[col].quantiles.get('0.25'),
+                    'median': profiles[col].quantiles.get('0.5'),
+                    'q3': profiles[col].quantiles.get('0.75'),
+                    'max': profiles[col].max_value
+                } for col in numeric_columns[:5] if profiles[col].count
+            }
+        }
+
+    return {
+        'column_types': column_types,
+        'numeric_columns': numeric_columns,
+        'categorical_columns': categorical_columns,
+        'stats': stats,
+        'chart_data': chart_data,
+        'sample': {'rows': sample_rows, 'total_rows': dataset.row_count} if sample_rows else None,
+        'approximate': approximation,
+        'approximate_profiles': sampled_profiles or any(column.is_approximate for column in columns),
+    }
+
+
+def get_analysis(dataset, user_id=None, exact=False):
+    """
+    Analysis payload of a dataset, served from the result cache when possible
+
+    Datasets with at least ``APPROX_MIN_ROWS`` rows are analyzed in
+    approximate mode (see build_analysis()) unless ``exact`` is set or an
+    exact payload is cached already. Exact payloads are subject to
+    admission control (see admission_utils): building one may wait for
+    memory, run on a sample of the rows, or be rejected. Only exact,
+    unsampled payloads are cached, so the next request tries for the full
+    analysis again.
+
+    Raises:
+        AdmissionRejected: when the server is too busy to build it
+    """
+    with phase('cache'):
+        payload = get_cached_analysis(dataset)
+    if payload is not None:
+        return payload
+    columns = list(dataset.columns.all())
+    if not exact and use_approximation(dataset):
+        with phase('aggregate'):
+            return build_analysis(dataset, columns, approximate=True)
+    with admit(user_id, estimate_analysis_memory(dataset, columns), dataset.row_count) as admission:
+        with phase('aggregate'):
+            payload = build_analysis(dataset, columns, sample_rows=admission.sample_rows)
+    if not payload['sample']:
+        with phase('cache'):
+            set_cached_analysis(dataset, payload)
+    return payload
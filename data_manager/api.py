@@ -0,0 +1,185 @@
+import math
+
+import pandas as pd
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+
+from .activity_utils import track_activity
+from .admission_utils import get_admission_stats
+from .cache_utils import get_cache_stats
+from .metabase_utils import get_embed_urls
+from .models import Dataset, MetabaseConfig
+from .query_utils import QueryError, normalize_query, parse_filter_param, read_rows, run_query
+from .search_utils import search_datasets
+from .timing_utils import phase
+
+MAX_QUERY_ROWS = 10000
+
+
+def get_readable_dataset(request, pk):
+    """Fetch a dataset the requesting user may read, or raise 404/403"""
+    dataset = get_object_or_404(Dataset, pk=pk)
+    if dataset.owner_id != request.user.id and not dataset.is_public:
+        raise PermissionDenied("You don't have permission to view this dataset.")
+    return dataset
+
+
+def _json_safe(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dataset_rows(request, pk):
+    """
+    One page of dataset rows
+
+    Query parameters:
+        offset, limit: Page window (limit is capped at 1000)
+        columns: Comma-separated projection
+        sort: Column to order by, prefixed with '-' for descending
+        filter: Repeatable ``column:op:value`` (ops: eq, ne, lt, lte, gt, gte,
+            in, contains, isnull, notnull)
+        count: '1' to also count matching rows when filtering
+        sheet: Worksheet position of an Excel dataset (default 0)
+    """
+    dataset = get_readable_dataset(request, pk)
+    if dataset.status != 'READY':
+        return Response({'error': "This dataset is still being processed."}, status=status.HTTP_409_CONFLICT)
+
+    params = request.query_params
+    sort = params.get('sort') or None
+    descending = bool(sort and sort.startswith('-'))
+    columns = [column for column in params.get('columns', '').split(',') if column]
+    try:
+        filters = [parse_filter_param(param) for param in params.getlist('filter')]
+        with phase('query'):
+            page = read_rows(
+                dataset,
+                offset=int(params.get('offset', 0)),
+                limit=int(params.get('limit', 100)),
+                columns=columns or None,
+                sort=sort.lstrip('-') if sort else None,
+                descending=descending,
+                filters=filters,
+                with_total=params.get('count') == '1',
+                sheet=int(params.get('sheet', 0)),
+            )
+    except (QueryError, ValueError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    page['rows'] = [[_json_safe(value) for value in row] for row in page['rows']]
+    return Response(page)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def dataset_query(request, pk):
+    """
+    Run a declarative aggregation query (see query_utils.normalize_query)
+
+    Results are capped at MAX_QUERY_ROWS rows; ``truncated`` tells the
+    client when the cap was hit.
+    """
+    dataset = get_readable_dataset(request, pk)
+    if dataset.status != 'READY':
+        return Response({'error': "This dataset is still being processed."}, status=status.HTTP_409_CONFLICT)
+
+    try:
+        spec = normalize_query(request.data)
+        if spec['limit'] is None or spec['limit'] > MAX_QUERY_ROWS:
+            spec['limit'] = MAX_QUERY_ROWS + 1
+        with phase('query'):
+            result = run_query(dataset, spec, sheet=int(request.query_params.get('sheet', 0)))
+    except (QueryError, ValueError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    truncated = result.num_rows > MAX_QUERY_ROWS
+    result = result.slice(0, MAX_QUERY_ROWS)
+    frame = result.to_pandas()
+    for column in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = frame[column].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+    return Response({
+        'columns': list(frame.columns),
+        'rows': [[_json_safe(value) for value in row] for row in rows],
+        'truncated': truncated,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dataset_sheets(request, pk):
+    """Worksheets of an Excel dataset; pass a position as ``sheet`` to the rows and query endpoints"""
+    dataset = get_readable_dataset(request, pk)
+    return Response({'sheets': [
+        {'position': sheet.position, 'name': sheet.name, 'row_count': sheet.row_count, 'columns': sheet.columns}
+        for sheet in dataset.sheets.all()
+    ]})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dataset_dashboards(request, pk):
+    """Every dashboard of a dataset with its signed embed URL, signed in one call"""
+    dataset = get_readable_dataset(request, pk)
+    dashboards = list(dataset.dashboards.all())
+    try:
+        urls = get_embed_urls(dashboards)
+    except MetabaseConfig.DoesNotExist:
+        return Response({'error': "Metabase integration is not configured."},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({'dashboards': [
+        {'id': dashboard.pk, 'dashboard_id': dashboard.dashboard_id, 'title': dashboard.title,
+         'embed_url': urls[dashboard.pk]}
+        for dashboard in dashboards
+    ]})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search(request):
+    """
+    Datasets the user may read that match a search, best match first
+
+    Query parameters:
+        q: Words matched, as prefixes, against dataset names, descriptions,
+            column names and frequent column values
+        limit: Maximum number of results (default 20, at most 50)
+    """
+    text = request.query_params.get('q', '')
+    try:
+        limit = int(request.query_params.get('limit', 20))
+    except ValueError:
+        return Response({'error': "'limit' must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+    with phase('search'):
+        results = search_datasets(request.user, text, limit=limit)
+    if text.strip():
+        track_activity(request.user, 'SEARCH', query=text[:200], results=len(results))
+    return Response({'results': [
+        {'id': dataset.pk, 'name': dataset.name, 'description': dataset.description,
+         'owner': dataset.owner.username, 'is_public': dataset.is_public, 'status': dataset.status,
+         'score': score}
+        for dataset, score in results
+    ]})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """Analysis cache hit/miss counters of the serving process, for monitoring"""
+    return Response(get_cache_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def admission_stats(request):
+    """Analysis queue depth, memory reservations and rejection counters of the serving process"""
+    return Response(get_admission_stats())
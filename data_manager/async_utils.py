@@ -0,0 +1,112 @@
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import render
+
+# Settings CPU workers need to find dataset files, copied from the parent
+# when the pool starts (spawned workers load settings afresh)
+WORKER_SETTINGS = ('MEDIA_ROOT', 'DATASET_CACHE_DIR', 'JSON_FLATTEN_DEPTH')
+
+_executor = None
+_executor_key = None
+_executor_lock = threading.Lock()
+
+# Templates may still touch the database lazily (request.user, sessions,
+# related managers), which is only allowed from synchronous code.
+arender = sync_to_async(render)
+
+
+async def aget_user(request):
+    """
+    The requesting user, loaded without blocking
+
+    ``request.user`` is replaced with the loaded user, so templates and
+    other sync code do not query it a second time.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+def _init_worker(overrides):
+    django.setup()
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def get_cpu_executor():
+    """
+    The process pool async views hand CPU-bound work to
+
+    Sized by ``ASYNC_CPU_WORKERS``; returns None when that is 0, in which
+    case the work runs in a thread instead.
+    """
+    global _executor, _executor_key
+    workers = getattr(settings, 'ASYNC_CPU_WORKERS', 2)
+    if not workers:
+        return None
+    overrides = {name: getattr(settings, name) for name in WORKER_SETTINGS if hasattr(settings, name)}
+    key = (workers, sorted(overrides.items()))
+    with _executor_lock:
+        if _executor is None or _executor_key != key:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            # Spawned workers start clean instead of inheriting the event loop and threads
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(overrides,))
+            _executor_key = key
+        return _executor
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """
+    Run a CPU-bound function without blocking the event loop
+
+    The call runs in a worker of the bounded process pool, so pandas work
+    for one request neither stalls other requests nor competes with them
+    for the GIL. ``func`` and its arguments must be picklable, and it must
+    not use the database: workers have their own connections and only see
+    the WORKER_SETTINGS of the parent.
+    """
+    call = functools.partial(func, *args, **kwargs)
+    executor = get_cpu_executor()
+    if executor is None:
+        return await sync_to_async(call, thread_sensitive=False)()
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def aiterate(iterator):
+    """
+    Consume a blocking iterator from async code
+
+    Each item is produced in a worker thread, so file reads and encoding
+    never block the event loop, and only one item is in memory at a time.
+    """
+    next_item = sync_to_async(next, thread_sensitive=False)
+    done = object()
+    try:
+        while True:
+            item = await next_item(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=False)()
+
+
+def streaming_body(request, iterator):
+    """
+    Body iterator for a StreamingHttpResponse that the server streams unbuffered
+
+    ASGI servers need an async iterator and WSGI servers a sync one; Django
+    buffers the whole body in memory to convert between the two.
+    """
+    return aiterate(iterator) if isinstance(request, ASGIRequest) else iterator
@@ -0,0 +1,278 @@
+import asyncio
+import io
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+GENERATOR_CHUNK_ROWS = 100_000
+EXCEL_MAX_ROWS = 1_048_575  # one header row below the sheet limit
+EXCEL_MAX_COLUMNS = 16_384
+FILE_EXTENSIONS = {'CSV': 'csv', 'EXCEL': 'xlsx', 'JSON': 'jsonl'}
+
+
+def synthetic_frame(rows, columns, seed=0, start=0):
+    """
+    A DataFrame mixing the column kinds real uploads have
+
+    Columns cycle through float, integer, categorical, datetime and a float
+    column with missing values, so profiling and chart planning exercise
+    every code path.
+
+    Args:
+        rows: Number of rows
+        columns: Number of columns
+        seed: Random seed; the same seed and ``start`` give the same rows
+        start: Index of the first row, for generating a file in chunks
+    """
+    rng = np.random.default_rng(seed + start)
+    data = {}
+    for index in range(columns):
+        kind = index % 5
+        name = f"col_{index}"
+        if kind == 0:
+            data[name] = rng.normal(100, 25, rows).round(3)
+        elif kind == 1:
+            data[name] = rng.integers(0, 10_000, rows)
+        elif kind == 2:
+            data[name] = pd.Categorical.from_codes(
+                rng.integers(0, 50, rows), [f"category_{i}" for i in range(50)]
+            )
+        elif kind == 3:
+            data[name] = pd.Timestamp('2020-01-01') + pd.to_timedelta(start + np.arange(rows), unit='min')
+        else:
+            values = rng.random(rows)
+            values[rng.random(rows) < 0.1] = np.nan
+            data[name] = values
+    return pd.DataFrame(data)
+
+
+def write_synthetic_file(path, file_type, rows, columns, seed=0):
+    """
+    Write a synthetic upload of the given shape without holding it in memory
+
+    CSV and JSON-lines files are written in chunks of GENERATOR_CHUNK_ROWS.
+    Excel files are capped at the sheet limits.
+
+    Returns:
+        (rows, columns) actually written
+    """
+    if file_type == 'EXCEL':
+        rows, columns = min(rows, EXCEL_MAX_ROWS), min(columns, EXCEL_MAX_COLUMNS)
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append([f"col_{index}" for index in range(columns)])
+        for start in range(0, rows, GENERATOR_CHUNK_ROWS):
+            chunk = synthetic_frame(min(GENERATOR_CHUNK_ROWS, rows - start), columns, seed, start)
+            for column in chunk.select_dtypes(include=['category']).columns:
+                chunk[column] = chunk[column].astype(str)
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False):
+                sheet.append(list(row))
+        workbook.save(path)
+        return rows, columns
+
+    with open(path, 'w', encoding='utf-8', newline='') as fh:
+        for start in range(0, rows, GENERATOR_CHUNK_ROWS):
+            chunk = synthetic_frame(min(GENERATOR_CHUNK_ROWS, rows - start), columns, seed, start)
+            if file_type == 'JSON':
+                chunk.to_json(fh, orient='records', lines=True, date_format='iso')
+            else:
+                chunk.to_csv(fh, index=False, header=start == 0)
+    return rows, columns
+
+
+def measure(func, repeat=3, setup=None):
+    """
+    Run ``func`` several times and summarise its cost
+
+    Each run is timed on its own; peak Python heap use comes from
+    tracemalloc (NumPy and Arrow buffers report to it as well) and is
+    measured on an extra, untimed run so tracing does not skew latency.
+
+    Args:
+        func: Callable to benchmark
+        repeat: Number of timed runs
+        setup: Optional callable run before every run, outside the timing
+
+    Returns:
+        dict with median/min/max seconds, peak_mb and queries per run
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        queries = len(context.captured_queries)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'max_s': max(timings),
+        'peak_mb': peak / (1024 * 1024),
+        'queries': queries,
+    }
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """
+    Compare benchmark results with a stored baseline
+
+    A case regresses when its median time or peak memory grows by more than
+    ``tolerance`` (a fraction), or when it runs more queries.
+
+    Returns:
+        List of dicts describing each regression
+    """
+    regressions = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if not previous:
+            continue
+        for metric in ('median_s', 'peak_mb'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append({
+                    'case': case, 'metric': metric,
+                    'baseline': previous[metric], 'current': current[metric],
+                    'change': current[metric] / previous[metric] - 1,
+                })
+        if current['queries'] > previous['queries']:
+            regressions.append({
+                'case': case, 'metric': 'queries',
+                'baseline': previous['queries'], 'current': current['queries'],
+                'change': current['queries'] - previous['queries'],
+            })
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)['results']
+
+
+def save_results(path, results, metadata=None):
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump({'metadata': metadata or {}, 'results': results}, fh, indent=2, sort_keys=True)
+
+
+def _summarize_load(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+    }
+
+
+def wsgi_load(application, paths, total, concurrency, cookie='', host='testserver'):
+    """
+    Drive a WSGI application with ``concurrency`` threads, like a threaded WSGI server
+
+    Requests cycle through ``paths``; no network is involved, so the
+    numbers measure the request path itself.
+
+    Returns:
+        dict with requests, errors, elapsed_s, throughput_rps, p50_ms, p95_ms
+    """
+    def call(index):
+        path, _, query = paths[index % len(paths)].partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': host, 'HTTP_COOKIE': cookie, 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+            'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        status = []
+        start = time.perf_counter()
+        result = application(environ, lambda code, headers, exc_info=None: status.append(int(code[:3])))
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return time.perf_counter() - start, status[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    return _summarize_load([latency for latency, _ in results], [status for _, status in results], elapsed)
+
+
+def asgi_load(application, paths, total, concurrency, cookie='', host='testserver'):
+    """
+    Drive an ASGI application with ``concurrency`` concurrent requests on one event loop
+
+    Returns:
+        The same summary as wsgi_load()
+    """
+    async def call(index):
+        path, _, query = paths[index % len(paths)].partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0), 'server': (host, 80),
+        }
+        finished = asyncio.Event()
+        received = []
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        status = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                finished.set()
+
+        start = time.perf_counter()
+        await application(scope, receive, send)
+        return time.perf_counter() - start, status[0]
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                return await call(index)
+
+        return await asyncio.gather(*(limited(index) for index in range(total)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return _summarize_load([latency for latency, _ in results], [status for _, status in results], elapsed)
@@ -0,0 +1,147 @@
+import logging
+import pickle
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.db.models import F
+
+from .storage_utils import refresh_checksum
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the shape or content of the analysis payload built by
+# analysis_utils.build_analysis() changes, so older payloads are ignored
+ANALYSIS_VERSION = 6
+
+MEMORY_CACHE_ALIAS = 'analysis_memory'
+FILE_CACHE_ALIAS = 'analysis'
+DEFAULT_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def get_cache_stats():
+    """
+    Hit/miss counters of the analysis cache for this process
+
+    Returns:
+        dict with memory_hits, file_hits, misses, sets, skipped (payloads
+        over the size cap), invalidations and the derived hit_ratio
+    """
+    with _stats_lock:
+        stats = {key: _stats[key] for key in
+                 ('memory_hits', 'file_hits', 'misses', 'sets', 'skipped', 'invalidations')}
+    lookups = stats['memory_hits'] + stats['file_hits'] + stats['misses']
+    stats['hit_ratio'] = (stats['memory_hits'] + stats['file_hits']) / lookups if lookups else None
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _get_tiers():
+    """Configured cache tiers, fastest first; missing aliases are skipped"""
+    tiers = []
+    for alias in (MEMORY_CACHE_ALIAS, FILE_CACHE_ALIAS):
+        try:
+            tiers.append((alias, caches[alias]))
+        except InvalidCacheBackendError:
+            continue
+    return tiers
+
+
+def analysis_cache_key(dataset, version=ANALYSIS_VERSION):
+    """
+    Cache key for a dataset's analysis payload
+
+    The file checksum is part of the key, so a changed upload can never be
+    served a payload computed from its previous content. So is the dataset's
+    analysis generation, which invalidate_analysis() bumps in the database:
+    payloads cached by other processes become unreachable as soon as they
+    next load the dataset.
+    """
+    if not dataset.file_checksum:
+        refresh_checksum(dataset)
+    return f"analysis:{dataset.pk}:{dataset.file_checksum}:g{dataset.analysis_generation}:v{version}"
+
+
+def get_cached_analysis(dataset):
+    """
+    Look a dataset's analysis payload up in the memory tier, then the file tier
+
+    File-tier hits are copied into the memory tier so the next request is
+    served without touching the disk. The memory tier evicts the least
+    recently used entries, but Django's file-based cache culls a random
+    CULL_FREQUENCY share of its entries once MAX_ENTRIES is reached, so
+    the file tier holds recent payloads only approximately.
+
+    Returns:
+        The cached payload, or None on a miss
+    """
+    key = analysis_cache_key(dataset)
+    tiers = _get_tiers()
+    for position, (alias, cache) in enumerate(tiers):
+        payload = cache.get(key)
+        if payload is None:
+            continue
+        _count('memory_hits' if alias == MEMORY_CACHE_ALIAS else 'file_hits')
+        for _, faster in tiers[:position]:
+            faster.set(key, payload)
+        return payload
+    _count('misses')
+    return None
+
+
+def set_cached_analysis(dataset, payload):
+    """
+    Store an analysis payload in every tier
+
+    Payloads larger than ``ANALYSIS_CACHE_MAX_ENTRY_BYTES`` once pickled are
+    not cached, so a single huge dataset cannot evict everything else.
+
+    Returns:
+        True if the payload was cached
+    """
+    max_bytes = getattr(settings, 'ANALYSIS_CACHE_MAX_ENTRY_BYTES', DEFAULT_MAX_ENTRY_BYTES)
+    size = len(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+    if max_bytes and size > max_bytes:
+        logger.info("Analysis of dataset %s is %s bytes, over the cache limit", dataset.pk, size)
+        _count('skipped')
+        return False
+
+    key = analysis_cache_key(dataset)
+    for _, cache in _get_tiers():
+        cache.set(key, payload)
+    _count('sets')
+    return True
+
+
+def invalidate_analysis(dataset):
+    """
+    Expire the cached analysis payload of a dataset in every process
+
+    The dataset's analysis generation is incremented in the database, which
+    changes its cache key everywhere. The old entry is also deleted from
+    the tiers this process can reach, to free the space right away; other
+    processes' memory tiers age it out.
+    """
+    if not dataset.file_checksum:
+        # Nothing can have been cached under a key without a checksum
+        return
+    key = analysis_cache_key(dataset)
+    for _, cache in _get_tiers():
+        cache.delete(key)
+    type(dataset).objects.filter(pk=dataset.pk).update(analysis_generation=F('analysis_generation') + 1)
+    dataset.analysis_generation += 1
+    _count('invalidations')
@@ -0,0 +1,248 @@
+import math
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+DEFAULT_MAX_POINTS = 2000
+
+
+def get_point_budget(max_points=None):
+    """Maximum number of points a single chart may send to the browser"""
+    if max_points is not None:
+        return max_points
+    return getattr(settings, 'CHART_MAX_POINTS', DEFAULT_MAX_POINTS)
+
+
+def json_safe(values):
+    """
+    Chart values as a plain list that serializes to valid JSON
+
+    Missing values, NaN (e.g. the sum of an all-null group) and infinities
+    become None, which charts show as gaps.
+    """
+    return [None if pd.isna(value) or (isinstance(value, float) and math.isinf(value)) else value
+            for value in values]
+
+
+def _is_finite(series):
+    """Mask of the values of a numeric column that can be plotted"""
+    return np.isfinite(series.to_numpy(dtype=float, na_value=np.nan))
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling for ordered series
+
+    Args:
+        x: 1-D array of ascending x values
+        y: 1-D array of y values, same length as x
+        threshold: Number of points to keep
+
+    Returns:
+        Sorted array of indices into x/y
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket edges for the n - 2 interior points; the last edge is n - 1
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(int) + 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def stratified_indices(values, budget, bins=20, seed=0):
+    """
+    Sample row positions evenly across quantile bins of ``values``
+
+    Keeps the rows holding the minimum and maximum so the chart's axis range
+    is preserved, then draws the remaining budget proportionally per bin.
+
+    Returns:
+        Sorted array of positional indices
+    """
+    n = len(values)
+    if n <= budget:
+        return np.arange(n)
+
+    rng = np.random.default_rng(seed)
+    values = np.asarray(values, dtype=float)
+    extremes = np.unique([np.argmin(values), np.argmax(values)])
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+    strata = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, max(len(edges) - 2, 0))
+
+    remaining = budget - len(extremes)
+    counts = np.bincount(strata)
+    quotas = np.floor(counts / n * remaining).astype(int)
+    picked = [extremes]
+    for stratum in np.nonzero(quotas)[0]:
+        members = np.flatnonzero(strata == stratum)
+        picked.append(rng.choice(members, size=min(quotas[stratum], len(members)), replace=False))
+    return np.unique(np.concatenate(picked))
+
+
+def build_scatter(df, x_col, y_col, label_col=None, max_points=None):
+    """
+    Build a scatter payload, downsampled to the point budget
+
+    Returns:
+        dict with the points ({x, y} plus ``label`` when label_col is given)
+        under ``data`` and the total point count
+    """
+    columns = [x_col, y_col] + ([label_col] if label_col else [])
+    points = df.loc[_is_finite(df[x_col]) & _is_finite(df[y_col]), columns]
+    total = len(points)
+
+    budget = get_point_budget(max_points)
+    if total > budget:
+        points = points.iloc[stratified_indices(points[x_col].to_numpy(dtype=float), budget)]
+
+    points = points.rename(columns={x_col: 'x', y_col: 'y', **({label_col: 'label'} if label_col else {})})
+    points['x'] = points['x'].astype(float)
+    points['y'] = points['y'].astype(float)
+    if label_col:
+        points['label'] = points['label'].astype(object).where(points['label'].notna(), '').astype(str)
+
+    return {
+        'data': points.to_dict('records'),
+        'total_points': total,
+        'sampled': total > budget,
+    }
+
+
+def build_line(df, x_col, y_col, max_points=None):
+    """Build a line payload for an ordered series, downsampled with LTTB"""
+    series = df.loc[df[x_col].notna() & _is_finite(df[y_col]), [x_col, y_col]].sort_values(x_col)
+    total = len(series)
+    budget = get_point_budget(max_points)
+    if total > budget:
+        x_values = series[x_col]
+        if pd.api.types.is_datetime64_any_dtype(x_values):
+            x_values = x_values.astype('int64')
+        series = series.iloc[lttb_indices(x_values.to_numpy(dtype=float), series[y_col].to_numpy(dtype=float), budget)]
+
+    labels = series[x_col]
+    if pd.api.types.is_datetime64_any_dtype(labels):
+        labels = labels.dt.strftime('%Y-%m-%d %H:%M')
+    return {
+        'labels': labels.tolist(),
+        'values': series[y_col].astype(float).tolist(),
+        'total_points': total,
+        'sampled': total > budget,
+    }
+
+
+def build_bar(df, label_col, value_col):
+    """Bar/pie payload from an already aggregated and ordered result"""
+    return {
+        'labels': json_safe(df[label_col].tolist()),
+        'values': json_safe(df[value_col].tolist()),
+    }
+
+
+def plan_charts(columns):
+    """
+    Choose the charts for a dataset and the query that feeds each one
+
+    Charts are picked from the column kinds alone: the first numeric column
+    is the measure, the first two categorical columns give a top-10 bar and
+    a top-10 breakdown, the first two numeric columns a scatter and the
+    first date column a daily series.
+
+    Args:
+        columns: DataColumn instances (name and kind are used)
+
+    Returns:
+        dict mapping a chart name to a dict with the chart ``type``, its
+        query spec and any extra payload fields
+    """
+    numeric = [column.name for column in columns if column.kind == 'NUMERIC']
+    categorical = [column.name for column in columns if column.kind == 'CATEGORICAL']
+    datetimes = [column.name for column in columns if column.kind == 'DATETIME']
+    charts = {}
+
+    # Top 10 categories of the first categorical column by the first
+    # numeric column
+    if categorical and numeric:
+        category_col, value_col = categorical[0], numeric[0]
+        charts['bar'] = {
+            'type': 'bar',
+            'query': {'group_by': [category_col], 'order_by': ['-value'], 'limit': 10,
+                      'aggregates': [{'column': value_col, 'func': 'sum', 'as': 'value'}],
+                      'filters': [{'column': category_col, 'op': 'notnull'}]},
+            'label': category_col, 'value': 'value',
+            'extra': {'category_col': category_col, 'value_col': value_col},
+        }
+
+    # Share of the same measure among the top 10 values of the second
+    # categorical column, which may be as distinct as an id column
+    if len(categorical) >= 2 and numeric:
+        category_col, value_col = categorical[1], numeric[0]
+        charts['breakdown'] = {
+            'type': 'bar',
+            'query': {'group_by': [category_col], 'order_by': ['-value'], 'limit': 10,
+                      'aggregates': [{'column': value_col, 'func': 'sum', 'as': 'value'}],
+                      'filters': [{'column': category_col, 'op': 'notnull'}]},
+            'label': category_col, 'value': 'value',
+            'extra': {'category_col': category_col, 'value_col': value_col},
+        }
+
+    # Relationship between the first two numeric columns, each point
+    # labelled by the first categorical column
+    if len(numeric) >= 2:
+        x_col, y_col = numeric[:2]
+        label_col = categorical[0] if categorical else None
+        charts['scatter'] = {
+            'type': 'scatter',
+            'query': {'columns': [x_col, y_col] + ([label_col] if label_col else [])},
+            'x': x_col, 'y': y_col, 'point_label': label_col,
+            'extra': {'x_label': x_col, 'y_label': y_col},
+        }
+
+    # Daily totals over the first date column
+    if datetimes and numeric:
+        date_col, value_col = datetimes[0], numeric[0]
+        charts['timeseries'] = {
+            'type': 'line',
+            'query': {'time_bucket': {'column': date_col, 'unit': 'day', 'as': 'bucket'},
+                      'aggregates': [{'column': value_col, 'func': 'sum', 'as': 'value'}],
+                      'order_by': ['bucket']},
+            'x': 'bucket', 'y': 'value',
+            'extra': {'date_col': date_col, 'value_col': value_col},
+        }
+    return charts
+
+
+def build_chart(chart, df, max_points=None):
+    """Turn a planned chart's query result into its template payload"""
+    if chart['type'] == 'scatter':
+        payload = build_scatter(df, chart['x'], chart['y'], label_col=chart.get('point_label'),
+                                max_points=max_points)
+    elif chart['type'] == 'line':
+        payload = build_line(df, chart['x'], chart['y'], max_points=max_points)
+    else:
+        payload = build_bar(df, chart['label'], chart['value'])
+    payload.update(chart.get('extra', {}))
+    return payload
+
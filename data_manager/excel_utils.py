@@ -0,0 +1,110 @@
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Rows collected from the sheet before they are turned into a DataFrame
+# chunk; bounds the number of Python cell objects alive at any time.
+SHEET_BATCH_ROWS = 10_000
+
+
+def is_streamable_excel(path):
+    """Whether an Excel upload can be read row by row with openpyxl"""
+    return Path(path).suffix.lower() in ('.xlsx', '.xlsm', '.xltx', '.xltm')
+
+
+def list_sheets(path):
+    """Names of the worksheets of a workbook, in workbook order"""
+    if not is_streamable_excel(path):
+        return pd.ExcelFile(path).sheet_names
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def _column_names(header, width):
+    """Header cells as unique column names, named like pandas.read_excel() does"""
+    names = []
+    seen = {}
+    for index in range(width):
+        value = header[index] if index < len(header) else None
+        name = f"Unnamed: {index}" if value is None or value == '' else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def iter_sheet_batches(path, sheet=0, batch_rows=None):
+    """
+    Read one worksheet as a stream of DataFrames without loading the workbook
+
+    .xlsx files are streamed in openpyxl's read-only mode, so memory holds
+    one batch of ``batch_rows`` rows rather than the workbook's cell tree or
+    the whole sheet. Blank rows are skipped. Columns are named from the
+    header row like pandas.read_excel() does; a batch only has the columns
+    its own rows reach, so later batches may add trailing columns. Legacy
+    .xls files fall back to a single pandas.read_excel() frame.
+
+    Args:
+        path: Path of the workbook
+        sheet: Position of the worksheet
+        batch_rows: Rows per batch, SHEET_BATCH_ROWS by default
+
+    Yields:
+        pandas DataFrames with object dtypes; at least one, empty for a
+        sheet without data rows
+    """
+    if not is_streamable_excel(path):
+        yield pd.read_excel(path, sheet_name=sheet)
+        return
+
+    batch_rows = batch_rows or SHEET_BATCH_ROWS
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[sheet].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        batch = []
+        yielded = False
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                yield _frame(batch, header)
+                yielded = True
+                batch = []
+        if batch or not yielded:
+            yield _frame(batch, header)
+    finally:
+        workbook.close()
+
+
+def _frame(rows, header):
+    width = max([len(header), *map(len, rows)])
+    df = pd.DataFrame.from_records(rows, columns=range(width)) if rows else pd.DataFrame(columns=range(width))
+    df.columns = _column_names(header, width)
+    return df
+
+
+def read_sheet(path, sheet=0, batch_rows=None):
+    """
+    Read one worksheet into a single DataFrame
+
+    Holds the whole sheet in memory; cache building streams the batches of
+    iter_sheet_batches() instead.
+
+    Returns:
+        pandas DataFrame
+    """
+    frames = list(iter_sheet_batches(path, sheet, batch_rows))
+    if len(frames) == 1:
+        return frames[0]
+    # Short rows leave trailing columns missing from some batches
+    names = max((frame.columns for frame in frames), key=len)
+    return pd.concat(frames, ignore_index=True).reindex(columns=names)
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import quote_etag
+from django.utils.text import slugify
+
+try:
+    import zstandard
+except ImportError:  # zstd downloads are offered only when it is installed
+    zstandard = None
+
+from .query_utils import (
+    QueryError, decode_dictionary, filter_expression, get_table_path, iter_filtered_tables, validate_columns,
+)
+
+# Bump when the bytes produced for the same inputs change, so ETags change too
+EXPORT_VERSION = 1
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'jsonl': ('application/x-ndjson', '.jsonl'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+COMPRESSIONS = {
+    'none': (None, ''),
+    'gzip': ('application/gzip', '.gz'),
+    'zstd': ('application/zstd', '.zst'),
+}
+
+# Bytes read from a finished export file per chunk of a response
+READ_CHUNK_BYTES = 256 * 1024
+
+DEFAULT_EXPORT_STORE_MAX_BYTES = 1024 ** 3
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def available_compressions():
+    return [name for name in COMPRESSIONS if name != 'zstd' or zstandard is not None]
+
+
+class _ChunkSink:
+    """Write-only file object collecting what ParquetWriter writes, drained per row group"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _encode_csv(tables, schema):
+    header = True
+    for table in tables:
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(table, sink, write_options=pa_csv.WriteOptions(include_header=header))
+        header = False
+        yield sink.getvalue().to_pybytes()
+    if header:
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(schema.empty_table(), sink)
+        yield sink.getvalue().to_pybytes()
+
+
+def _json_column(values):
+    """A column as plain Python values that json can encode directly"""
+    values = decode_dictionary(values)
+    if pa.types.is_timestamp(values.type):
+        return pc.strftime(values, format='%Y-%m-%dT%H:%M:%S').to_pylist()
+    if pa.types.is_date(values.type) or pa.types.is_decimal(values.type):
+        return pc.cast(values, pa.string()).to_pylist()
+    return values.to_pylist()
+
+
+def _encode_jsonl(tables, schema):
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    for table in tables:
+        if not table.num_rows:
+            continue
+        names = table.column_names
+        rows = zip(*(_json_column(column) for column in table.columns))
+        yield ('\n'.join(encode(dict(zip(names, row))) for row in rows) + '\n').encode()
+
+
+def _encode_parquet(tables, schema):
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for table in tables:
+            if table.num_rows:
+                writer.write_table(table)
+                yield sink.drain()
+    yield sink.drain()
+
+
+ENCODERS = {'csv': _encode_csv, 'jsonl': _encode_jsonl, 'parquet': _encode_parquet}
+
+
+def _compress(chunks, compression):
+    if compression == 'gzip':
+        # gzip container; the header carries no timestamp, so output is reproducible
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        yield from chunks
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class DatasetExport:
+    """
+    One downloadable rendering of a dataset table
+
+    The rows come from the columnar cache one row group at a time and are
+    encoded and compressed as they are read, so memory stays constant
+    whatever the dataset size. Plain downloads are streamed without being
+    stored. HTTP Range requests, which resume a transfer, write the bytes
+    next to the cache file first and are served from it; stored exports
+    are capped by prune_exports(). The ETag identifies the cache file (and
+    so the file content) plus every export option.
+
+    Raises:
+        QueryError: for unknown formats, compressions, columns or filters
+    """
+
+    def __init__(self, dataset, format='csv', compression='none', columns=None, filters=None, sheet=0):
+        if format not in EXPORT_FORMATS:
+            raise QueryError(f"Format must be one of {', '.join(EXPORT_FORMATS)}.")
+        if compression not in available_compressions():
+            raise QueryError(f"Compression must be one of {', '.join(available_compressions())}.")
+        self.format = format
+        self.compression = compression
+        self.filters = filters or []
+        self.source = get_table_path(dataset, sheet)
+        schema = pq.read_schema(self.source)
+        self.columns = list(columns) if columns else schema.names
+        validate_columns(schema, self.columns + [spec['column'] for spec in self.filters])
+        # Rejects values the columns cannot be compared with before streaming starts
+        filter_expression(schema, self.filters)
+        self.schema = pa.schema([schema.field(column) for column in self.columns])
+
+        key = json.dumps([EXPORT_VERSION, self.source.name, format, compression, self.columns, self.filters],
+                         cls=DjangoJSONEncoder)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:20]
+        self.etag = quote_etag(digest)
+
+        content_type, extension = EXPORT_FORMATS[format]
+        compressed_type, compressed_extension = COMPRESSIONS[compression]
+        self.content_type = compressed_type or content_type
+        extension += compressed_extension
+        self.path = self.source.with_name(f"{self.source.stem}.export-{digest}{extension}")
+        name = slugify(dataset.name) or f"dataset-{dataset.pk}"
+        self.filename = f"{name}-sheet{sheet}{extension}" if sheet else f"{name}{extension}"
+
+    def is_stored(self):
+        return self.path.exists()
+
+    def size(self):
+        return self.path.stat().st_size
+
+    def generate(self):
+        """Yield the export's bytes straight from the columnar cache"""
+        tables = iter_filtered_tables(pq.ParquetFile(self.source), self.columns, self.filters)
+        return _compress(ENCODERS[self.format](tables, self.schema), self.compression)
+
+    def stream(self):
+        """
+        Yield the export's bytes while writing them to the export file
+
+        The file only appears once the whole export has been written; a
+        download cut short leaves nothing behind.
+        """
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as fh:
+                for chunk in self.generate():
+                    fh.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self.path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        prune_exports(self.path.parent, keep=self.path)
+
+    def store(self):
+        """Write the export file if it does not exist yet"""
+        if not self.is_stored():
+            for _ in self.stream():
+                pass
+
+    def read(self, start=0, end=None):
+        """Yield bytes ``start`` to ``end`` (inclusive) of the export file"""
+        remaining = (self.size() if end is None else end + 1) - start
+        with open(self.path, 'rb') as fh:
+            # Marks the export as recently used for prune_exports()
+            os.utime(fh.fileno())
+            fh.seek(start)
+            while remaining > 0:
+                chunk = fh.read(min(READ_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def prune_exports(directory, keep=None):
+    """
+    Delete the least recently used stored exports over EXPORT_STORE_MAX_BYTES
+
+    Exports are reproducible, so an evicted one is simply written again by
+    the next Range request for it.
+
+    Args:
+        directory: Cache directory holding the export files
+        keep: Path of an export that must stay, e.g. the one just written
+
+    Returns:
+        Number of files deleted
+    """
+    limit = getattr(settings, 'EXPORT_STORE_MAX_BYTES', DEFAULT_EXPORT_STORE_MAX_BYTES)
+    exports = []
+    for path in directory.glob('*.export-*'):
+        if path.name.endswith('.tmp'):
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        exports.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in exports)
+    deleted = 0
+    for _, size, path in sorted(exports, key=lambda item: item[0]):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        path.unlink(missing_ok=True)
+        total -= size
+        deleted += 1
+    return deleted
+
+
+def parse_range(header, size):
+    """
+    Byte range requested by a ``Range`` header
+
+    Only single ranges are supported; for anything else the whole file is
+    served, which the HTTP spec allows.
+
+    Returns:
+        (start, end) inclusive, or None to serve the whole file
+
+    Raises:
+        ValueError: when the range lies outside the file
+    """
+    match = _RANGE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
@@ -0,0 +1,277 @@
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache_utils import invalidate_analysis
+from .excel_utils import list_sheets
+from .models import Dataset, DataColumn, DatasetSheet, IngestionJob
+from .profile_utils import profile_dataframe
+from .query_utils import get_sample_path
+from .search_utils import schedule_index
+from .sketch_utils import sketch_profiles
+from .storage_utils import describe_table, ensure_cache, get_cache_path, load_dataframe
+
+logger = logging.getLogger(__name__)
+
+
+def process_dataset_file(dataset, progress=None):
+    """
+    Parse an uploaded file, cache it and store its column profiles
+
+    Args:
+        dataset: Dataset instance
+        progress: Optional callable(percent, message) for status reporting
+
+    Raises:
+        Any parsing error; callers decide how to record the failure
+    """
+    report = progress or (lambda percent, message: None)
+
+    # Parses the upload once and stores it in the columnar cache; Excel
+    # workbooks report their progress sheet by sheet
+    report(10, "Parsing file")
+    cache_path = ensure_cache(dataset, progress=lambda percent, message: report(10 + percent // 2, message))
+    row_count = pq.ParquetFile(cache_path).metadata.num_rows
+
+    # Create column entries, with their statistics, for each column. Large
+    # tables are summarized with sketches one row group at a time instead
+    # of being loaded whole, and get the sample approximate analyses use
+    if row_count >= getattr(settings, 'APPROX_MIN_ROWS', 1_000_000):
+        report(60, "Sketching columns")
+        df = None
+        profiles = sketch_profiles(cache_path)
+        report(80, "Sampling rows")
+        get_sample_path(dataset)
+    else:
+        df = load_dataframe(dataset)
+        report(60, "Profiling columns")
+        profiles = profile_dataframe(df)
+
+    report(90, "Saving column metadata")
+    with transaction.atomic():
+        dataset.row_count = row_count
+        Dataset.objects.filter(pk=dataset.pk).update(row_count=dataset.row_count)
+        store_column_profiles(dataset, df, profiles=profiles)
+        if dataset.file_type == 'EXCEL':
+            store_sheets(dataset)
+    report(100, "Done")
+
+
+def store_sheets(dataset):
+    """Replace the dataset's sheet records with the worksheets of its cached workbook"""
+    sheets = []
+    for position, name in enumerate(list_sheets(dataset.file.path)):
+        row_count, columns = describe_table(get_cache_path(dataset, position))
+        sheets.append(DatasetSheet(dataset=dataset, name=name, position=position,
+                                   row_count=row_count, columns=columns))
+    with transaction.atomic():
+        dataset.sheets.all().delete()
+        DatasetSheet.objects.bulk_create(sheets)
+    return sheets
+
+
+def store_column_profiles(dataset, df, profiles=None):
+    """
+    Replace the dataset's column metadata with freshly computed profiles
+
+    All rows are written with one bulk INSERT per batch inside a single
+    transaction, and re-ingestion replaces the previous rows instead of
+    adding duplicates. Any cached analysis built from the old profiles is
+    dropped, and the search index picks up the new columns.
+    """
+    if profiles is None:
+        profiles = profile_dataframe(df)
+    with transaction.atomic():
+        dataset.columns.all().delete()
+        DataColumn.objects.bulk_create(
+            [DataColumn(dataset=dataset, **profile) for profile in profiles],
+            batch_size=500,
+        )
+        # bulk_create() sends no post_save signals
+        schedule_index(dataset.pk)
+    invalidate_analysis(dataset)
+
+
+def enqueue_ingestion(dataset):
+    """
+    Queue a dataset for background processing
+
+    With ``INGESTION_RUN_INLINE`` enabled the job runs immediately in the
+    current process instead, which is convenient for development and tests.
+
+    Returns:
+        The IngestionJob
+    """
+    job = IngestionJob.objects.create(
+        dataset=dataset,
+        max_attempts=getattr(settings, 'INGESTION_MAX_ATTEMPTS', 3),
+    )
+    Dataset.objects.filter(pk=dataset.pk).update(status='PENDING')
+    dataset.status = 'PENDING'
+
+    if getattr(settings, 'INGESTION_RUN_INLINE', False):
+        now = timezone.now()
+        claimed = IngestionJob.objects.filter(pk=job.pk, status='QUEUED').update(
+            status='RUNNING', started_at=now, heartbeat_at=now, worker='inline'
+        )
+        if claimed:
+            run_job(job.pk)
+        job.refresh_from_db()
+        dataset.refresh_from_db(fields=['status', 'row_count'])
+    return job
+
+
+def get_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(worker_name):
+    """
+    Atomically move the oldest runnable job from QUEUED to RUNNING
+
+    The conditional UPDATE makes concurrent workers safe: only the one whose
+    update matched the row owns the job.
+
+    Returns:
+        The claimed IngestionJob, or None when the queue is empty
+    """
+    now = timezone.now()
+    candidates = IngestionJob.objects.filter(
+        status='QUEUED', available_at__lte=now
+    ).order_by('available_at', 'pk').values_list('pk', flat=True)[:5]
+
+    for job_id in candidates:
+        with transaction.atomic():
+            claimed = IngestionJob.objects.filter(pk=job_id, status='QUEUED').update(
+                status='RUNNING', started_at=now, heartbeat_at=now, worker=worker_name, progress=0, message=''
+            )
+        if claimed:
+            return IngestionJob.objects.get(pk=job_id)
+    return None
+
+
+def heartbeat_jobs(job_ids):
+    """Record that the worker running these jobs is still alive"""
+    if job_ids:
+        IngestionJob.objects.filter(pk__in=job_ids, status='RUNNING').update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs(stale_after):
+    """
+    Return RUNNING jobs whose worker apparently died to the queue
+
+    A job is stale when no heartbeat (see heartbeat_jobs()) arrived for
+    ``stale_after`` seconds, however long it has been running.
+
+    Returns:
+        Number of jobs requeued
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    silent = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    return IngestionJob.objects.filter(silent, status='RUNNING').update(
+        status='QUEUED', available_at=timezone.now(), message="Requeued after worker timeout"
+    )
+
+
+def release_crashed_job(job_id):
+    """Requeue (or fail) a job whose worker process died mid-run"""
+    job = IngestionJob.objects.get(pk=job_id)
+    if job.status != 'RUNNING':
+        return
+    attempts = job.attempts + 1
+    if attempts < job.max_attempts:
+        IngestionJob.objects.filter(pk=job_id).update(
+            status='QUEUED', attempts=attempts, available_at=timezone.now(),
+            message="Requeued after worker crash",
+        )
+        Dataset.objects.filter(pk=job.dataset_id).update(status='PENDING')
+    else:
+        IngestionJob.objects.filter(pk=job_id).update(
+            status='FAILED', attempts=attempts, finished_at=timezone.now(),
+            error="Worker process crashed", message="Processing failed",
+        )
+        Dataset.objects.filter(pk=job.dataset_id).update(status='FAILED')
+
+
+def run_job(job_id):
+    """
+    Execute a claimed ingestion job
+
+    Runs inside a worker process. Failures are retried with exponential
+    backoff until ``max_attempts`` is reached, after which both the job and
+    its dataset are marked FAILED.
+
+    Returns:
+        Final job status
+    """
+    job = IngestionJob.objects.select_related('dataset').get(pk=job_id)
+    dataset = job.dataset
+
+    def report(percent, message):
+        IngestionJob.objects.filter(pk=job.pk).update(progress=percent, message=message,
+                                                      heartbeat_at=timezone.now())
+
+    Dataset.objects.filter(pk=dataset.pk).update(status='PROCESSING')
+    attempts = job.attempts + 1
+    try:
+        process_dataset_file(dataset, progress=report)
+    except Exception:
+        error = traceback.format_exc()
+        if attempts < job.max_attempts:
+            delay = getattr(settings, 'INGESTION_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+            logger.warning("Ingestion of dataset %s failed (attempt %s), retrying in %ss",
+                           dataset.pk, attempts, delay)
+            IngestionJob.objects.filter(pk=job.pk).update(
+                status='QUEUED', attempts=attempts, error=error,
+                available_at=timezone.now() + timedelta(seconds=delay),
+                message=f"Retrying (attempt {attempts + 1} of {job.max_attempts})",
+            )
+            Dataset.objects.filter(pk=dataset.pk).update(status='PENDING')
+            return 'QUEUED'
+
+        logger.exception("Ingestion of dataset %s failed", dataset.pk)
+        IngestionJob.objects.filter(pk=job.pk).update(
+            status='FAILED', attempts=attempts, error=error, finished_at=timezone.now(),
+            message="Processing failed",
+        )
+        Dataset.objects.filter(pk=dataset.pk).update(status='FAILED')
+        return 'FAILED'
+
+    IngestionJob.objects.filter(pk=job.pk).update(
+        status='DONE', attempts=attempts, progress=100, finished_at=timezone.now(), error=''
+    )
+    Dataset.objects.filter(pk=dataset.pk).update(status='READY')
+    return 'DONE'
+
+
+def _ingestion_status(dataset, job):
+    return {
+        'status': dataset.status,
+        'progress': job.progress if job else (100 if dataset.status == 'READY' else 0),
+        'message': job.message if job else '',
+        'error': job.error.strip().splitlines()[-1] if job and job.status == 'FAILED' and job.error else '',
+        'attempts': job.attempts if job else 0,
+    }
+
+
+def get_ingestion_status(dataset):
+    """
+    Current processing state of a dataset, for the status endpoint
+
+    Returns:
+        dict with status, progress, message and error
+    """
+    return _ingestion_status(dataset, dataset.ingestion_jobs.order_by('-created_at', '-pk').first())
+
+
+async def aget_ingestion_status(dataset):
+    """Async version of get_ingestion_status()"""
+    return _ingestion_status(dataset, await dataset.ingestion_jobs.order_by('-created_at', '-pk').afirst())
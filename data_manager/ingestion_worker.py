@@ -0,0 +1,23 @@
+"""
+Entry points executed inside ingestion worker processes
+
+Kept free of model imports at module level: spawned workers unpickle these
+functions before Django is set up.
+"""
+import django
+
+
+def init_worker():
+    django.setup()
+
+
+def run_ingestion_job(job_id):
+    from django.db import close_old_connections
+
+    from .ingestion_utils import run_job
+
+    close_old_connections()
+    try:
+        return run_job(job_id)
+    finally:
+        close_old_connections()
@@ -0,0 +1,141 @@
+import codecs
+import json
+import re
+
+# Characters read from the file at a time when scanning a top-level array
+READ_CHUNK_CHARS = 1024 * 1024
+
+_SEPARATORS = re.compile(r'[\s,]*')
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def is_json_lines(path):
+    """Whether a JSON upload is newline-delimited (one record per line)"""
+    with open(path, 'rb') as fh:
+        first_line = fh.readline().lstrip(codecs.BOM_UTF8).strip()
+        if not first_line.startswith(b'{'):
+            return False
+        try:
+            json.loads(first_line)
+        except ValueError:
+            return False
+        return bool(fh.readline().strip())
+
+
+def json_layout(path):
+    """
+    How records are laid out in a JSON upload
+
+    Returns:
+        'lines' for JSON lines, 'array' for a top-level array of records,
+        or 'document' for anything else (e.g. a dict of columns)
+    """
+    if is_json_lines(path):
+        return 'lines'
+    with open(path, encoding='utf-8-sig') as fh:
+        while True:
+            chunk = fh.read(4096)
+            if not chunk:
+                return 'document'
+            stripped = chunk.lstrip()
+            if stripped:
+                return 'array' if stripped[0] == '[' else 'document'
+
+
+def _iter_array(fh, chunk_chars=READ_CHUNK_CHARS):
+    """Decode the elements of a top-level JSON array one at a time"""
+    decoder = json.JSONDecoder()
+    buffer = fh.read(chunk_chars)
+    pos = buffer.index('[') + 1
+    eof = False
+
+    def refill(buffer, pos):
+        # Read at least as much as is buffered, so a record larger than
+        # the chunk size is decoded in a logarithmic number of attempts
+        more = fh.read(max(chunk_chars, len(buffer) - pos))
+        return buffer[pos:] + more, 0, not more
+
+    while True:
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            buffer, pos, eof = refill(buffer, pos)
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buffer, pos, eof = refill(buffer, pos)
+            continue
+        if end == len(buffer) and not eof:
+            # A number cut off at the end of the buffer also decodes
+            buffer, pos, eof = refill(buffer, pos)
+            continue
+        yield value
+        pos = end
+
+
+def iter_json_records(path):
+    """
+    Yield the records of a JSON-lines file or of a top-level JSON array
+
+    Only one record (plus a read buffer) is held in memory at a time.
+    """
+    layout = json_layout(path)
+    with open(path, encoding='utf-8-sig') as fh:
+        if layout == 'lines':
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        elif layout == 'array':
+            yield from _iter_array(fh)
+        else:
+            raise ValueError("Only JSON lines and top-level arrays can be streamed")
+
+
+def flatten_record(record, max_depth, separator='.'):
+    """
+    Flatten nested objects into dotted column names
+
+    Objects nested up to ``max_depth`` levels deep become columns such as
+    ``address.city``; deeper objects and all lists are kept as JSON text.
+    Records that are not objects become a single ``value`` column.
+
+    Returns:
+        dict mapping column name to a scalar value
+    """
+    if not isinstance(record, dict):
+        record = {'value': record}
+    flat = {}
+
+    def visit(value, prefix, depth):
+        for key, item in value.items():
+            name = f"{prefix}{separator}{key}" if prefix else str(key)
+            if isinstance(item, dict) and item and depth < max_depth:
+                visit(item, name, depth + 1)
+            elif isinstance(item, (dict, list)):
+                flat[name] = _encode(item)
+            else:
+                flat[name] = item
+
+    visit(record, '', 0)
+    return flat
+
+
+def iter_record_batches(path, batch_rows, max_depth):
+    """
+    Yield lists of flattened records of at most ``batch_rows`` records each
+    """
+    batch = []
+    for record in iter_json_records(path):
+        batch.append(flatten_record(record, max_depth))
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,152 @@
+import platform
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from data_manager.benchmark_utils import (
+    FILE_EXTENSIONS, compare_results, load_results, measure, save_results, write_synthetic_file,
+)
+from data_manager.cache_utils import invalidate_analysis
+from data_manager.ingestion_utils import process_dataset_file
+from data_manager.models import Dataset
+from data_manager.storage_utils import invalidate_cache
+
+
+def _int_list(value):
+    return [int(item.replace('_', '')) for item in value.split(',') if item]
+
+
+class Command(BaseCommand):
+    help = ("Benchmark ingestion, analysis and page rendering on synthetic uploads, "
+            "optionally comparing against a stored baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=_int_list, default=[10_000, 100_000],
+                            help="Comma-separated row counts (default: 10000,100000; up to 10M is supported)")
+        parser.add_argument('--columns', type=_int_list, default=[10, 100],
+                            help="Comma-separated column counts (default: 10,100; up to 5000 is supported)")
+        parser.add_argument('--formats', default='CSV,EXCEL,JSON',
+                            help="Comma-separated file types (default: CSV,EXCEL,JSON)")
+        parser.add_argument('--scenarios', default='ingest,detail,analyze,list',
+                            help="Comma-separated scenarios (default: ingest,detail,analyze,list)")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case (default: 3)")
+        parser.add_argument('--output', help="Write results as JSON to this file")
+        parser.add_argument('--baseline', help="Compare against results previously written with --output")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed slowdown/memory growth before a case counts as a regression (default: 0.2)")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error when a regression is found")
+
+    def handle(self, *args, **options):
+        formats = [item.strip().upper() for item in options['formats'].split(',') if item.strip()]
+        unknown = set(formats) - set(FILE_EXTENSIONS)
+        if unknown:
+            raise CommandError(f"Unknown format(s): {', '.join(sorted(unknown))}")
+        scenarios = {item.strip() for item in options['scenarios'].split(',') if item.strip()}
+        baseline = load_results(options['baseline']) if options['baseline'] else None
+
+        work_dir = Path(tempfile.mkdtemp(prefix='benchmark-'))
+        user, created_user = get_user_model().objects.get_or_create(username='__benchmark__')
+        hosts = list(settings.ALLOWED_HOSTS) + ['testserver']
+        results = {}
+        try:
+            with override_settings(MEDIA_ROOT=str(work_dir / 'media'), ALLOWED_HOSTS=hosts,
+                                   DATASET_CACHE_DIR=str(work_dir / 'cache')):
+                client = Client()
+                client.force_login(user)
+                for file_type in formats:
+                    for rows in options['rows']:
+                        for columns in options['columns']:
+                            results.update(self.run_case(
+                                client, user, work_dir, file_type, rows, columns, scenarios, options['repeat']
+                            ))
+        finally:
+            Dataset.objects.filter(owner=user).delete()
+            if created_user:
+                user.delete()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if options['output']:
+            save_results(options['output'], results, metadata={
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'database': settings.DATABASES['default']['ENGINE'],
+            })
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            self.report_regressions(compare_results(results, baseline, options['tolerance']),
+                                    options['fail_on_regression'])
+
+    def run_case(self, client, user, work_dir, file_type, rows, columns, scenarios, repeat):
+        path = work_dir / 'media' / 'datasets' / f"bench_{rows}x{columns}.{FILE_EXTENSIONS[file_type]}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows, columns = write_synthetic_file(path, file_type, rows, columns)
+        label = f"{file_type.lower()}/{rows}x{columns}"
+        self.stdout.write(f"{label}: {path.stat().st_size / (1024 * 1024):.1f} MB")
+
+        dataset = Dataset.objects.create(
+            name=f"Benchmark {label}", file=str(path.relative_to(work_dir / 'media')), file_type=file_type,
+            owner=user, status='READY',
+        )
+        results = {}
+
+        def record(scenario, result):
+            case = f"{scenario}/{label}"
+            results[case] = result
+            self.stdout.write(
+                f"  {scenario:<14} {result['median_s'] * 1000:>10.1f} ms  "
+                f"{result['peak_mb']:>9.1f} MB peak  {result['queries']:>4} queries"
+            )
+
+        def reset():
+            # Every ingestion run starts cold: no checksum, no columnar cache
+            invalidate_cache(dataset)
+            dataset.file_checksum = ''
+
+        if 'ingest' in scenarios:
+            record('ingest', measure(lambda: process_dataset_file(dataset), repeat=repeat, setup=reset))
+        else:
+            process_dataset_file(dataset)
+
+        def get(url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"GET {url} returned {response.status_code}")
+
+        if 'detail' in scenarios:
+            record('detail', measure(lambda: get(reverse('dataset_detail', args=[dataset.pk])), repeat=repeat))
+        if 'analyze' in scenarios:
+            url = reverse('analyze_dataset', args=[dataset.pk])
+            record('analyze_cold', measure(lambda: get(url), repeat=repeat,
+                                           setup=lambda: invalidate_analysis(dataset)))
+            record('analyze_warm', measure(lambda: get(url), repeat=repeat))
+        if 'list' in scenarios:
+            record('list', measure(lambda: get(reverse('dataset_list')), repeat=repeat))
+
+        dataset.delete()
+        path.unlink()
+        return results
+
+    def report_regressions(self, regressions, fail):
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+            return
+        for item in regressions:
+            if item['metric'] == 'queries':
+                change = f"+{item['change']} queries"
+            else:
+                change = f"{item['change']:+.0%}"
+            self.stdout.write(self.style.WARNING(
+                f"REGRESSION {item['case']} {item['metric']}: {item['baseline']:.4g} -> {item['current']:.4g} ({change})"
+            ))
+        if fail:
+            raise CommandError(f"{len(regressions)} regression(s) against the baseline")
@@ -0,0 +1,51 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from data_manager.models import Dataset, DataColumn
+
+
+class Command(BaseCommand):
+    help = "Compare per-row and bulk insertion of DataColumn metadata for a wide dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--columns', type=int, default=2000,
+                            help="Number of columns to insert (default: 2000)")
+
+    def handle(self, *args, **options):
+        n_columns = options['columns']
+        user, created_user = get_user_model().objects.get_or_create(username='__benchmark__')
+        dataset = Dataset.objects.create(
+            name='Column metadata benchmark', file='datasets/benchmark.csv', file_type='CSV', owner=user
+        )
+        names = [f'column_{i}' for i in range(n_columns)]
+
+        try:
+            # Previous behaviour: one INSERT, and one autocommit, per column
+            start = time.perf_counter()
+            for position, name in enumerate(names):
+                DataColumn.objects.create(dataset=dataset, name=name, data_type='float64', position=position)
+            per_row = time.perf_counter() - start
+            dataset.columns.all().delete()
+
+            # Current behaviour: batched INSERTs inside one transaction
+            start = time.perf_counter()
+            with transaction.atomic():
+                dataset.columns.all().delete()
+                DataColumn.objects.bulk_create(
+                    [DataColumn(dataset=dataset, name=name, data_type='float64', position=position)
+                     for position, name in enumerate(names)],
+                    batch_size=500,
+                )
+            bulk = time.perf_counter() - start
+        finally:
+            dataset.delete()
+            if created_user:
+                user.delete()
+
+        self.stdout.write(f"{n_columns} columns")
+        self.stdout.write(f"  create() per column: {per_row:.3f}s ({per_row / n_columns * 1e6:.0f} us/column)")
+        self.stdout.write(f"  bulk_create():       {bulk:.3f}s ({bulk / n_columns * 1e6:.0f} us/column)")
+        self.stdout.write(f"  speed-up:            {per_row / bulk:.1f}x")
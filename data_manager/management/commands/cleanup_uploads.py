@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from data_manager.upload_utils import cleanup_stale_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads that were abandoned before completion"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=24 * 60 * 60,
+                            help="Seconds since the last received chunk (default: 1 day)")
+
+    def handle(self, *args, **options):
+        removed = cleanup_stale_sessions(options['max_age'])
+        self.stdout.write(f"Removed {removed} abandoned upload(s)")
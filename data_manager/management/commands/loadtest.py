@@ -0,0 +1,73 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from data_manager.benchmark_utils import FILE_EXTENSIONS, asgi_load, write_synthetic_file, wsgi_load
+from data_manager.ingestion_utils import process_dataset_file
+from data_manager.models import Dataset
+
+
+class Command(BaseCommand):
+    help = ("Compare concurrent request throughput of the ASGI (async views) and WSGI request paths "
+            "on a synthetic dataset")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per run (default: 200)")
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help="Concurrent requests: threads for WSGI, tasks for ASGI (default: 16)")
+        parser.add_argument('--rows', type=int, default=50_000, help="Rows of the synthetic dataset")
+        parser.add_argument('--columns', type=int, default=20, help="Columns of the synthetic dataset")
+        parser.add_argument('--pages', default='list,detail,status,download',
+                            help="Comma-separated pages to request (default: list,detail,status,download)")
+
+    def handle(self, *args, **options):
+        pages = [page.strip() for page in options['pages'].split(',') if page.strip()]
+        work_dir = Path(tempfile.mkdtemp(prefix='loadtest-'))
+        user, created_user = get_user_model().objects.get_or_create(username='__loadtest__')
+        hosts = list(settings.ALLOWED_HOSTS) + ['testserver']
+        try:
+            with override_settings(MEDIA_ROOT=str(work_dir / 'media'), ALLOWED_HOSTS=hosts,
+                                   DATASET_CACHE_DIR=str(work_dir / 'cache'), PROFILING_ENABLED=False):
+                path = work_dir / 'media' / 'datasets' / f"loadtest.{FILE_EXTENSIONS['CSV']}"
+                path.parent.mkdir(parents=True)
+                write_synthetic_file(path, 'CSV', options['rows'], options['columns'])
+                dataset = Dataset.objects.create(
+                    name="Load test", file=str(path.relative_to(work_dir / 'media')), file_type='CSV',
+                    owner=user, status='READY',
+                )
+                process_dataset_file(dataset)
+                urls = {
+                    'list': reverse('dataset_list'),
+                    'detail': reverse('dataset_detail', args=[dataset.pk]),
+                    'status': reverse('dataset_status', args=[dataset.pk]),
+                    'download': reverse('download_dataset', args=[dataset.pk]) + '?format=parquet',
+                }
+                paths = [urls[page] for page in pages]
+
+                client = Client()
+                client.force_login(user)
+                cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+                runs = {'wsgi': (wsgi_load, get_wsgi_application()), 'asgi': (asgi_load, get_asgi_application())}
+                self.stdout.write(f"{options['requests']} requests over {', '.join(pages)}, "
+                                  f"concurrency {options['concurrency']}")
+                for name, (load, application) in runs.items():
+                    # One request per page first, starting worker processes and filling caches
+                    load(application, paths, len(paths), 1, cookie=cookie)
+                    result = load(application, paths, options['requests'], options['concurrency'], cookie=cookie)
+                    self.stdout.write(
+                        f"  {name}: {result['throughput_rps']:>7.1f} req/s  p50 {result['p50_ms']:>7.1f} ms  "
+                        f"p95 {result['p95_ms']:>7.1f} ms  errors {result['errors']}"
+                    )
+        finally:
+            Dataset.objects.filter(owner=user).delete()
+            if created_user:
+                user.delete()
+            shutil.rmtree(work_dir, ignore_errors=True)
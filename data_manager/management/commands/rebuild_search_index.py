@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from data_manager.search_utils import is_supported, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of datasets, columns and column values"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Datasets indexed per batch")
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            self.stdout.write("The database has no full-text index; search uses plain LIKE queries")
+            return
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(f"Indexed {indexed} dataset(s)")
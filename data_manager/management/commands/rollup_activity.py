@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from data_manager.activity_utils import (
+    DEFAULT_ROLLUP_LOOKBACK, archive_activity, flush_activity, prune_hourly_rollups, rollup_activity,
+)
+
+
+class Command(BaseCommand):
+    help = "Update the activity rollups and archive raw activity past its retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookback', type=int, default=int(DEFAULT_ROLLUP_LOOKBACK.total_seconds() // 60),
+                            help="Minutes of already rolled-up activity to recompute (default: 120)")
+        parser.add_argument('--retention-days', type=int,
+                            default=getattr(settings, 'ACTIVITY_RAW_RETENTION_DAYS', 90),
+                            help="Days of raw activity to keep; 0 keeps everything")
+        parser.add_argument('--hourly-retention-days', type=int,
+                            default=getattr(settings, 'ACTIVITY_HOURLY_ROLLUP_RETENTION_DAYS', 30),
+                            help="Days of hourly rollups to keep; daily rollups are kept forever")
+        parser.add_argument('--archive-dir', default=getattr(settings, 'ACTIVITY_ARCHIVE_DIR', None),
+                            help="Write removed raw rows here as gzipped JSON lines")
+
+    def handle(self, *args, **options):
+        lookback = timedelta(minutes=options['lookback'])
+        flush_activity()
+        written = rollup_activity(lookback=lookback)
+        self.stdout.write(f"Wrote {written} hourly rollup row(s)")
+
+        now = timezone.now()
+        if options['retention_days']:
+            removed = archive_activity(
+                now - timedelta(days=options['retention_days']),
+                archive_dir=options['archive_dir'],
+                lookback=lookback,
+            )
+            self.stdout.write(f"Archived {removed} raw activity row(s)")
+        if options['hourly_retention_days']:
+            pruned = prune_hourly_rollups(now - timedelta(days=max(options['hourly_retention_days'], 2)))
+            self.stdout.write(f"Pruned {pruned} hourly rollup row(s)")
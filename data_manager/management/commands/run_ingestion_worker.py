@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from data_manager.ingestion_utils import (
+    claim_next_job, get_worker_name, heartbeat_jobs, release_crashed_job, requeue_stale_jobs,
+)
+from data_manager.ingestion_worker import init_worker, run_ingestion_job
+
+# Seconds between heartbeats for the jobs this worker is running
+HEARTBEAT_INTERVAL = 30
+
+
+class Command(BaseCommand):
+    help = "Process queued dataset ingestion jobs using a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Number of worker processes (default: CPU count)")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Seconds to wait between polls when the queue is empty")
+        parser.add_argument('--stale-after', type=int, default=10 * HEARTBEAT_INTERVAL,
+                            help="Requeue RUNNING jobs without a heartbeat for this many seconds")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is drained instead of polling forever")
+
+    def start_pool(self, workers):
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker)
+
+    def collect(self, future, job_id):
+        """
+        Record the outcome of a finished job
+
+        Returns:
+            True when the job's worker process died, which breaks the pool
+        """
+        try:
+            status = future.result()
+        except Exception as exc:
+            # The worker process itself died (e.g. killed for memory)
+            self.stderr.write(f"Job {job_id} crashed: {exc!r}")
+            release_crashed_job(job_id)
+            return isinstance(exc, BrokenProcessPool)
+        self.stdout.write(f"Job {job_id} finished: {status}")
+        return False
+
+    def handle(self, *args, **options):
+        worker_name = get_worker_name()
+        workers = options['workers']
+        self.stdout.write(f"Ingestion worker {worker_name} started with {workers} process(es)")
+        pool = self.start_pool(workers)
+        running = {}
+        last_heartbeat = last_requeue = float('-inf')
+        try:
+            while True:
+                # Jobs of workers that stopped sending heartbeats go back to the queue
+                if time.monotonic() - last_requeue >= HEARTBEAT_INTERVAL:
+                    requeued = requeue_stale_jobs(options['stale_after'])
+                    if requeued:
+                        self.stdout.write(f"Requeued {requeued} stale job(s)")
+                    last_requeue = time.monotonic()
+
+                # Fill every free slot with a claimed job
+                while len(running) < workers:
+                    job = claim_next_job(worker_name)
+                    if job is None:
+                        break
+                    self.stdout.write(f"Processing job {job.pk} (dataset {job.dataset_id})")
+                    try:
+                        future = pool.submit(run_ingestion_job, job.pk)
+                    except BrokenProcessPool:
+                        pool = self.restart_pool(pool, running, workers)
+                        future = pool.submit(run_ingestion_job, job.pk)
+                    running[future] = job.pk
+
+                if running and time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    heartbeat_jobs(list(running.values()))
+                    last_heartbeat = time.monotonic()
+                connections.close_all()
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    broken |= self.collect(future, running.pop(future))
+                if broken:
+                    pool = self.restart_pool(pool, running, workers)
+        except KeyboardInterrupt:
+            self.stdout.write("Shutting down, waiting for running jobs")
+        finally:
+            pool.shutdown(wait=True)
+
+    def restart_pool(self, pool, running, workers):
+        """
+        Replace a pool broken by a dead worker process
+
+        Every job still running in the old pool failed with it and is
+        released like a crashed one.
+        """
+        self.stderr.write("A worker process died, restarting the pool")
+        pool.shutdown(wait=True)
+        for future, job_id in list(running.items()):
+            self.collect(future, job_id)
+        running.clear()
+        return self.start_pool(workers)
@@ -1,7 +1,25 @@
-import jwt
+import json
+import threading
 import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+
+from .models import MetabaseConfig
+from .timing_utils import phase
 
-def generate_metabase_url(metabase_config, dashboard_id, params=None):
+TOKEN_LIFETIME = 60 * 60  # 1 hour
+DEFAULT_REFRESH_MARGIN = 5 * 60
+DEFAULT_CONFIG_CACHE_TTL = 60
+MAX_CACHED_URLS = 1024
+
+_lock = threading.Lock()
+_config_cache = {'config': None, 'loaded_at': None}
+_url_cache = OrderedDict()
+
+
+def generate_metabase_url(metabase_config, dashboard_id, params=None, expires_at=None):
     """
     Generate a signed URL for embedding Metabase dashboards
     
@@ -9,6 +27,7 @@ def generate_metabase_url(metabase_config, dashboard_id, params=None):
         metabase_config: MetabaseConfig instance
         dashboard_id: ID of the dashboard in Metabase
         params: Optional parameters for the dashboard
+        expires_at: Optional expiry as a Unix timestamp (default: one hour)
         
     Returns:
         URL string for embedding
@@ -16,7 +35,7 @@ def generate_metabase_url(metabase_config, dashboard_id, params=None):
     payload = {
         "resource": {"dashboard": dashboard_id},
         "params": params or {},
-        "exp": round(time.time()) + (60 * 60)  # 1 hour expiration
+        "exp": expires_at or round(time.time()) + TOKEN_LIFETIME
     }
     
     token = jwt.encode(
@@ -25,4 +44,94 @@ def generate_metabase_url(metabase_config, dashboard_id, params=None):
         algorithm="HS256"
     )
     
-    return f"{metabase_config.site_url}/embed/dashboard/{token}#bordered=true&titled=true"
\ No newline at end of file
+    return f"{metabase_config.site_url}/embed/dashboard/{token}#bordered=true&titled=true"
+
+
+def get_active_config():
+    """
+    The active MetabaseConfig, memoized in-process
+
+    The cached instance is dropped by the MetabaseConfig signals and, as a
+    safety net for changes made by other processes, after
+    ``METABASE_CONFIG_CACHE_TTL`` seconds.
+
+    Raises:
+        MetabaseConfig.DoesNotExist: if no configuration is active
+    """
+    ttl = getattr(settings, 'METABASE_CONFIG_CACHE_TTL', DEFAULT_CONFIG_CACHE_TTL)
+    now = time.monotonic()
+    with _lock:
+        loaded_at = _config_cache['loaded_at']
+        if loaded_at is not None and now - loaded_at < ttl:
+            config = _config_cache['config']
+            if config is None:
+                raise MetabaseConfig.DoesNotExist("No active Metabase configuration.")
+            return config
+
+    try:
+        config = MetabaseConfig.objects.get(is_active=True)
+    except MetabaseConfig.DoesNotExist:
+        config = None
+    with _lock:
+        _config_cache.update(config=config, loaded_at=now)
+    if config is None:
+        raise MetabaseConfig.DoesNotExist("No active Metabase configuration.")
+    return config
+
+
+def clear_metabase_cache():
+    """Forget the memoized config and every cached signed URL"""
+    with _lock:
+        _config_cache.update(config=None, loaded_at=None)
+        _url_cache.clear()
+
+
+def get_embed_url(metabase_config, dashboard_id, params=None):
+    """
+    Signed embed URL, reused until it is close to expiry
+
+    URLs are cached per (config, dashboard_id, params) and re-signed once
+    fewer than ``METABASE_TOKEN_REFRESH_MARGIN`` seconds of their one-hour
+    lifetime remain, so a browser never receives an almost-expired token.
+    """
+    margin = getattr(settings, 'METABASE_TOKEN_REFRESH_MARGIN', DEFAULT_REFRESH_MARGIN)
+    key = (metabase_config.pk, metabase_config.site_url, metabase_config.secret_key, dashboard_id,
+           json.dumps(params or {}, sort_keys=True, default=str))
+    now = time.time()
+    with _lock:
+        cached = _url_cache.get(key)
+        if cached and cached[1] - now > margin:
+            _url_cache.move_to_end(key)
+            return cached[0]
+
+    expires_at = round(now) + TOKEN_LIFETIME
+    with phase('sign'):
+        url = generate_metabase_url(metabase_config, dashboard_id, params=params, expires_at=expires_at)
+    with _lock:
+        _url_cache[key] = (url, expires_at)
+        _url_cache.move_to_end(key)
+        while len(_url_cache) > MAX_CACHED_URLS:
+            _url_cache.popitem(last=False)
+    return url
+
+
+def get_embed_urls(dashboards, params=None, metabase_config=None):
+    """
+    Signed embed URLs for several dashboards at once
+
+    Args:
+        dashboards: MetabaseDashboard instances, e.g. all of a dataset's
+        params: Optional parameters applied to every dashboard
+        metabase_config: Config to sign with (default: the active one)
+
+    Returns:
+        dict mapping each MetabaseDashboard pk to its URL
+
+    Raises:
+        MetabaseConfig.DoesNotExist: if no configuration is active
+    """
+    metabase_config = metabase_config or get_active_config()
+    return {
+        dashboard.pk: get_embed_url(metabase_config, dashboard.dashboard_id, params=params)
+        for dashboard in dashboards
+    }
@@ -0,0 +1,91 @@
+import cProfile
+import json
+import logging
+import random
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .timing_utils import start_request_timings, stop_request_timings
+
+logger = logging.getLogger('data_manager.profiling')
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in per-request timing and profiling
+
+    With ``PROFILING_ENABLED`` every request collects the phases timed with
+    timing_utils.phase() plus all database time, returns them in a
+    Server-Timing header and logs them as one structured record. Requests
+    picked by ``PROFILING_SAMPLE_RATE``, or sent by a staff user with an
+    ``X-Profile: 1`` header, also run under cProfile and have their stats
+    written to ``PROFILING_OUTPUT_DIR``.
+
+    When profiling is disabled the middleware removes itself at startup, so
+    it costs nothing per request.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.output_dir = Path(getattr(settings, 'PROFILING_OUTPUT_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+    def __call__(self, request):
+        timings, token = start_request_timings()
+
+        def time_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.add('db', time.perf_counter() - start)
+
+        profiler = cProfile.Profile() if self.should_profile(request) else None
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(time_query))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            stop_request_timings(token)
+
+        response['Server-Timing'] = timings.server_timing()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(timings.total * 1000, 2),
+            'phases': timings.as_dict(),
+        }
+        if profiler:
+            profile_id = uuid.uuid4().hex[:12]
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(self.output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{profile_id}.prof")
+            response['X-Profile-Id'] = profile_id
+            record['profile_id'] = profile_id
+        logger.info(json.dumps(record, sort_keys=True), extra={'timings': record})
+        return response
+
+    def should_profile(self, request):
+        if request.META.get(PROFILE_HEADER) == '1':
+            # Listed after AuthenticationMiddleware, so request.user is set
+            user = getattr(request, 'user', None)
+            return bool(user is not None and user.is_authenticated and user.is_staff)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0004_dataset_is_public'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='file_checksum',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
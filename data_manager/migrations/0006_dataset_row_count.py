@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0005_dataset_file_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='row_count',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0006_dataset_row_count'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='datacolumn',
+            options={'ordering': ['position']},
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='count',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='distinct_count',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='histogram',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='kind',
+            field=models.CharField(choices=[('NUMERIC', 'Numeric'), ('CATEGORICAL', 'Categorical'), ('DATETIME', 'Date/Time'), ('BOOLEAN', 'Boolean'), ('OTHER', 'Other')], default='OTHER', max_length=11),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='max_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='mean',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='min_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='null_count',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='quantiles',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='std',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='top_values',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0010_useractivity_event_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hourly'), ('DAY', 'Daily')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('action', models.CharField(choices=[('VIEW', 'Viewed Dataset'), ('UPLOAD', 'Uploaded Dataset'), ('DOWNLOAD', 'Downloaded Dataset'), ('DASHBOARD', 'Viewed Dashboard'), ('SEARCH', 'Performed Search')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-bucket_start'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', 'timestamp'], name='data_manage_user_id_a01346_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['dataset', 'action', 'timestamp'], name='data_manage_dataset_51a649_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['action', 'timestamp'], name='data_manage_action_ce6d09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['timestamp'], name='data_manage_timesta_c5763b_idx'),
+        ),
+        migrations.AddField(
+            model_name='activityrollup',
+            name='dataset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activity_rollups', to='data_manager.dataset'),
+        ),
+        migrations.AddField(
+            model_name='activityrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['period', 'bucket_start'], name='data_manage_period_25fe4d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['dataset', 'period', 'bucket_start'], name='data_manage_dataset_31d645_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['user', 'period', 'bucket_start'], name='data_manage_user_id_ebe665_idx'),
+        ),
+    ]
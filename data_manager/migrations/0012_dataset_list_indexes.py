@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0011_activity_indexes_and_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['owner', '-upload_date', '-id'], name='data_manage_owner_i_cadc97_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['is_public', '-upload_date', '-id'], name='data_manage_is_publ_d67394_idx'),
+        ),
+    ]
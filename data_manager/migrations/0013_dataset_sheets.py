@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0012_dataset_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('position', models.PositiveIntegerField()),
+                ('row_count', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('columns', models.JSONField(blank=True, default=list)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sheets', to='data_manager.dataset')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('dataset', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS data_manager_search USING fts5(
+    name, description, columns, vals, tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+# Values of existing datasets are indexed by the rebuild_search_index command
+POPULATE_INDEX = """
+INSERT INTO data_manager_search (rowid, name, description, columns, vals)
+SELECT d.id, d.name, coalesce(d.description, ''),
+       coalesce((SELECT group_concat(c.name, ' ') FROM data_manager_datacolumn c WHERE c.dataset_id = d.id), ''),
+       ''
+FROM data_manager_dataset d
+"""
+
+
+def create_search_index(apps, schema_editor):
+    # Full-text search uses SQLite's FTS5; other databases fall back to LIKE queries
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    schema_editor.execute(POPULATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS data_manager_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0013_dataset_sheets'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
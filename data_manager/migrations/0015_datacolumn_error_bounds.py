@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datacolumn',
+            name='error_bounds',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0016_ingestionjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='analysis_generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0017_dataset_analysis_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityrollup',
+            name='last_activity_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
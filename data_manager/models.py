@@ -1,7 +1,10 @@
 # project-root/data_manager/models.py
+import uuid
+
 from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Dataset(models.Model):
     """Stores uploaded data files"""
@@ -10,6 +13,12 @@ class Dataset(models.Model):
         ('EXCEL', 'Excel File'),
         ('JSON', 'JSON File'),
     ]
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('READY', 'Ready'),
+        ('FAILED', 'Failed'),
+    ]
     
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -18,19 +27,166 @@ class Dataset(models.Model):
     upload_date = models.DateTimeField(auto_now_add=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     is_public = models.BooleanField(default=False)  # Added this field
+    file_checksum = models.CharField(max_length=64, blank=True, editable=False)
+    row_count = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', editable=False)
+    # Part of the analysis cache key; bumped to expire cached analyses in every process
+    analysis_generation = models.PositiveIntegerField(default=0, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Keyset pagination of the dataset list, newest first
+            models.Index(fields=['owner', '-upload_date', '-id']),
+            models.Index(fields=['is_public', '-upload_date', '-id']),
+        ]
     
     def __str__(self):
         return self.name
 
 class DataColumn(models.Model):
-    """Stores information about columns in a dataset"""
+    """Stores information about columns in a dataset, profiled at upload"""
+    KIND_CHOICES = [
+        ('NUMERIC', 'Numeric'),
+        ('CATEGORICAL', 'Categorical'),
+        ('DATETIME', 'Date/Time'),
+        ('BOOLEAN', 'Boolean'),
+        ('OTHER', 'Other'),
+    ]
+    
     dataset = models.ForeignKey('Dataset', related_name='columns', on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     data_type = models.CharField(max_length=50)
+    position = models.PositiveIntegerField(default=0)
+    kind = models.CharField(max_length=11, choices=KIND_CHOICES, default='OTHER')
+    
+    # Profile statistics; numeric fields stay empty for non-numeric columns
+    count = models.PositiveBigIntegerField(null=True, blank=True)
+    null_count = models.PositiveBigIntegerField(null=True, blank=True)
+    distinct_count = models.PositiveBigIntegerField(null=True, blank=True)
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    mean = models.FloatField(null=True, blank=True)
+    std = models.FloatField(null=True, blank=True)
+    quantiles = models.JSONField(default=dict, blank=True)
+    top_values = models.JSONField(default=list, blank=True)
+    histogram = models.JSONField(default=dict, blank=True)
+    # Set when the profile was estimated with sketches (see sketch_utils):
+    # {'rank': ..., 'distinct': ..., 'top_count': ...} at 99% confidence
+    error_bounds = models.JSONField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['position']
+    
+    @property
+    def is_profiled(self):
+        return self.count is not None
+
+    @property
+    def is_approximate(self):
+        return self.error_bounds is not None
+    
+    def __str__(self):
+        return f"{self.dataset.name} - {self.name}"
+
+class DatasetSheet(models.Model):
+    """A worksheet of an Excel dataset, cached as its own columnar table"""
+    dataset = models.ForeignKey('Dataset', related_name='sheets', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    # Sheet 0 is the dataset's main table, profiled in DataColumn
+    position = models.PositiveIntegerField()
+    row_count = models.PositiveBigIntegerField(null=True, blank=True)
+    # [[column name, dtype], ...] in column order
+    columns = models.JSONField(default=list, blank=True)
+    
+    class Meta:
+        ordering = ['position']
+        unique_together = [('dataset', 'position')]
     
     def __str__(self):
         return f"{self.dataset.name} - {self.name}"
 
+class IngestionJob(models.Model):
+    """Queued background processing of an uploaded dataset file"""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    dataset = models.ForeignKey('Dataset', related_name='ingestion_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='QUEUED')
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    worker = models.CharField(max_length=100, blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed while a worker runs the job; see requeue_stale_jobs()
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+    
+    def __str__(self):
+        return f"Ingestion of dataset {self.dataset_id} ({self.status})"
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload of a dataset file"""
+    STATUS_CHOICES = [
+        ('ACTIVE', 'Active'),
+        ('COMPLETE', 'Complete'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default='ACTIVE')
+    
+    # Dataset fields applied when the upload completes
+    name = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    file_type = models.CharField(max_length=5, choices=Dataset.FILE_TYPES)
+    is_public = models.BooleanField(default=False)
+    dataset = models.ForeignKey('Dataset', null=True, blank=True, on_delete=models.SET_NULL)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @property
+    def total_chunks(self):
+        return max(-(-self.total_size // self.chunk_size), 1)
+    
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+    
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
+
+class UploadChunk(models.Model):
+    """A chunk of an UploadSession that has been received and verified"""
+    session = models.ForeignKey('UploadSession', related_name='chunks', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)
+    
+    class Meta:
+        unique_together = [('session', 'index')]
+    
+    def __str__(self):
+        return f"{self.session_id} #{self.index}"
+
 class MetabaseConfig(models.Model):
     """Configuration for Metabase integration"""
     site_url = models.URLField(help_text="URL of your Metabase instance")
@@ -65,11 +221,48 @@ class UserActivity(models.Model):
     dataset = models.ForeignKey('Dataset', on_delete=models.SET_NULL, null=True, blank=True)
     dashboard = models.ForeignKey('MetabaseDashboard', on_delete=models.SET_NULL, null=True, blank=True)
     details = models.JSONField(default=dict, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when a batch of events is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         verbose_name_plural = "User Activities"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['dataset', 'action', 'timestamp']),
+            models.Index(fields=['action', 'timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} - {self.action} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+        return f"{self.user.username} - {self.action} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class ActivityRollup(models.Model):
+    """Pre-aggregated activity counts per period, dataset, action and user"""
+    PERIOD_CHOICES = (
+        ('HOUR', 'Hourly'),
+        ('DAY', 'Daily'),
+    )
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='activity_rollups')
+    action = models.CharField(max_length=20, choices=UserActivity.ACTION_CHOICES)
+    dataset = models.ForeignKey('Dataset', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='activity_rollups')
+    count = models.PositiveIntegerField(default=0)
+    # Highest UserActivity id counted by the run that wrote this row; rows
+    # above it were written late (e.g. replayed from the spill file)
+    last_activity_id = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-bucket_start']
+        indexes = [
+            models.Index(fields=['period', 'bucket_start']),
+            models.Index(fields=['dataset', 'period', 'bucket_start']),
+            models.Index(fields=['user', 'period', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:%M} {self.action}: {self.count}"
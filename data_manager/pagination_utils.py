@@ -0,0 +1,63 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(obj):
+    """Opaque cursor pointing just after ``obj`` in upload_date/pk order"""
+    raw = f"{obj.upload_date.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor made by encode_cursor()
+
+    Returns:
+        (upload_date, pk), or None for a missing or malformed cursor
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, pk = raw.split('|')
+        upload_date = parse_datetime(timestamp)
+        return (upload_date, int(pk)) if upload_date else None
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _page_queryset(queryset, cursor, page_size):
+    queryset = queryset.order_by('-upload_date', '-pk')
+    position = decode_cursor(cursor)
+    if position:
+        upload_date, pk = position
+        queryset = queryset.filter(Q(upload_date__lt=upload_date) | Q(upload_date=upload_date, pk__lt=pk))
+    return queryset[:page_size + 1]
+
+
+def _split_page(items, page_size):
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return items[:page_size], next_cursor
+
+
+def keyset_page(queryset, cursor=None, page_size=24):
+    """
+    One page of a queryset, newest first, using keyset pagination
+
+    Rows are ordered by (upload_date, pk) descending and the page starts
+    after the row the cursor points at, so every page costs the same index
+    range scan no matter how deep the user pages; OFFSET would scan and
+    discard all earlier rows.
+
+    Returns:
+        (items, next_cursor) where next_cursor is None on the last page
+    """
+    return _split_page(list(_page_queryset(queryset, cursor, page_size)), page_size)
+
+
+async def akeyset_page(queryset, cursor=None, page_size=24):
+    """Async version of keyset_page()"""
+    return _split_page([item async for item in _page_queryset(queryset, cursor, page_size)], page_size)
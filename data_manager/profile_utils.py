@@ -0,0 +1,173 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+QUANTILES = (0.25, 0.5, 0.75)
+TOP_K = 10
+HISTOGRAM_BINS = 20
+
+
+def column_kind(dtype):
+    """
+    Classify a pandas dtype for analysis purposes
+
+    Returns:
+        One of the DataColumn.KIND_CHOICES keys
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'BOOLEAN'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'NUMERIC'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'DATETIME'
+    if (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+            or isinstance(dtype, pd.CategoricalDtype)):
+        return 'CATEGORICAL'
+    return 'OTHER'
+
+
+def _to_python(value):
+    """Convert a NumPy/pandas scalar to something JSON can store"""
+    if value is None:
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (int, float, bool, str)):
+        return value
+    return str(value)
+
+
+def _native_array(values):
+    """NumPy array of a column without missing values, in its own dtype"""
+    if isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+        return values.to_numpy(dtype=values.dtype.numpy_dtype)
+    return values.to_numpy()
+
+
+def _quantiles(ordered):
+    """Linearly interpolated quantiles of a sorted array (like np.quantile)"""
+    positions = np.asarray(QUANTILES) * (len(ordered) - 1)
+    low = np.floor(positions).astype(np.int64)
+    high = np.ceil(positions).astype(np.int64)
+    low_values = ordered[low].astype(float)
+    return low_values + (ordered[high].astype(float) - low_values) * (positions - low)
+
+
+def _histogram(ordered):
+    """Equal-width histogram of a sorted array, with np.histogram's bins"""
+    low, high = float(ordered[0]), float(ordered[-1])
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    edges = np.linspace(low, high, HISTOGRAM_BINS + 1)
+    # Bins are half-open except the last, which includes the maximum
+    bounds = np.concatenate([[0], np.searchsorted(ordered, edges[1:-1], side='left'), [len(ordered)]])
+    return np.diff(bounds), edges
+
+
+def _numeric_profile(values):
+    """
+    Statistics of a numeric column from a single sort of its values
+
+    Min, max, quantiles, histogram, distinct count and the most frequent
+    values are all read off the sorted array, replacing a hash-based
+    value_counts() and separate selection passes.
+    """
+    ordered = np.sort(_native_array(values))
+    count = len(ordered)
+    starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+    run_lengths = np.diff(np.append(starts, count))
+    # Most frequent first, ties broken by value
+    top = np.lexsort((ordered[starts], -run_lengths))[:TOP_K]
+    hist_counts, edges = _histogram(ordered)
+    return {
+        'distinct_count': int(len(starts)),
+        'top_values': [[_to_python(ordered[starts[i]]), int(run_lengths[i])] for i in top],
+        'min_value': _to_python(float(ordered[0])),
+        'max_value': _to_python(float(ordered[-1])),
+        'mean': _to_python(ordered.mean(dtype=np.float64)),
+        'std': _to_python(ordered.std(ddof=1, dtype=np.float64)) if count > 1 else None,
+        'quantiles': {str(q): _to_python(point) for q, point in zip(QUANTILES, _quantiles(ordered))},
+        'histogram': {'edges': [_to_python(edge) for edge in edges], 'counts': hist_counts.tolist()},
+    }
+
+
+def profile_column(series):
+    """
+    Compute summary statistics for one column
+
+    Args:
+        series: pandas Series
+
+    Returns:
+        dict of DataColumn profile fields
+    """
+    kind = column_kind(series.dtype)
+    values = series.dropna()
+
+    profile = {
+        'kind': kind,
+        'count': int(len(values)),
+        'null_count': int(len(series) - len(values)),
+        'distinct_count': 0,
+        'min_value': None,
+        'max_value': None,
+        'mean': None,
+        'std': None,
+        'quantiles': {},
+        'top_values': [],
+        'histogram': {},
+    }
+
+    if kind == 'NUMERIC' and len(values):
+        profile.update(_numeric_profile(values))
+    elif len(values):
+        counts = values.value_counts()
+        # Categorical columns also count the categories that never occur
+        counts = counts[counts > 0]
+        profile.update({
+            'distinct_count': int(len(counts)),
+            'top_values': [[_to_python(value), int(count)] for value, count in counts.head(TOP_K).items()],
+        })
+    return profile
+
+
+def profile_dataframe(df, workers=None):
+    """
+    Profile every column of a DataFrame
+
+    Columns are profiled concurrently by a thread pool of ``workers``
+    threads (default: the ``PROFILE_WORKERS`` setting, else one per CPU).
+    Threads share the DataFrame without copying it, and the sorting and
+    counting behind each profile run in NumPy/pandas code that releases
+    the GIL, so wide datasets scale across cores.
+
+    Returns:
+        List of dicts with ``name``, ``position``, ``data_type`` and the
+        fields from profile_column(), in column order
+    """
+    if workers is None:
+        workers = getattr(settings, 'PROFILE_WORKERS', None) or os.cpu_count() or 1
+    columns = [df[column] for column in df.columns]
+    if workers > 1 and len(columns) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(columns))) as pool:
+            results = list(pool.map(profile_column, columns))
+    else:
+        results = [profile_column(series) for series in columns]
+
+    profiles = []
+    for position, (column, profile) in enumerate(zip(df.columns, results)):
+        profile.update({
+            'name': str(column),
+            'position': position,
+            'data_type': str(df[column].dtype),
+        })
+        profiles.append(profile)
+    return profiles
@@ -0,0 +1,691 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from django.conf import settings
+
+from .storage_utils import ensure_cache, get_cache_path
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 1000
+
+AGGREGATE_FUNCTIONS = ('sum', 'mean', 'min', 'max', 'count', 'count_distinct')
+TIME_BUCKET_UNITS = ('hour', 'day', 'week', 'month', 'quarter', 'year')
+
+FILTER_OPERATORS = {
+    'eq': pc.equal,
+    'ne': pc.not_equal,
+    'lt': pc.less,
+    'lte': pc.less_equal,
+    'gt': pc.greater,
+    'gte': pc.greater_equal,
+}
+
+# Operators that test the row alone and take no value
+VALUELESS_OPERATORS = ('isnull', 'notnull')
+
+FILTER_OPS = (*FILTER_OPERATORS, 'in', 'contains', *VALUELESS_OPERATORS)
+
+# Aggregates that only make sense on numbers (booleans count as 0/1)
+NUMERIC_AGGREGATES = ('sum', 'mean')
+
+
+class QueryError(ValueError):
+    """Raised for invalid column names, operators or values in a query"""
+
+
+def parse_filter_param(param):
+    """
+    Parse a ``column:op:value`` query-string filter
+
+    ``in`` takes ``|``-separated values; column names may not contain ``:``.
+
+    Returns:
+        dict with column, op and value
+    """
+    try:
+        column, op, value = param.split(':', 2)
+    except ValueError:
+        raise QueryError(f"Invalid filter '{param}', expected column:op:value.")
+    if op == 'in':
+        value = value.split('|')
+    return normalize_filter({'column': column, 'op': op, 'value': value})
+
+
+def _cast_value(value, arrow_type):
+    """Convert a filter value (usually a string) to the column's Arrow type"""
+    if pa.types.is_dictionary(arrow_type):
+        # Categorical columns compare against their values, not their codes
+        arrow_type = arrow_type.value_type
+    try:
+        return pc.cast(pa.array([value]), arrow_type)[0]
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        raise QueryError(f"Cannot compare {arrow_type} column with {value!r}.")
+
+
+def validate_columns(schema, columns):
+    unknown = [column for column in columns if schema.get_field_index(column) == -1]
+    if unknown:
+        raise QueryError(f"Unknown column(s): {', '.join(unknown)}")
+
+
+def _condition(operand, arrow_type, op, value):
+    """
+    Build one filter condition
+
+    ``operand`` is either an Arrow array (evaluated eagerly) or a dataset
+    field expression (evaluated by the scanner, which can push it down).
+    """
+    if op in FILTER_OPERATORS:
+        return FILTER_OPERATORS[op](operand, _cast_value(value, arrow_type))
+    if op == 'in':
+        if not isinstance(value, (list, tuple)):
+            raise QueryError("The 'in' operator needs a list of values.")
+        if pa.types.is_dictionary(arrow_type):
+            arrow_type = arrow_type.value_type
+        try:
+            values = pc.cast(pa.array(list(value)), arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            raise QueryError(f"Cannot compare {arrow_type} column with {value!r}.")
+        return pc.is_in(operand, value_set=values, skip_nulls=True)
+    if op == 'contains':
+        if isinstance(operand, ds.Expression):
+            text = operand.cast(pa.string())
+        else:
+            text = pc.cast(operand, pa.string())
+        return pc.match_substring(text, str(value), ignore_case=True)
+    if op == 'isnull':
+        return pc.is_null(operand)
+    if op == 'notnull':
+        return pc.is_valid(operand)
+    raise QueryError(f"Unknown filter operator '{op}'.")
+
+
+def filter_mask(table, filters):
+    """
+    Evaluate filters against an Arrow table
+
+    Returns:
+        Boolean Arrow array (nulls count as non-matching)
+    """
+    mask = None
+    for spec in filters:
+        column = table.column(spec['column'])
+        condition = pc.fill_null(_condition(column, column.type, spec['op'], spec['value']), False)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return mask
+
+
+def filter_expression(schema, filters):
+    """
+    Combine filters into a dataset expression for predicate pushdown
+
+    Returns:
+        pyarrow.dataset Expression, or None when there are no filters
+    """
+    expression = None
+    for spec in filters:
+        field_type = schema.field(spec['column']).type
+        condition = _condition(ds.field(spec['column']), field_type, spec['op'], spec['value'])
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _row_group_may_match(row_group, schema, filters):
+    """
+    Use Parquet min/max statistics to decide whether a row group can be skipped
+
+    Only comparison operators are checked; anything else is assumed to match.
+    """
+    for spec in filters:
+        if spec['op'] not in ('eq', 'lt', 'lte', 'gt', 'gte'):
+            continue
+        index = schema.get_field_index(spec['column'])
+        stats = row_group.column(index).statistics
+        if stats is None or not stats.has_min_max:
+            continue
+        try:
+            value = _cast_value(spec['value'], schema.field(index).type).as_py()
+            low, high = stats.min, stats.max
+            if spec['op'] == 'eq' and (value < low or value > high):
+                return False
+            if spec['op'] == 'lt' and low >= value:
+                return False
+            if spec['op'] == 'lte' and low > value:
+                return False
+            if spec['op'] == 'gt' and high <= value:
+                return False
+            if spec['op'] == 'gte' and high < value:
+                return False
+        except (QueryError, TypeError):
+            continue
+    return True
+
+
+def decode_dictionary(values):
+    """Plain values of a dictionary-encoded (categorical) column; sorting needs them"""
+    if pa.types.is_dictionary(values.type):
+        return pc.cast(values, values.type.value_type)
+    return values
+
+
+def get_table_path(dataset, sheet=0):
+    """
+    Cache file of one table of a dataset, built on demand
+
+    Sheet 0 is the dataset itself; higher positions are the other worksheets
+    of an Excel workbook.
+    """
+    cache_path = ensure_cache(dataset)
+    if sheet:
+        cache_path = get_cache_path(dataset, sheet)
+        if not cache_path.exists():
+            raise QueryError(f"Dataset has no sheet {sheet}.")
+    return cache_path
+
+
+def _row_group_starts(parquet_file):
+    sizes = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+    return np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+
+def take_positions(parquet_file, positions, columns):
+    """
+    Read the rows at the given positions, touching only the row groups that hold them
+
+    Returns:
+        Arrow table with the rows in the order of ``positions``
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if not len(positions):
+        return parquet_file.schema_arrow.empty_table().select(columns)
+
+    starts = _row_group_starts(parquet_file)
+    groups = np.searchsorted(starts, positions, side='right') - 1
+    unique_groups = np.unique(groups)
+    tables = [parquet_file.read_row_group(int(group), columns=columns) for group in unique_groups]
+
+    # Offsets of each row group within the concatenated table
+    group_offsets = np.concatenate([[0], np.cumsum([len(table) for table in tables])])
+    group_slot = np.searchsorted(unique_groups, groups)
+    indices = group_offsets[group_slot] + (positions - starts[groups])
+    return pa.concat_tables(tables).take(pa.array(indices))
+
+
+def _read_positions(parquet_file, positions, columns):
+    """Rows at sorted ``positions``, reading one row group at a time"""
+    starts = _row_group_starts(parquet_file)
+    tables = []
+    for group in range(parquet_file.num_row_groups):
+        lo, hi = np.searchsorted(positions, [starts[group], starts[group + 1]])
+        if lo < hi:
+            table = parquet_file.read_row_group(group, columns=columns)
+            tables.append(table.take(pa.array(positions[lo:hi] - starts[group])))
+    return pa.concat_tables(tables) if tables else parquet_file.schema_arrow.empty_table().select(columns)
+
+
+def read_sample(parquet_file, rows, columns=None):
+    """
+    Systematic sample of about ``rows`` evenly spaced rows
+
+    Row groups are read one at a time, so memory holds the sample plus a
+    single row group of the requested columns.
+
+    Returns:
+        Arrow table with the sampled rows in file order
+    """
+    columns = list(columns) if columns is not None else parquet_file.schema_arrow.names
+    total = parquet_file.metadata.num_rows
+    if rows >= total:
+        return parquet_file.read(columns=columns)
+    return _read_positions(parquet_file, np.linspace(0, total - 1, rows).astype(np.int64), columns)
+
+
+def get_sample_path(dataset, sheet=0):
+    """
+    Persisted random sample of a dataset table, built on demand
+
+    A simple random sample of ``APPROX_SAMPLE_ROWS`` rows, drawn without
+    replacement and seeded by the dataset id. This is the sample a
+    reservoir would hold; it is drawn directly because the Parquet footer
+    already gives the row count. It is kept next to the cache file, so it
+    is rebuilt whenever the file content changes.
+
+    Returns:
+        Path of the sample's Parquet file
+    """
+    cache_path = get_table_path(dataset, sheet)
+    sample_path = cache_path.with_name(f"{cache_path.stem}.sample.parquet")
+    if sample_path.exists() and sample_path.stat().st_mtime >= cache_path.stat().st_mtime:
+        return sample_path
+
+    logger.info("Building sample of dataset %s", dataset.pk)
+    parquet_file = pq.ParquetFile(cache_path)
+    total = parquet_file.metadata.num_rows
+    rows = min(getattr(settings, 'APPROX_SAMPLE_ROWS', 50_000), total)
+    positions = np.sort(np.random.default_rng(dataset.pk).choice(total, rows, replace=False))
+    table = _read_positions(parquet_file, positions, parquet_file.schema_arrow.names)
+    tmp_path = sample_path.with_name(f"{sample_path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, sample_path)
+    return sample_path
+
+
+def _null_count(parquet_file, column):
+    """Nulls in a column, from row group statistics when they are available"""
+    index = parquet_file.schema_arrow.get_field_index(column)
+    total = 0
+    for group in range(parquet_file.num_row_groups):
+        stats = parquet_file.metadata.row_group(group).column(index).statistics
+        if stats is None or not stats.has_null_count:
+            return parquet_file.read(columns=[column]).column(0).null_count
+        total += stats.null_count
+    return total
+
+
+def get_sort_index(dataset, cache_path, column, parquet_file):
+    """
+    Row permutation that sorts the table by ``column`` (ascending, nulls last)
+
+    Built once per cached file and column, then memory-mapped from disk on
+    later requests so paging a sorted view never re-sorts the data.
+    """
+    column_hash = hashlib.sha1(column.encode()).hexdigest()[:12]
+    index_path = cache_path.with_name(f"{cache_path.stem}.sort-{column_hash}.npy")
+    if index_path.exists() and index_path.stat().st_mtime >= cache_path.stat().st_mtime:
+        return np.load(index_path, mmap_mode='r')
+
+    logger.info("Building sort index on %r for dataset %s", column, dataset.pk)
+    values = decode_dictionary(parquet_file.read(columns=[column]).column(0))
+    permutation = pc.array_sort_indices(values, null_placement='at_end').to_numpy()
+    tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp.npy")
+    np.save(tmp_path, permutation)
+    os.replace(tmp_path, index_path)
+    return permutation
+
+
+def _scan_filtered(parquet_file, filters, offset, limit, columns):
+    """
+    Page through filtered rows in file order, stopping as soon as the page is full
+
+    Row groups whose statistics rule out a match are skipped without being
+    decoded, and only the filter columns are read for the rest.
+    """
+    schema = parquet_file.schema_arrow
+    filter_columns = sorted({spec['column'] for spec in filters})
+    starts = _row_group_starts(parquet_file)
+    skipped = 0
+    positions = []
+    for group in range(parquet_file.num_row_groups):
+        if not _row_group_may_match(parquet_file.metadata.row_group(group), schema, filters):
+            continue
+        mask = filter_mask(parquet_file.read_row_group(group, columns=filter_columns), filters)
+        matches = np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+        if skipped + len(matches) <= offset:
+            skipped += len(matches)
+            continue
+        matches = matches[max(offset - skipped, 0):]
+        skipped = offset
+        positions.extend((matches + starts[group])[:limit + 1 - len(positions)])
+        if len(positions) > limit:
+            break
+    has_more = len(positions) > limit
+    return take_positions(parquet_file, positions[:limit], columns), has_more
+
+
+def count_matching(parquet_file, filters):
+    """Number of rows matching the filters, reading only the filter columns"""
+    schema = parquet_file.schema_arrow
+    filter_columns = sorted({spec['column'] for spec in filters})
+    total = 0
+    for group in range(parquet_file.num_row_groups):
+        if not _row_group_may_match(parquet_file.metadata.row_group(group), schema, filters):
+            continue
+        mask = filter_mask(parquet_file.read_row_group(group, columns=filter_columns), filters)
+        total += pc.sum(mask).as_py() or 0
+    return total
+
+
+def iter_filtered_tables(parquet_file, columns, filters=None):
+    """
+    Yield the matching rows one row group at a time, in file order
+
+    Row groups ruled out by their statistics are skipped; memory holds a
+    single row group of the projected and filter columns.
+    """
+    schema = parquet_file.schema_arrow
+    filters = filters or []
+    read_columns = list(dict.fromkeys(list(columns) + [spec['column'] for spec in filters]))
+    for group in range(parquet_file.num_row_groups):
+        if not _row_group_may_match(parquet_file.metadata.row_group(group), schema, filters):
+            continue
+        table = parquet_file.read_row_group(group, columns=read_columns)
+        if filters:
+            table = table.filter(filter_mask(table, filters))
+        yield table.select(columns)
+
+
+def read_rows(dataset, offset=0, limit=100, columns=None, sort=None, descending=False, filters=None,
+              with_total=False, sheet=0):
+    """
+    Read one page of rows from a dataset's columnar cache
+
+    Args:
+        dataset: Dataset instance
+        offset: Number of matching rows to skip
+        limit: Page size, capped at MAX_PAGE_SIZE
+        columns: Columns to return (projection); defaults to all
+        sort: Optional column to order by
+        descending: Reverse the sort order
+        filters: List of {'column', 'op', 'value'} dicts, combined with AND
+        with_total: Also count matching rows when filters are given
+        sheet: Worksheet position, for Excel datasets
+
+    Returns:
+        dict with columns, rows, total (None when unknown) and has_more
+    """
+    cache_path = get_table_path(dataset, sheet)
+    parquet_file = pq.ParquetFile(cache_path)
+    schema = parquet_file.schema_arrow
+    columns = list(columns) if columns else schema.names
+    filters = filters or []
+    offset = max(int(offset), 0)
+    limit = min(max(int(limit), 1), MAX_PAGE_SIZE)
+    validate_columns(schema, columns + [spec['column'] for spec in filters] + ([sort] if sort else []))
+
+    total = None
+    if sort:
+        permutation = get_sort_index(dataset, cache_path, sort, parquet_file)
+        if descending:
+            # Keep nulls last when reversing the ascending order
+            valid = parquet_file.metadata.num_rows - _null_count(parquet_file, sort)
+            permutation = np.concatenate([permutation[:valid][::-1], permutation[valid:]])
+        if filters:
+            mask = filter_mask(parquet_file.read(columns=sorted({s['column'] for s in filters})), filters)
+            mask = mask.to_numpy(zero_copy_only=False)
+            permutation = permutation[mask[permutation]]
+        total = len(permutation)
+        table = take_positions(parquet_file, permutation[offset:offset + limit], columns)
+        has_more = offset + limit < total
+    elif filters:
+        table, has_more = _scan_filtered(parquet_file, filters, offset, limit, columns)
+        if with_total:
+            total = count_matching(parquet_file, filters)
+    else:
+        total = parquet_file.metadata.num_rows
+        positions = np.arange(offset, min(offset + limit, total))
+        table = take_positions(parquet_file, positions, columns)
+        has_more = offset + limit < total
+
+    return {
+        'columns': columns,
+        'rows': [list(row) for row in zip(*(table.column(column).to_pylist() for column in columns))],
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'has_more': has_more,
+    }
+
+
+def _require_list(spec, key):
+    value = spec.get(key) or []
+    if not isinstance(value, list):
+        raise QueryError(f"'{key}' must be a list.")
+    return value
+
+
+def normalize_filter(item):
+    """Validate one filter, defaulting ``value`` to None for isnull/notnull"""
+    if not isinstance(item, dict) or 'column' not in item or 'op' not in item:
+        raise QueryError("Each filter needs 'column' and 'op'.")
+    op = item['op']
+    if op not in FILTER_OPS:
+        raise QueryError(f"Filter 'op' must be one of {', '.join(FILTER_OPS)}.")
+    value = item.get('value')
+    if op not in VALUELESS_OPERATORS and value is None:
+        raise QueryError(f"Filter '{op}' on '{item['column']}' needs a value.")
+    if op == 'in' and not isinstance(value, (list, tuple)):
+        raise QueryError("The 'in' operator needs a list of values.")
+    return {'column': item['column'], 'op': op, 'value': None if op in VALUELESS_OPERATORS else value}
+
+
+def normalize_query(spec):
+    """
+    Validate a declarative query spec and fill in defaults
+
+    A spec is a dict with optional keys:
+        filters: [{'column', 'op', 'value'}], combined with AND
+        group_by: [column, ...]
+        time_bucket: {'column', 'unit', 'as'}, an extra group key truncating a
+            date column to one of TIME_BUCKET_UNITS
+        aggregates: [{'column', 'func', 'as'}] with func from
+            AGGREGATE_FUNCTIONS; 'count' without a column counts rows
+        columns: projection when there are no aggregates
+        order_by: [{'column', 'descending'}] over the output columns
+        limit: maximum number of output rows
+
+    Returns:
+        Normalized copy of the spec
+
+    Raises:
+        QueryError: for malformed specs
+    """
+    if not isinstance(spec, dict):
+        raise QueryError("The query must be a JSON object.")
+
+    filters = [normalize_filter(item) for item in _require_list(spec, 'filters')]
+
+    aggregates = []
+    for item in _require_list(spec, 'aggregates'):
+        func = item.get('func') if isinstance(item, dict) else None
+        if func not in AGGREGATE_FUNCTIONS:
+            raise QueryError(f"Aggregate 'func' must be one of {', '.join(AGGREGATE_FUNCTIONS)}.")
+        column = item.get('column')
+        if column is None and func != 'count':
+            raise QueryError(f"Aggregate '{func}' needs a column.")
+        aggregates.append({
+            'column': column,
+            'func': func,
+            'as': item.get('as') or (f"{column}_{func}" if column else 'count'),
+        })
+
+    time_bucket = spec.get('time_bucket')
+    if time_bucket is not None:
+        if not isinstance(time_bucket, dict) or 'column' not in time_bucket:
+            raise QueryError("'time_bucket' needs a column.")
+        unit = time_bucket.get('unit', 'day')
+        if unit not in TIME_BUCKET_UNITS:
+            raise QueryError(f"Time bucket unit must be one of {', '.join(TIME_BUCKET_UNITS)}.")
+        time_bucket = {
+            'column': time_bucket['column'],
+            'unit': unit,
+            'as': time_bucket.get('as') or f"{time_bucket['column']}_{unit}",
+        }
+
+    order_by = []
+    for item in _require_list(spec, 'order_by'):
+        if isinstance(item, str):
+            item = {'column': item.lstrip('-'), 'descending': item.startswith('-')}
+        if not isinstance(item, dict) or 'column' not in item:
+            raise QueryError("Each 'order_by' entry needs a column.")
+        order_by.append({'column': item['column'], 'descending': bool(item.get('descending'))})
+
+    limit = spec.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise QueryError("'limit' must be an integer.")
+        if limit < 0:
+            raise QueryError("'limit' must not be negative.")
+
+    group_by = [str(column) for column in _require_list(spec, 'group_by')]
+    columns = [str(column) for column in _require_list(spec, 'columns')]
+    if aggregates:
+        output = group_by + ([time_bucket['as']] if time_bucket else []) + [item['as'] for item in aggregates]
+    else:
+        output = columns
+    duplicates = sorted({name for name in output if output.count(name) > 1})
+    if duplicates:
+        raise QueryError(f"Duplicate output column(s): {', '.join(duplicates)}. Use 'as' to rename them.")
+
+    return {
+        'filters': filters,
+        'group_by': group_by,
+        'time_bucket': time_bucket,
+        'aggregates': aggregates,
+        'columns': columns,
+        'order_by': order_by,
+        'limit': limit,
+    }
+
+
+def referenced_columns(spec):
+    """Source columns a normalized query reads, in first-use order"""
+    columns = list(spec['columns']) + list(spec['group_by'])
+    if spec['time_bucket']:
+        columns.append(spec['time_bucket']['column'])
+    columns += [item['column'] for item in spec['aggregates'] if item['column']]
+    columns += [item['column'] for item in spec['filters']]
+    return list(dict.fromkeys(columns))
+
+
+def _value_type(arrow_type):
+    return arrow_type.value_type if pa.types.is_dictionary(arrow_type) else arrow_type
+
+
+def _is_temporal(arrow_type):
+    return pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type)
+
+
+def check_query_types(schema, spec):
+    """
+    Check a normalized query's aggregates and time bucket against column types
+
+    Raises:
+        QueryError: for sum/mean of a non-numeric column, or a time bucket
+            over a column that is neither a date nor text
+    """
+    for item in spec['aggregates']:
+        if item['func'] not in NUMERIC_AGGREGATES:
+            continue
+        arrow_type = _value_type(schema.field(item['column']).type)
+        if not (pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type)
+                or pa.types.is_decimal(arrow_type) or pa.types.is_boolean(arrow_type)):
+            raise QueryError(f"Cannot {item['func']} column '{item['column']}' of type {arrow_type}.")
+    if spec['time_bucket']:
+        column = spec['time_bucket']['column']
+        arrow_type = _value_type(schema.field(column).type)
+        if not (_is_temporal(arrow_type) or pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)):
+            raise QueryError(f"Cannot bucket column '{column}' of type {arrow_type} by time.")
+
+
+def _to_timestamp(values):
+    """
+    Cast a column to timestamps, parsing strings when needed
+
+    Raises:
+        QueryError: when some non-null values are not dates
+    """
+    if _is_temporal(values.type):
+        return values
+    try:
+        return pc.cast(values, pa.timestamp('ns'))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        parsed = pa.chunked_array([pd.to_datetime(values.to_pandas(), errors='coerce')])
+    if parsed.null_count > values.null_count:
+        raise QueryError("The time bucket column contains values that are not dates.")
+    return parsed
+
+
+def _execute(path, source, spec, columns, sample_rows):
+    """Scan, filter and aggregate for run_query(), before ordering and limiting"""
+    schema = source.schema
+    read_columns = columns if columns or spec['aggregates'] else schema.names
+    expression = filter_expression(schema, spec['filters'])
+    if sample_rows:
+        table = read_sample(pq.ParquetFile(path), sample_rows, read_columns)
+        if expression is not None:
+            table = table.filter(expression)
+    else:
+        table = source.to_table(columns=read_columns, filter=expression)
+
+    if not spec['aggregates']:
+        return table.select(spec['columns'] or schema.names)
+
+    # Group keys get private names, so they cannot clash with aggregate
+    # results or with a column that is also aggregated
+    keys = [table.column(column) for column in spec['group_by']]
+    if spec['time_bucket']:
+        bucket = spec['time_bucket']
+        keys.append(pc.floor_temporal(_to_timestamp(table.column(bucket['column'])), unit=bucket['unit']))
+    key_names = [f"\0key{index}" for index in range(len(keys))]
+    # Identical aggregates under different names are computed once
+    targets = list(dict.fromkeys((item['column'], item['func']) for item in spec['aggregates']))
+    for name, values in zip(key_names, keys):
+        table = table.append_column(name, values)
+    grouped = table.group_by(key_names).aggregate([
+        ([], 'count_all') if column is None else (column, func) for column, func in targets
+    ])
+
+    arrays = [grouped.column(name) for name in key_names]
+    arrays += [grouped.column('count_all' if item['column'] is None else f"{item['column']}_{item['func']}")
+               for item in spec['aggregates']]
+    names = list(spec['group_by']) + ([spec['time_bucket']['as']] if spec['time_bucket'] else [])
+    return pa.Table.from_arrays(arrays, names=names + [item['as'] for item in spec['aggregates']])
+
+
+def run_query(dataset, spec, sheet=0, sample_rows=None, use_sample=False):
+    """
+    Execute a declarative query against a dataset's columnar cache
+
+    Only the referenced columns are read, and filters are pushed into the
+    Parquet scan so row groups ruled out by their statistics are skipped.
+    Grouping and aggregation run vectorized in Arrow.
+
+    Args:
+        dataset: Dataset instance
+        spec: Query spec, see normalize_query()
+        sheet: Worksheet position, for Excel datasets
+        sample_rows: Run on an evenly spaced sample of this many rows
+            instead (see read_sample()); counts and sums then cover the
+            sample only
+        use_sample: Run on the persisted random sample instead (see
+            get_sample_path()); counts and sums cover the sample only
+
+    Returns:
+        pyarrow Table with the result
+    """
+    spec = normalize_query(spec)
+    path = get_sample_path(dataset, sheet) if use_sample else get_table_path(dataset, sheet)
+    source = ds.dataset(path, format='parquet')
+    schema = source.schema
+    columns = referenced_columns(spec)
+    validate_columns(schema, columns)
+    if not spec['aggregates'] and (spec['group_by'] or spec['time_bucket']):
+        raise QueryError("Grouping requires at least one aggregate.")
+    check_query_types(schema, spec)
+
+    try:
+        table = _execute(path, source, spec, columns, sample_rows)
+        if spec['order_by']:
+            validate_columns(table.schema, [item['column'] for item in spec['order_by']])
+            for item in spec['order_by']:
+                index = table.schema.get_field_index(item['column'])
+                table = table.set_column(index, item['column'], decode_dictionary(table.column(index)))
+            table = table.sort_by([
+                (item['column'], 'descending' if item['descending'] else 'ascending') for item in spec['order_by']
+            ])
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+        # Anything the checks above did not anticipate is still the spec's fault
+        raise QueryError(f"Cannot run this query: {e}")
+    if spec['limit'] is not None:
+        table = table.slice(0, spec['limit'])
+    return table
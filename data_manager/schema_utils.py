@@ -0,0 +1,297 @@
+import logging
+import warnings
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# A text column becomes categorical when at most this share of its values
+# are distinct, so each category is repeated at least twice on average.
+CATEGORY_MAX_RATIO = 0.5
+
+# Values sampled to decide whether a text column holds dates before the
+# whole column is parsed.
+DATETIME_SAMPLE_SIZE = 1000
+
+# Pandas' default dtypes; a stored schema holding one of these may predate
+# inference, so such columns are inferred again rather than trusted.
+DEFAULT_DTYPES = {'object', 'str', 'string', 'int64', 'float64'}
+
+
+def _is_text(series):
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        return False
+    return pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty')
+
+
+def _parse_datetimes(values):
+    """Parse text values as datetimes, or return None if any of them is not a date"""
+    sample = values.iloc[:DATETIME_SAMPLE_SIZE]
+    if pd.to_numeric(sample, errors='coerce').notna().any():
+        # Numbers such as years or ids parse as dates too; keep them as they are
+        return None
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        try:
+            pd.to_datetime(sample)
+            parsed = pd.to_datetime(values)
+        except (ValueError, TypeError, OverflowError):
+            return None
+    return parsed if pd.api.types.is_datetime64_any_dtype(parsed.dtype) else None
+
+
+def _smallest_int(values, nullable=False):
+    """Smallest signed integer dtype holding every value"""
+    low, high = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            name = np.dtype(dtype).name
+            return name.capitalize() if nullable else name
+    return None
+
+
+def optimize_series(series):
+    """
+    Convert a column to the most compact dtype that loses no information
+
+    - text with few distinct values becomes ``category``
+    - text that parses entirely as dates becomes ``datetime64``
+    - true/false values mixed with missing values become ``boolean``
+    - integers shrink to the smallest width that holds them
+    - floats holding only whole numbers and missing values become nullable
+      integers; other floats become ``float32`` when that is exact
+
+    Returns:
+        The converted Series (the input when nothing fits better)
+    """
+    values = series.dropna()
+    if not len(values):
+        return series
+
+    if _is_text(series):
+        parsed = _parse_datetimes(values)
+        if parsed is not None:
+            return parsed.reindex(series.index)
+        if values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+            return series.astype('category')
+        return series
+
+    if pd.api.types.is_object_dtype(series.dtype) and pd.api.types.infer_dtype(values) == 'boolean':
+        return series.astype('boolean')
+    if pd.api.types.is_bool_dtype(series.dtype) or not pd.api.types.is_numeric_dtype(series.dtype):
+        return series
+
+    if pd.api.types.is_integer_dtype(series.dtype):
+        dtype = _smallest_int(values, nullable=isinstance(series.dtype, pd.api.extensions.ExtensionDtype))
+        return series.astype(dtype) if dtype and dtype != str(series.dtype) else series
+
+    if pd.api.types.is_float_dtype(series.dtype):
+        array = values.to_numpy(dtype=np.float64)
+        if not np.isfinite(array).all():
+            return series
+        if (np.mod(array, 1) == 0).all():
+            dtype = _smallest_int(array, nullable=True)
+            if dtype and len(values) < len(series):
+                return series.astype(dtype)
+            if dtype:
+                return series.astype(dtype.lower())
+        if str(series.dtype) == 'float64' and np.array_equal(array.astype(np.float32).astype(np.float64), array):
+            return series.astype(np.float32)
+    return series
+
+
+def optimize_dtypes(df):
+    """Apply optimize_series() to every column of a DataFrame, in place"""
+    for column in df.columns:
+        df[column] = optimize_series(df[column])
+    return df
+
+
+def get_stored_schema(dataset):
+    """
+    Dtypes recorded for a dataset's columns at its last ingestion
+
+    Returns:
+        dict mapping column name to the dtype string kept in
+        DataColumn.data_type, in column order
+    """
+    return dict(dataset.columns.order_by('position').values_list('name', 'data_type'))
+
+
+def get_stored_sheet_schemas(dataset):
+    """
+    Stored dtypes of every worksheet of an Excel dataset
+
+    Returns:
+        {sheet position: schema}; sheet 0 is the dataset's main table
+    """
+    schemas = {sheet.position: dict(sheet.columns) for sheet in dataset.sheets.filter(position__gt=0)}
+    schemas[0] = get_stored_schema(dataset)
+    return schemas
+
+
+def read_csv_options(schema):
+    """
+    read_csv() keyword arguments that parse straight into a stored schema
+
+    Columns are read into their compact dtypes directly, so the parser never
+    materializes the default int64/object representation.
+    """
+    parse_dates = [name for name, dtype in schema.items() if dtype.startswith('datetime64')]
+    dtypes = {name: dtype for name, dtype in schema.items()
+              if dtype not in DEFAULT_DTYPES and not dtype.startswith('datetime64')}
+    return {'dtype': dtypes, 'parse_dates': parse_dates}
+
+
+def cast_series(series, dtype):
+    """Cast a column to a dtype (a name or a dtype object), parsing text dates"""
+    if str(dtype).startswith('datetime64'):
+        return pd.to_datetime(series).astype(dtype)
+    return series.astype(dtype)
+
+
+def apply_schema(df, schema):
+    """
+    Cast columns to the dtypes of a stored schema
+
+    Only meant for the file content the schema was inferred from: casts to a
+    narrower integer are not range checked. Columns missing from the schema,
+    stored with one of the DEFAULT_DTYPES, or that cannot be cast, are
+    inferred afresh with optimize_series().
+
+    Returns:
+        The DataFrame, converted in place
+    """
+    for column in df.columns:
+        dtype = schema.get(str(column))
+        if dtype is None or dtype in DEFAULT_DTYPES:
+            df[column] = optimize_series(df[column])
+            continue
+        if str(df[column].dtype) == dtype:
+            continue
+        try:
+            df[column] = cast_series(df[column], dtype)
+        except (ValueError, TypeError, OverflowError):
+            logger.info("Column %r no longer fits its stored dtype %s; inferring again", column, dtype)
+            df[column] = optimize_series(df[column])
+    return df
+
+
+def _kind(dtype):
+    name = str(dtype)
+    if name.startswith(('int', 'Int')):
+        return 'int'
+    if name.startswith('float'):
+        return 'float'
+    if name in ('bool', 'boolean'):
+        return 'bool'
+    if name.startswith('datetime64'):
+        return name
+    if name in ('category', 'str', 'string'):
+        # Strings may still be few enough across all batches for a categorical
+        return 'category'
+    return 'text'
+
+
+class SchemaBuilder:
+    """
+    Infer one compact schema from a stream of DataFrame batches
+
+    Each batch is inferred on its own with optimize_series() and the batch
+    dtypes are merged: integers widen, integers and floats meet at float64,
+    strings become categorical when the distinct values of all batches are
+    few enough, and any other disagreement falls back to text. Memory
+    stays bounded by the batch plus the categories seen so far (at most
+    ``max_categories`` per column).
+    """
+
+    def __init__(self, max_categories=65536):
+        self.max_categories = max_categories
+        self.rows = 0
+        self.columns = {}
+
+    def update(self, df):
+        """
+        Fold a batch into the schema
+
+        Returns:
+            The batch with its own compact dtypes, smaller to keep around
+        """
+        for column in df.columns:
+            series = optimize_series(df[column])
+            df[column] = series
+            state = self.columns.setdefault(column, {
+                'kind': None, 'width': 0, 'float32': True, 'nulls': self.rows > 0, 'count': 0,
+                'categories': set(),
+            })
+            count = int(series.notna().sum())
+            state['nulls'] = state['nulls'] or count < len(series)
+            if not count:
+                continue
+            state['count'] += count
+            self._merge(state, series)
+        for column, state in self.columns.items():
+            if column not in df.columns:
+                state['nulls'] = True
+        self.rows += len(df)
+        return df
+
+    def _merge(self, state, series):
+        kind = _kind(series.dtype)
+        if state['kind'] is None:
+            state['kind'] = kind
+        elif {state['kind'], kind} == {'int', 'float'}:
+            state['kind'] = 'float'
+            state['float32'] = False
+        elif state['kind'] != kind:
+            state['kind'] = 'text'
+
+        if state['kind'] == 'int':
+            state['width'] = max(state['width'], np.dtype(str(series.dtype).lower()).itemsize)
+        elif state['kind'] == 'float':
+            state['float32'] = state['float32'] and str(series.dtype) == 'float32'
+        elif state['kind'] == 'category':
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                state['categories'].update(series.cat.categories)
+            else:
+                state['categories'].update(series.dropna().unique())
+            if len(state['categories']) > self.max_categories:
+                state['kind'] = 'text'
+        if state['kind'] != 'category':
+            state['categories'] = set()
+
+    def schema(self):
+        """
+        The merged schema
+
+        Returns:
+            {column: dtype} in first-seen column order; categoricals map to a
+            CategoricalDtype so every batch is encoded the same way
+        """
+        schema = {}
+        for column, state in self.columns.items():
+            kind = state['kind']
+            if kind == 'int':
+                name = f"int{state['width'] * 8}"
+                schema[column] = name.capitalize() if state['nulls'] else name
+            elif kind == 'float':
+                schema[column] = 'float32' if state['float32'] else 'float64'
+            elif kind == 'bool':
+                schema[column] = 'boolean' if state['nulls'] else 'bool'
+            elif kind == 'category' and len(state['categories']) <= CATEGORY_MAX_RATIO * state['count']:
+                schema[column] = pd.CategoricalDtype(sorted(state['categories']))
+            elif kind and kind.startswith('datetime64'):
+                schema[column] = kind
+            else:
+                schema[column] = 'str'
+        return schema
+
+
+def conform(df, schema):
+    """Reorder, fill in and cast a batch's columns to match a SchemaBuilder schema"""
+    df = df.reindex(columns=list(schema))
+    for column, dtype in schema.items():
+        df[column] = cast_series(df[column], dtype)
+    return df
@@ -0,0 +1,172 @@
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Dataset, DataColumn
+
+# FTS5 table created by migration 0014; its rowid is the dataset id
+SEARCH_TABLE = 'data_manager_search'
+
+# bm25() weights of the indexed fields: name, description, columns, values
+FIELD_WEIGHTS = (10.0, 2.0, 5.0, 1.0)
+
+MAX_RESULTS = 50
+MAX_TERMS = 10
+
+_TERM = re.compile(r'\w+')
+
+
+def is_supported():
+    """Whether the database has the FTS5 index (SQLite only)"""
+    return connection.vendor == 'sqlite'
+
+
+def _column_values(column):
+    """Text of a column's most frequent values, the sample of its content that is indexed"""
+    if column['kind'] != 'CATEGORICAL':
+        return []
+    limit = getattr(settings, 'SEARCH_VALUES_PER_COLUMN', 10)
+    return [str(value) for value, _ in column['top_values'][:limit] if value is not None]
+
+
+def index_datasets(dataset_ids):
+    """
+    Write the search index rows of the given datasets
+
+    Datasets that no longer exist are removed from the index.
+    """
+    if not is_supported() or not dataset_ids:
+        return
+    dataset_ids = list(dataset_ids)
+    datasets = Dataset.objects.filter(pk__in=dataset_ids).values_list('pk', 'name', 'description')
+    columns = {}
+    for column in (DataColumn.objects.filter(dataset_id__in=dataset_ids)
+                   .values('dataset_id', 'name', 'kind', 'top_values').order_by('dataset_id', 'position')):
+        names, values = columns.setdefault(column['dataset_id'], ([], []))
+        names.append(column['name'])
+        values.extend(_column_values(column))
+
+    rows = [(pk, name, description or '', ' '.join(columns.get(pk, ([], []))[0]),
+             ' '.join(columns.get(pk, ([], []))[1])) for pk, name, description in datasets]
+    placeholders = ', '.join(['%s'] * len(dataset_ids))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", dataset_ids)
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, columns, vals) VALUES (%s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def remove_from_index(dataset_id):
+    if is_supported():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [dataset_id])
+
+
+_pending = threading.local()
+
+
+def _pending_ids():
+    """Datasets waiting for the current thread's transaction to commit"""
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    return _pending.ids
+
+
+def _index_pending():
+    ids = _pending_ids()
+    if ids:
+        dataset_ids = list(ids)
+        ids.clear()
+        index_datasets(dataset_ids)
+
+
+def schedule_index(dataset_id):
+    """
+    Re-index a dataset once the current transaction commits
+
+    Datasets scheduled during a transaction are collected and written with
+    a single index_datasets() call when it commits. Outside a transaction
+    the dataset is indexed immediately. Datasets scheduled in a transaction
+    that rolls back are re-indexed with the next commit, which is harmless
+    because the index is rebuilt from the database rows.
+    """
+    _pending_ids().add(dataset_id)
+    # Later callbacks of the same commit find nothing left to index
+    transaction.on_commit(_index_pending)
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Index every dataset from scratch
+
+    Returns:
+        Number of datasets indexed
+    """
+    if not is_supported():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    ids = list(Dataset.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        index_datasets(ids[start:start + batch_size])
+    return len(ids)
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query
+
+    Every word must match, as a prefix of an indexed word; punctuation and
+    FTS5 operators in the input are ignored.
+
+    Returns:
+        The MATCH expression, or '' when the text has no words
+    """
+    terms = _TERM.findall(text.lower())[:MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_datasets(user, text, limit=20):
+    """
+    Datasets readable by ``user`` that match ``text``, best match first
+
+    The FTS5 index is ranked with bm25(), weighting name matches over
+    column names, descriptions and column values, and joined with the
+    dataset table so permissions are applied inside the same query.
+
+    Returns:
+        List of (dataset, score) pairs; lower scores rank higher
+    """
+    limit = min(max(int(limit), 1), MAX_RESULTS)
+    match = build_match_query(text)
+    if not match:
+        return []
+    if not is_supported():
+        return _search_fallback(user, text, limit)
+
+    weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {SEARCH_TABLE}.rowid, bm25({SEARCH_TABLE}, {weights}) AS score "
+            f"FROM {SEARCH_TABLE} JOIN data_manager_dataset d ON d.id = {SEARCH_TABLE}.rowid "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND (d.owner_id = %s OR d.is_public) "
+            f"ORDER BY score LIMIT %s",
+            [match, user.pk, limit],
+        )
+        hits = cursor.fetchall()
+    datasets = Dataset.objects.select_related('owner').in_bulk([pk for pk, _ in hits])
+    return [(datasets[pk], score) for pk, score in hits if pk in datasets]
+
+
+def _search_fallback(user, text, limit):
+    """Unranked substring search for databases without FTS5"""
+    query = Q()
+    for term in _TERM.findall(text)[:MAX_TERMS]:
+        query &= Q(name__icontains=term) | Q(description__icontains=term) | Q(columns__name__icontains=term)
+    datasets = (Dataset.objects.filter(query).filter(Q(owner=user) | Q(is_public=True))
+                .select_related('owner').distinct()[:limit])
+    return [(dataset, None) for dataset in datasets]
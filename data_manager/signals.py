@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache_utils import invalidate_analysis
+from .metabase_utils import clear_metabase_cache
+from .models import Dataset, DataColumn, MetabaseConfig
+from .search_utils import remove_from_index, schedule_index
+from .storage_utils import invalidate_cache
+
+
+@receiver(post_delete, sender=Dataset)
+def remove_dataset_cache(sender, instance, **kwargs):
+    """Drop cached columnar files and analysis results when a dataset is deleted"""
+    invalidate_cache(instance)
+    invalidate_analysis(instance)
+
+
+@receiver(post_save, sender=Dataset)
+def expire_dataset_analysis(sender, instance, created, **kwargs):
+    """Drop the cached analysis whenever a dataset is saved"""
+    if not created:
+        invalidate_analysis(instance)
+
+
+@receiver(post_save, sender=MetabaseConfig)
+@receiver(post_delete, sender=MetabaseConfig)
+def expire_metabase_cache(sender, **kwargs):
+    """Forget the memoized config and URLs signed with it"""
+    clear_metabase_cache()
+
+
+@receiver(post_save, sender=Dataset)
+def index_dataset(sender, instance, **kwargs):
+    """Keep the dataset's name and description searchable"""
+    schedule_index(instance.pk)
+
+
+@receiver(post_delete, sender=Dataset)
+def unindex_dataset(sender, instance, **kwargs):
+    remove_from_index(instance.pk)
+
+
+@receiver(post_save, sender=DataColumn)
+def index_dataset_columns(sender, instance, **kwargs):
+    """
+    Column names and values are indexed with their dataset
+
+    There is deliberately no post_delete receiver: it would stop Django from
+    deleting a dataset's columns with one DELETE. Code replacing columns
+    re-indexes the dataset itself (see store_column_profiles()).
+    """
+    schedule_index(instance.dataset_id)
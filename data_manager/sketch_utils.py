@@ -0,0 +1,370 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from django.conf import settings
+
+from .profile_utils import HISTOGRAM_BINS, QUANTILES, TOP_K, _native_array, _to_python, column_kind
+
+# z-score of the two-sided 99% confidence level every error bound is given at
+Z_99 = 2.576
+
+
+def hash_values(values):
+    """Stable 64-bit hashes of a Series' values, equal for equal values whatever the dtype encoding"""
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def _bit_length(words):
+    """Bit length of each uint64, exact (float64 halves hold 32 bits without rounding)"""
+    high = (words >> np.uint64(32)).astype(np.float64)
+    low = (words & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch of a stream of numbers
+
+    Level ``h`` holds items standing for 2**h values each. A level over its
+    capacity is sorted and every other item, from a random offset, is
+    promoted to the next level. Each such compaction shifts the rank of any
+    value by at most the weight of the compacted items, in either direction
+    with equal probability; the variance of those shifts is tracked, so
+    the rank error bound holds for the data actually seen. Sketches of
+    separate chunks merge into the sketch of their union.
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.variance = 0.0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 8)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # An odd item out stays behind so every promoted item stands for exactly two
+            kept, paired = items[:len(items) % 2], items[len(items) % 2:]
+            self.levels[level] = kept
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], paired[self._rng.integers(2)::2]])
+            self.variance += float(2 ** level) ** 2
+            # Capacities below shrink as levels are added, so start over from the bottom
+            level = 0
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.variance += other.variance
+        self._compress()
+        return self
+
+    def _weighted(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], weights[order]
+
+    def quantiles(self, fractions):
+        """Values at the given rank fractions; the minimum and maximum are exact"""
+        if not self.count:
+            return [None] * len(fractions)
+        items, weights = self._weighted()
+        cumulative = np.cumsum(weights)
+        positions = np.searchsorted(cumulative, np.asarray(fractions) * cumulative[-1], side='left')
+        values = items[np.minimum(positions, len(items) - 1)]
+        return [self.min if q <= 0 else self.max if q >= 1 else float(value) for q, value in zip(fractions, values)]
+
+    def rank(self, points):
+        """Estimated share of values strictly below each point"""
+        items, weights = self._weighted()
+        cumulative = np.concatenate([[0], np.cumsum(weights)])
+        return cumulative[np.searchsorted(items, points, side='left')] / cumulative[-1]
+
+    @property
+    def rank_error(self):
+        """Rank error, as a share of the values, that a quantile stays within at 99% confidence"""
+        return Z_99 * math.sqrt(self.variance) / self.count if self.count else 0.0
+
+
+class DistinctSketch:
+    """HyperLogLog distinct-count sketch; merging keeps the larger register of each pair"""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = hashes >> np.uint64(64 - self.precision)
+        # A guard bit caps the run of leading zeros at 64 - precision
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        np.maximum.at(self.registers, index, (65 - _bit_length(rest)).astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    @property
+    def relative_error(self):
+        """Relative error of estimate() at 99% confidence"""
+        return Z_99 * 1.04 / math.sqrt(len(self.registers))
+
+
+class FrequencySketch:
+    """
+    Count-min sketch with a bounded set of heavy-hitter candidates
+
+    Counts are never underestimated, and overestimated by at most
+    ``error`` with probability 1 - e**-depth (99.3% at the default depth).
+    The values most frequent within each update become candidates; only
+    the ``capacity`` candidates with the highest estimates are kept.
+    """
+
+    def __init__(self, width=2048, depth=5, capacity=64):
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.candidates = {}
+
+    def _cells(self, hashes):
+        # Double hashing: the two 32-bit halves of each hash give every row its own cell
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((low[None, :] + rows * high[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def _estimate(self, hashes):
+        cells = self._cells(np.asarray(hashes, dtype=np.uint64))
+        return self.table[np.arange(self.depth)[:, None], cells].min(axis=0)
+
+    def update(self, values, hashes):
+        # Hash-table grouping; sorting the hashes would dominate the cost
+        codes, unique = pd.factorize(hashes)
+        counts = np.bincount(codes)
+        cells = self._cells(unique)
+        for row in range(self.depth):
+            np.add.at(self.table[row], cells[row], counts)
+        self.total += len(hashes)
+        top = np.argpartition(-counts, self.capacity)[:self.capacity] if len(counts) > self.capacity \
+            else np.arange(len(counts))
+        for index in top:
+            if int(unique[index]) not in self.candidates:
+                self.candidates[int(unique[index])] = values.iloc[int(np.argmax(codes == index))]
+        self._prune()
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+        for key, value in other.candidates.items():
+            self.candidates.setdefault(key, value)
+        self._prune()
+        return self
+
+    def _prune(self):
+        if len(self.candidates) <= self.capacity:
+            return
+        keys = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        keep = keys[np.argsort(-self._estimate(keys), kind='stable')[:self.capacity]]
+        self.candidates = {int(key): self.candidates[int(key)] for key in keep}
+
+    def top(self, k):
+        """The ``k`` candidates with the highest estimated counts, as (value, count) pairs"""
+        if not self.candidates:
+            return []
+        keys = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        estimates = self._estimate(keys)
+        order = np.lexsort((keys, -estimates))[:k]
+        return [(self.candidates[int(keys[i])], int(estimates[i])) for i in order]
+
+    @property
+    def error(self):
+        return int(math.ceil(math.e / self.width * self.total))
+
+
+class ColumnSketch:
+    """Mergeable summary of one column: moments, quantiles, distinct count and top values"""
+
+    def __init__(self, kind, seed=0):
+        self.kind = kind
+        self.count = 0
+        self.null_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.quantiles = QuantileSketch(seed=seed) if kind == 'NUMERIC' else None
+        self.distinct = DistinctSketch()
+        self.frequent = FrequencySketch()
+
+    def update(self, series):
+        values = series.dropna()
+        self.null_count += len(series) - len(values)
+        if not len(values):
+            return
+        hashes = hash_values(values)
+        self.distinct.update(hashes)
+        self.frequent.update(values, hashes)
+        if self.quantiles is not None:
+            array = _native_array(values).astype(np.float64)
+            self.quantiles.update(array)
+            self._merge_moments(len(array), float(array.mean()), float(((array - array.mean()) ** 2).sum()))
+        else:
+            self.count += len(values)
+
+    def _merge_moments(self, count, mean, m2):
+        # Chan et al.'s pairwise update keeps the variance accurate across chunks
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def merge(self, other):
+        self.null_count += other.null_count
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+        if self.quantiles is not None:
+            self.quantiles.merge(other.quantiles)
+            if other.count:
+                self._merge_moments(other.count, other.mean, other.m2)
+        else:
+            self.count += other.count
+        return self
+
+    def profile(self):
+        """
+        DataColumn profile fields, as profile_utils.profile_column() returns them
+
+        Count, null count, minimum, maximum, mean and standard deviation
+        are exact; quantiles, the histogram, the distinct count and the top
+        value counts are estimates within ``error_bounds`` (99% confidence):
+        ``rank`` as a share of the values, ``distinct`` relative and
+        ``top_count`` as an absolute count. Only values counted more often
+        than ``top_count`` are listed as top values.
+        """
+        profile = {
+            'kind': self.kind,
+            'count': self.count,
+            'null_count': self.null_count,
+            'distinct_count': min(self.distinct.estimate(), self.count) if self.count else 0,
+            'min_value': None,
+            'max_value': None,
+            'mean': None,
+            'std': None,
+            'quantiles': {},
+            # Counts within the error bound could be hash collisions alone
+            'top_values': [[_to_python(value), count] for value, count in self.frequent.top(TOP_K)
+                           if count > self.frequent.error],
+            'histogram': {},
+            'error_bounds': {
+                'rank': self.quantiles.rank_error if self.quantiles is not None else None,
+                'distinct': self.distinct.relative_error,
+                'top_count': self.frequent.error,
+            },
+        }
+        if self.quantiles is not None and self.count:
+            sketch = self.quantiles
+            low, high = sketch.min, sketch.max
+            if low == high:
+                low, high = low - 0.5, high + 0.5
+            edges = np.linspace(low, high, HISTOGRAM_BINS + 1)
+            # Bins are half-open except the last, which includes the maximum
+            below = np.concatenate([[0.0], sketch.rank(edges[1:-1]), [1.0]]) * self.count
+            counts = np.diff(np.round(below).astype(np.int64))
+            profile.update({
+                'min_value': _to_python(sketch.min),
+                'max_value': _to_python(sketch.max),
+                'mean': _to_python(self.mean),
+                'std': _to_python(math.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else None,
+                'quantiles': {str(q): _to_python(value) for q, value in zip(QUANTILES, sketch.quantiles(QUANTILES))},
+                'histogram': {'edges': [_to_python(edge) for edge in edges], 'counts': counts.tolist()},
+            })
+        return profile
+
+
+def _sketch_row_group(path, group, kinds):
+    # Each thread opens the file itself; ParquetFile objects are not shared between threads
+    df = pq.ParquetFile(path).read_row_group(group).to_pandas()
+    sketches = {}
+    for column, kind in kinds.items():
+        # Row groups draw different compaction offsets, so their rank errors stay independent
+        sketches[column] = ColumnSketch(kind, seed=group)
+        sketches[column].update(df[column])
+    return sketches
+
+
+def sketch_profiles(path, workers=None):
+    """
+    Profile every column of a cached table with mergeable sketches
+
+    Row groups are summarized independently by a pool of ``workers``
+    threads (default: ``PROFILE_WORKERS``, else one per CPU) and their
+    sketches merged, so memory holds one row group per thread however
+    many rows the table has.
+
+    Returns:
+        List of profile dicts as profile_utils.profile_dataframe() returns
+        them, plus ``error_bounds`` per column (see ColumnSketch.profile())
+    """
+    parquet_file = pq.ParquetFile(path)
+    dtypes = parquet_file.schema_arrow.empty_table().to_pandas().dtypes
+    kinds = {column: column_kind(dtype) for column, dtype in dtypes.items()}
+    merged = {column: ColumnSketch(kind) for column, kind in kinds.items()}
+    if workers is None:
+        workers = getattr(settings, 'PROFILE_WORKERS', None) or os.cpu_count() or 1
+    groups = range(parquet_file.num_row_groups)
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(groups)), 1)) as pool:
+        for sketches in pool.map(lambda group: _sketch_row_group(path, group, kinds), groups):
+            for column, sketch in sketches.items():
+                merged[column].merge(sketch)
+
+    profiles = []
+    for position, (column, sketch) in enumerate(merged.items()):
+        profile = sketch.profile()
+        profile.update({'name': str(column), 'position': position, 'data_type': str(dtypes[column])})
+        profiles.append(profile)
+    return profiles
@@ -0,0 +1,459 @@
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from openpyxl import load_workbook
+
+from .excel_utils import is_streamable_excel, iter_sheet_batches, list_sheets, read_sheet
+from .json_utils import flatten_record, is_json_lines, iter_json_records, iter_record_batches, json_layout
+from .schema_utils import (
+    SchemaBuilder, apply_schema, conform, get_stored_schema, get_stored_sheet_schemas, optimize_dtypes,
+    read_csv_options,
+)
+from .timing_utils import phase
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the on-disk layout of cached tables changes so stale files
+# written by an older version are never read back.
+CACHE_FORMAT_VERSION = 3
+
+# Small row groups let paged reads decode only the rows around a page and
+# let filters skip whole groups using their min/max statistics.
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def compute_checksum(path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_cache_dir():
+    """Directory holding the columnar cache files, created on demand"""
+    cache_dir = Path(getattr(settings, 'DATASET_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'cache')))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def get_cache_path(dataset, sheet=0):
+    """
+    Location of the columnar cache for the dataset's current file
+
+    Excel workbooks get one cache file per worksheet; sheet 0 is the
+    dataset's main table and the other sheets are its sub-tables.
+    """
+    suffix = f".sheet{sheet}" if sheet else ''
+    return get_cache_dir() / f"{dataset.pk}_{dataset.file_checksum[:16]}_v{CACHE_FORMAT_VERSION}{suffix}.parquet"
+
+
+def read_source_file(path, file_type, schema=None):
+    """
+    Parse an uploaded file into a DataFrame with compact dtypes
+
+    Args:
+        path: Path of the raw upload
+        file_type: Value from Dataset.FILE_TYPES; unknown types are read as CSV
+        schema: Optional {column: dtype} stored for this exact file content;
+            when given it is reused instead of inferring dtypes again
+
+    Returns:
+        pandas DataFrame
+    """
+    if file_type == 'EXCEL':
+        df = read_sheet(path)
+    elif file_type == 'JSON':
+        df = pd.read_json(path, lines=is_json_lines(path))
+    elif schema:
+        try:
+            df = pd.read_csv(path, **read_csv_options(schema))
+        except (ValueError, TypeError):
+            logger.info("Stored schema does not match %s; inferring dtypes", path)
+            df = pd.read_csv(path)
+    else:
+        df = pd.read_csv(path)
+    return apply_schema(df, schema) if schema else optimize_dtypes(df)
+
+
+def _coerce_for_arrow(df):
+    """Make a DataFrame writable as Parquet without changing its pandas dtypes"""
+    df.columns = [str(column) for column in df.columns]
+    for column in df.select_dtypes(include=['object']).columns:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed-type object columns (e.g. numbers and strings) are stored as text
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def write_table(df, path):
+    """Write a DataFrame to a Parquet file atomically"""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    table = pa.Table.from_pandas(_coerce_for_arrow(df), preserve_index=False)
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_cache(dataset, df, sheet=0):
+    """Write the DataFrame to the dataset's cache file atomically"""
+    return write_table(df, get_cache_path(dataset, sheet))
+
+
+def invalidate_cache(dataset, keep=None):
+    """
+    Remove cache files (and derived indexes) for the dataset
+
+    Args:
+        keep: Optional cache path to keep, together with the sheet caches
+            and sort indexes derived from it
+    """
+    for path in get_cache_dir().glob(f"{dataset.pk}_*"):
+        if keep is not None and (path == keep or path.name.startswith(f"{keep.stem}.")):
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def refresh_checksum(dataset):
+    """
+    Recompute the checksum of the dataset's file and store it if it changed
+
+    Returns:
+        True if the checksum changed
+    """
+    checksum = compute_checksum(dataset.file.path)
+    if checksum == dataset.file_checksum:
+        return False
+    dataset.file_checksum = checksum
+    if dataset.pk:
+        type(dataset).objects.filter(pk=dataset.pk).update(file_checksum=checksum)
+    return True
+
+
+def _build_sheet(path, sheet, destination, schema):
+    """Stream one worksheet into a Parquet file; also runs in worker processes"""
+    if schema:
+        frames = (conform(df, schema) for df in iter_sheet_batches(path, sheet))
+        try:
+            return write_batches(frames, destination)
+        except (ValueError, TypeError, pa.ArrowException):
+            logger.info("Stored schema does not match sheet %s of %s; inferring dtypes", sheet, path)
+    return write_inferred(iter_sheet_batches(path, sheet), destination)
+
+
+def build_workbook_cache(dataset, path, schemas=None, progress=None):
+    """
+    Convert every worksheet of an Excel upload into its own cache file
+
+    Sheets are parsed in parallel by up to ``EXCEL_SHEET_WORKERS`` processes
+    (capped at the CPU count, and spawned so no thread or database
+    connection state of the parent is inherited),
+    and ``progress`` is called as each one finishes.
+
+    Args:
+        dataset: Dataset instance with its checksum set
+        path: Path of the workbook
+        schemas: Optional {sheet position: stored schema}
+        progress: Optional callable(percent, message)
+
+    Returns:
+        {sheet position: row count}
+    """
+    report = progress or (lambda percent, message: None)
+    schemas = schemas or {}
+    names = list_sheets(path)
+    tasks = {sheet: (path, sheet, get_cache_path(dataset, sheet), schemas.get(sheet)) for sheet in range(len(names))}
+    workers = min(getattr(settings, 'EXCEL_SHEET_WORKERS', 1), len(tasks), os.cpu_count() or 1)
+    row_counts = {}
+
+    def finished(sheet, rows):
+        row_counts[sheet] = rows
+        report(int(100 * len(row_counts) / len(tasks)),
+               f"Parsed sheet {len(row_counts)} of {len(tasks)} ({names[sheet]}: {rows} rows)")
+
+    if workers <= 1:
+        for sheet, args in tasks.items():
+            finished(sheet, _build_sheet(*args))
+        return row_counts
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(_build_sheet, *args): sheet for sheet, args in tasks.items()}
+        for future in as_completed(futures):
+            finished(futures[future], future.result())
+    return row_counts
+
+
+def write_batches(frames, path):
+    """
+    Write a stream of DataFrames with identical dtypes to one Parquet file
+
+    Batches are buffered as Arrow tables until a full row group is ready, so
+    memory holds at most about ROW_GROUP_SIZE rows at a time.
+
+    Returns:
+        Number of rows written
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    writer = None
+    pending = []
+    rows = 0
+    try:
+        for df in frames:
+            table = pa.Table.from_pandas(df, schema=writer.schema if writer else None, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            pending.append(table)
+            rows += len(table)
+            if sum(len(item) for item in pending) >= ROW_GROUP_SIZE:
+                writer.write_table(pa.concat_tables(pending), row_group_size=ROW_GROUP_SIZE)
+                pending = []
+        if writer is None:
+            write_table(pd.DataFrame(), path)
+            return 0
+        if pending:
+            writer.write_table(pa.concat_tables(pending), row_group_size=ROW_GROUP_SIZE)
+        writer.close()
+        writer = None
+        os.replace(tmp_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        tmp_path.unlink(missing_ok=True)
+    return rows
+
+
+def write_inferred(frames, path):
+    """
+    Write a stream of DataFrames to one Parquet file with a merged schema
+
+    Each batch is spilled to a temporary Parquet file while the dtypes of
+    all batches are merged into one compact schema (see
+    schema_utils.SchemaBuilder); the spilled batches are then cast to that
+    schema and appended to the file. Peak memory depends on the batch size,
+    not on the total number of rows.
+
+    Returns:
+        Number of rows written
+    """
+    builder = SchemaBuilder()
+    with tempfile.TemporaryDirectory(prefix='spill-', dir=get_cache_dir()) as spill_dir:
+        spills = []
+        for df in frames:
+            batch = builder.update(df)
+            spills.append(write_table(batch, Path(spill_dir) / f"{len(spills)}.parquet"))
+        schema = builder.schema()
+        return write_batches((conform(pd.read_parquet(spill), schema) for spill in spills), path)
+
+
+def build_json_cache(dataset, path):
+    """
+    Stream a JSON-lines file or top-level JSON array into the dataset's cache
+
+    Records are parsed incrementally and flattened (nested objects become
+    dotted columns, up to ``JSON_FLATTEN_DEPTH`` levels) in batches of
+    ``JSON_BATCH_ROWS``, and written with write_inferred().
+
+    Returns:
+        Number of rows written
+    """
+    batch_rows = getattr(settings, 'JSON_BATCH_ROWS', 10_000)
+    max_depth = getattr(settings, 'JSON_FLATTEN_DEPTH', 3)
+    batches = iter_record_batches(path, batch_rows, max_depth)
+    return write_inferred((pd.DataFrame.from_records(records) for records in batches), get_cache_path(dataset))
+
+
+def ensure_cache(dataset, progress=None):
+    """
+    Make sure an up-to-date columnar cache exists for the dataset
+
+    The cache is keyed by dataset id and file checksum. A cache file older
+    than the raw upload triggers a checksum comparison, so edits to the
+    underlying file invalidate the cache automatically while an unchanged
+    file only costs a stat() per load. Rebuilding the cache for unchanged
+    content reuses the dtypes stored in DataColumn.data_type; new content
+    has its dtypes inferred (see schema_utils). Excel workbooks are cached
+    one file per worksheet (see build_workbook_cache).
+
+    Args:
+        dataset: Dataset instance
+        progress: Optional callable(percent, message) while parsing
+
+    Returns:
+        Path of the cache file
+    """
+    source_path = dataset.file.path
+    known_content = bool(dataset.file_checksum)
+    if not known_content:
+        refresh_checksum(dataset)
+
+    cache_path = get_cache_path(dataset)
+    if cache_path.exists() and cache_path.stat().st_mtime >= os.path.getmtime(source_path):
+        return cache_path
+
+    if refresh_checksum(dataset):
+        known_content = False
+        cache_path = get_cache_path(dataset)
+    elif cache_path.exists():
+        # Same content, just a newer mtime (e.g. file copied back in place)
+        os.utime(cache_path)
+        return cache_path
+
+    logger.info("Building columnar cache for dataset %s", dataset.pk)
+    reuse_schema = known_content and dataset.pk
+    if dataset.file_type == 'EXCEL':
+        schemas = get_stored_sheet_schemas(dataset) if reuse_schema else None
+        with phase('parse'):
+            build_workbook_cache(dataset, source_path, schemas=schemas, progress=progress)
+    elif dataset.file_type == 'JSON' and json_layout(source_path) != 'document':
+        # Streamed in one pass; dtypes are merged across batches as they are parsed
+        with phase('parse'):
+            build_json_cache(dataset, source_path)
+    else:
+        schema = get_stored_schema(dataset) if reuse_schema else None
+        with phase('parse'):
+            df = read_source_file(source_path, dataset.file_type, schema=schema)
+        with phase('cache_write'):
+            write_cache(dataset, df)
+    invalidate_cache(dataset, keep=cache_path)
+    return cache_path
+
+
+def describe_table(path):
+    """
+    Row count and pandas dtypes of a cached table, read from its footer
+
+    Returns:
+        (row_count, [[column, dtype], ...])
+    """
+    parquet_file = pq.ParquetFile(path)
+    dtypes = parquet_file.schema_arrow.empty_table().to_pandas().dtypes
+    return parquet_file.metadata.num_rows, [[str(column), str(dtype)] for column, dtype in dtypes.items()]
+
+
+def _count_lines(path, block_size=1024 * 1024):
+    """Count lines in a text file without decoding it"""
+    count = 0
+    last_block = b''
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            count += block.count(b'\n')
+            last_block = block
+    if last_block and not last_block.endswith(b'\n'):
+        count += 1
+    return count
+
+
+def count_rows(dataset):
+    """
+    Count data rows in a dataset without loading it into memory
+
+    Uses the Parquet footer when a cache exists, otherwise a newline count
+    for CSV and JSON-lines, a streaming pass over top-level JSON arrays or
+    the sheet dimensions for Excel. CSV counts assume no quoted fields span
+    several lines.
+
+    Returns:
+        Number of data rows (header excluded)
+    """
+    if dataset.file_checksum:
+        cache_path = get_cache_path(dataset)
+        if cache_path.exists():
+            return pq.ParquetFile(cache_path).metadata.num_rows
+
+    path = dataset.file.path
+    if dataset.file_type == 'EXCEL':
+        if not is_streamable_excel(path):
+            return len(pd.read_excel(path))
+        workbook = load_workbook(path, read_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            if sheet.max_row is None:
+                sheet.reset_dimensions()
+                return max(sum(1 for _ in sheet.iter_rows(values_only=True)) - 1, 0)
+            return max(sheet.max_row - 1, 0)
+        finally:
+            workbook.close()
+    if dataset.file_type == 'JSON':
+        layout = json_layout(path)
+        if layout == 'lines':
+            return _count_lines(path)
+        if layout == 'array':
+            return sum(1 for _ in iter_json_records(path))
+        return len(pd.read_json(path))
+    return max(_count_lines(path) - 1, 0)
+
+
+def read_preview(dataset, nrows=10):
+    """
+    Read only the first rows of a dataset
+
+    Reads the first record batch of the columnar cache if one is already
+    built; otherwise reads just the leading rows of the raw upload. Peak
+    memory depends on ``nrows`` rather than on file size, except for JSON
+    documents that are neither JSON lines nor a top-level array, which must
+    be parsed whole.
+
+    Returns:
+        pandas DataFrame with at most ``nrows`` rows
+    """
+    if dataset.file_checksum:
+        cache_path = get_cache_path(dataset)
+        if cache_path.exists() and cache_path.stat().st_mtime >= os.path.getmtime(dataset.file.path):
+            parquet_file = pq.ParquetFile(cache_path)
+            for batch in parquet_file.iter_batches(batch_size=nrows):
+                return batch.to_pandas()
+            return parquet_file.schema_arrow.empty_table().to_pandas()
+
+    path = dataset.file.path
+    if dataset.file_type == 'EXCEL':
+        if not is_streamable_excel(path):
+            return pd.read_excel(path, nrows=nrows)
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(max_row=nrows + 1, values_only=True)
+            header = next(rows, ())
+            return pd.DataFrame(list(rows), columns=list(header))
+        finally:
+            workbook.close()
+    if dataset.file_type == 'JSON':
+        if json_layout(path) == 'document':
+            return pd.read_json(path).head(nrows)
+        max_depth = getattr(settings, 'JSON_FLATTEN_DEPTH', 3)
+        records = itertools.islice(iter_json_records(path), nrows)
+        return pd.DataFrame.from_records([flatten_record(record, max_depth) for record in records])
+    return pd.read_csv(path, nrows=nrows)
+
+
+def load_dataframe(dataset, columns=None):
+    """
+    Load a dataset through its columnar cache
+
+    Args:
+        dataset: Dataset instance
+        columns: Optional list of column names to read; others are skipped
+
+    Returns:
+        pandas DataFrame
+    """
+    cache_path = ensure_cache(dataset)
+    with phase('load'):
+        return pd.read_parquet(cache_path, columns=columns)
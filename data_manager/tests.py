@@ -1,3 +1,1331 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .activity_utils import ActivitySink, archive_activity, get_activity_summary, rollup_activity
+from .admission_utils import AdmissionRejected, controller, get_admission_stats, reset_admission_stats
+from .analysis_utils import build_analysis, estimate_analysis_memory, get_analysis
+from .benchmark_utils import load_results, save_results
+from .cache_utils import (
+    analysis_cache_key, get_cache_stats, get_cached_analysis, invalidate_analysis, reset_cache_stats,
+)
+from .chart_utils import build_bar, build_line, build_scatter, lttb_indices, plan_charts
+from .export_utils import DatasetExport
+from .ingestion_utils import (
+    claim_next_job, enqueue_ingestion, heartbeat_jobs, process_dataset_file, release_crashed_job, requeue_stale_jobs,
+    run_job, store_column_profiles,
+)
+from .management.commands import run_ingestion_worker
+from .metabase_utils import clear_metabase_cache, get_active_config, get_embed_url, get_embed_urls
+from .models import (
+    ActivityRollup, DataColumn, Dataset, DatasetSheet, IngestionJob, MetabaseConfig, MetabaseDashboard, UploadSession,
+    UserActivity,
+)
+from .profile_utils import profile_dataframe
+from .query_utils import read_sample, run_query
+from .schema_utils import optimize_series
+from .sketch_utils import ColumnSketch
+from .storage_utils import count_rows, ensure_cache, invalidate_cache, load_dataframe, read_preview, write_batches
+from .upload_utils import get_part_path
+
+CSV_CONTENT = "category,value,amount\n" + "\n".join(f"c{i % 5},{i},{i * 1.5}" for i in range(50))
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-default'},
+    'analysis_memory': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-analysis'},
+}
+
+
+class QueryBudgetMixin:
+    """Assert an upper bound on the number of queries a block runs"""
+
+    def assertMaxQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.fail(f"{executed} queries executed, budget is {budget}:\n{queries}")
+        return result
+
+    def count_queries(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            func(*args, **kwargs)
+        return len(context.captured_queries)
+
+
+class MediaRootMixin:
+    """Give each test class its own MEDIA_ROOT so uploaded files are cleaned up"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES, ASYNC_CPU_WORKERS=0)
+class ViewQueryBudgetTests(QueryBudgetMixin, MediaRootMixin, TestCase):
+    """Per-view query budgets; they must not grow with the number of rows shown"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.client.force_login(self.owner)
+        for cache in caches.all():
+            cache.clear()
+
+    def make_dataset(self, owner=None, is_public=False, process=False, name='data'):
+        dataset = Dataset(name=name, file_type='CSV', owner=owner or self.owner, is_public=is_public)
+        dataset.file.save(f"{name}.csv", ContentFile(CSV_CONTENT.encode()))
+        if process:
+            process_dataset_file(dataset)
+            Dataset.objects.filter(pk=dataset.pk).update(status='READY')
+            dataset.status = 'READY'
+        return dataset
+
+    def test_dataset_list_query_count_is_constant(self):
+        self.make_dataset(process=True, name='mine')
+        self.make_dataset(owner=self.other, is_public=True, process=True, name='theirs')
+        url = reverse('dataset_list')
+        few = self.count_queries(self.client.get, url)
+
+        for i in range(10):
+            self.make_dataset(process=True, name=f"mine{i}")
+            self.make_dataset(owner=self.other, is_public=True, process=True, name=f"theirs{i}")
+        many = self.count_queries(self.client.get, url)
+
+        self.assertEqual(few, many)
+        self.assertMaxQueries(4, self.client.get, url)
+
+    def test_dataset_detail_budget(self):
+        dataset = self.make_dataset(process=True)
+        response = self.assertMaxQueries(8, self.client.get, reverse('dataset_detail', args=[dataset.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_analyze_dataset_budget(self):
+        dataset = self.make_dataset(process=True)
+        url = reverse('analyze_dataset', args=[dataset.pk])
+        response = self.assertMaxQueries(5, self.client.get, url)
+        self.assertEqual(response.status_code, 200)
+        # Cached analysis: session, user and dataset only
+        self.assertMaxQueries(3, self.client.get, url)
+
+    def test_view_dashboard_budget(self):
+        dataset = self.make_dataset(owner=self.other, is_public=True)
+        dashboard = MetabaseDashboard.objects.create(dataset=dataset, dashboard_id=1, title='Board')
+        MetabaseConfig.objects.create(site_url='https://metabase.example.com', secret_key='s' * 32)
+        response = self.assertMaxQueries(5, self.client.get, reverse('view_dashboard', args=[dashboard.pk]))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES)
+class AdminQueryBudgetTests(QueryBudgetMixin, MediaRootMixin, TestCase):
+    """Admin changelists must not query related objects once per row"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='pw')
+        cls.dataset = Dataset.objects.create(name='data', file_type='CSV', owner=cls.admin, file='data.csv')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        start = DataColumn.objects.count()
+        DataColumn.objects.bulk_create([
+            DataColumn(dataset=self.dataset, name=f"col{start + i}", data_type='int64', position=start + i)
+            for i in range(count)
+        ])
+        UserActivity.objects.bulk_create([
+            UserActivity(user=self.admin, action='VIEW', dataset=self.dataset) for _ in range(count)
+        ])
+
+    def assertConstantQueries(self, url):
+        self.add_rows(2)
+        few = self.count_queries(self.client.get, url)
+        self.add_rows(20)
+        many = self.count_queries(self.client.get, url)
+        self.assertEqual(few, many)
+
+    def test_datacolumn_changelist(self):
+        self.assertConstantQueries(reverse('admin:data_manager_datacolumn_changelist'))
+
+    def test_useractivity_changelist(self):
+        self.assertConstantQueries(reverse('admin:data_manager_useractivity_changelist'))
+
+    def test_dataset_changelist(self):
+        self.assertConstantQueries(reverse('admin:data_manager_dataset_changelist'))
+
+
+@override_settings(DATASET_LIST_PAGE_SIZE=4, CACHES=TEST_CACHES)
+class KeysetPaginationTests(MediaRootMixin, TestCase):
+    def test_pages_cover_every_dataset_once(self):
+        owner = User.objects.create_user('owner', password='pw')
+        created = {Dataset.objects.create(name=f"d{i}", file_type='CSV', owner=owner, file='d.csv').pk
+                   for i in range(10)}
+        self.client.force_login(owner)
+
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get(reverse('dataset_list'), {'cursor': cursor})
+            seen += [dataset.pk for dataset in response.context['user_datasets']]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(len(seen), len(created))
+        self.assertEqual(set(seen), created)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        owner = User.objects.create_user('owner', password='pw')
+        Dataset.objects.create(name='d', file_type='CSV', owner=owner, file='d.csv')
+        self.client.force_login(owner)
+        response = self.client.get(reverse('dataset_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['user_datasets']), 1)
+
+
+@mock.patch.object(ActivitySink, '_ensure_thread')
+class ActivitySinkTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def event(self, user_id=None, dataset_id=None):
+        return {'user_id': user_id or self.user.pk, 'action': 'VIEW', 'dataset_id': dataset_id,
+                'dashboard_id': None, 'details': {'page': 1}, 'timestamp': timezone.now()}
+
+    def test_flush_writes_buffered_events_in_one_insert(self, _):
+        sink = ActivitySink(spill_path=None)
+        for _ in range(50):
+            sink.put(self.event())
+        # A deleted dataset is cleared, a deleted user's event skipped
+        sink.put(self.event(dataset_id=999_999))
+        sink.put(self.event(user_id=999_999))
+        self.assertEqual(UserActivity.objects.count(), 0)
+
+        # Three lookups of the referenced rows, then a single INSERT
+        self.assertMaxQueries(4, sink.flush)
+        self.assertEqual(UserActivity.objects.count(), 51)
+        self.assertFalse(UserActivity.objects.filter(dataset__isnull=False).exists())
+
+    def test_overflow_and_failed_inserts_are_spilled_and_replayed(self, _):
+        spill_path = os.path.join(self.spill_dir, 'spill.jsonl')
+        sink = ActivitySink(max_queue_size=2, spill_path=spill_path)
+        for _ in range(5):
+            sink.put(self.event())
+        self.assertEqual(sink.spilled, 3)
+
+        with mock.patch('data_manager.activity_utils.insert_events', side_effect=RuntimeError("db down")), \
+                self.assertLogs('data_manager.activity_utils', 'ERROR'):
+            sink.flush()
+        self.assertEqual(UserActivity.objects.count(), 0)
+        self.assertEqual(sink.spilled, 8)
+
+        sink.flush()
+        self.assertEqual(UserActivity.objects.count(), 5)
+        self.assertFalse(os.path.exists(spill_path))
+
+    def test_events_are_dropped_without_a_spill_file(self, _):
+        sink = ActivitySink(max_queue_size=1, spill_path=None)
+        with self.assertLogs('data_manager.activity_utils', 'WARNING'):
+            sink.put(self.event())
+            sink.put(self.event())
+        self.assertEqual(sink.dropped, 1)
+        sink.flush()
+        self.assertEqual(UserActivity.objects.count(), 1)
+
+
+class ActivityRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset.objects.create(name='data', file_type='CSV', owner=self.user)
+        self.today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def log(self, at, action='VIEW', count=1):
+        UserActivity.objects.bulk_create([
+            UserActivity(user=self.user, action=action, dataset=self.dataset, timestamp=at) for _ in range(count)
+        ])
+
+    def rollups(self, period):
+        return dict(ActivityRollup.objects.filter(period=period).values_list('bucket_start', 'count'))
+
+    def test_hourly_and_daily_rollups(self):
+        yesterday = self.today - timedelta(days=1)
+        self.log(yesterday + timedelta(hours=9, minutes=5), count=2)
+        self.log(yesterday + timedelta(hours=9, minutes=50))
+        self.log(self.today + timedelta(minutes=30), count=4)
+        self.assertEqual(rollup_activity(), 2)
+        self.assertEqual(self.rollups('HOUR'), {yesterday + timedelta(hours=9): 3, self.today: 4})
+        self.assertEqual(self.rollups('DAY'), {yesterday: 3, self.today: 4})
+
+        # Late events within the lookback are picked up, nothing is counted twice
+        self.log(self.today + timedelta(minutes=45))
+        rollup_activity()
+        self.assertEqual(self.rollups('DAY'), {yesterday: 3, self.today: 5})
+
+        summary = get_activity_summary(self.user, days=2)
+        self.assertEqual(summary['series']['VIEW'], [3, 5])
+        self.assertEqual(summary['top_datasets'][0]['total'], 8)
+
+    def test_archive_keeps_rows_the_rollup_may_recompute(self):
+        old = self.today - timedelta(days=100)
+        self.log(old, count=3)
+        self.log(self.today + timedelta(minutes=5), count=2)
+        rollup_activity()
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+
+        # Everything before now is past retention, but only the old rows are out of the lookback
+        self.assertEqual(archive_activity(timezone.now(), archive_dir=archive_dir), 3)
+        self.assertEqual(UserActivity.objects.count(), 2)
+        (archive,) = os.listdir(archive_dir)
+        with gzip.open(os.path.join(archive_dir, archive), 'rt') as fh:
+            self.assertEqual(len(fh.readlines()), 3)
+        # The rollups still count the archived rows
+        self.assertEqual(sum(self.rollups('DAY').values()), 5)
+
+    def test_events_replayed_after_a_long_outage_are_counted_once(self):
+        yesterday = self.today - timedelta(days=1)
+        self.log(yesterday + timedelta(hours=9, minutes=5), count=2)
+        self.log(self.today + timedelta(minutes=30), count=4)
+        rollup_activity()
+        self.assertEqual(archive_activity(timezone.now()), 2)
+
+        # Events spilled during an outage are written long after they happened
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir, ignore_errors=True)
+        sink = ActivitySink(spill_path=os.path.join(spill_dir, 'spill.jsonl'))
+        event = {'user_id': self.user.pk, 'action': 'VIEW', 'dataset_id': self.dataset.pk, 'dashboard_id': None,
+                 'details': {}}
+        sink._spill([{**event, 'timestamp': yesterday + timedelta(hours=9, minutes=30)},
+                     {**event, 'timestamp': self.today - timedelta(days=3)}])
+        sink.flush()
+        # Not archived before a rollup has counted them
+        self.assertEqual(archive_activity(timezone.now()), 0)
+
+        expected_days = {self.today - timedelta(days=3): 1, yesterday: 3, self.today: 4}
+        rollup_activity()
+        self.assertEqual(self.rollups('DAY'), expected_days)
+        self.assertEqual(self.rollups('HOUR')[yesterday + timedelta(hours=9)], 3)
+        rollup_activity()
+        self.assertEqual(self.rollups('DAY'), expected_days)
+        self.assertEqual(archive_activity(timezone.now()), 2)
+        rollup_activity()
+        self.assertEqual(self.rollups('DAY'), expected_days)
+
+
+class MetabaseCacheTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        clear_metabase_cache()
+        self.config = MetabaseConfig.objects.create(site_url='https://metabase.example.com', secret_key='s' * 32)
+
+    def test_active_config_is_memoized_until_saved(self):
+        self.assertMaxQueries(1, get_active_config)
+        self.assertMaxQueries(0, get_active_config)
+
+        self.config.site_url = 'https://bi.example.com'
+        self.config.save()
+        self.assertEqual(self.assertMaxQueries(1, get_active_config).site_url, 'https://bi.example.com')
+
+    def test_missing_config_is_memoized_too(self):
+        self.config.delete()
+        with self.assertRaises(MetabaseConfig.DoesNotExist):
+            get_active_config()
+        with self.assertNumQueries(0), self.assertRaises(MetabaseConfig.DoesNotExist):
+            get_active_config()
+
+    def test_signed_url_is_reused_until_close_to_expiry(self):
+        first = get_embed_url(self.config, 7, params={'a': 1})
+        self.assertEqual(get_embed_url(self.config, 7, params={'a': 1}), first)
+        self.assertNotEqual(get_embed_url(self.config, 7, params={'a': 2}), first)
+
+        with mock.patch('data_manager.metabase_utils.time.time', return_value=time.time() + 3500):
+            self.assertNotEqual(get_embed_url(self.config, 7, params={'a': 1}), first)
+
+    def test_bulk_signing_uses_one_config_lookup(self):
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset.objects.create(name='data', file_type='CSV', owner=owner, file='data.csv')
+        dashboards = [
+            MetabaseDashboard.objects.create(dataset=dataset, dashboard_id=i, title=f"Board {i}") for i in range(5)
+        ]
+        urls = self.assertMaxQueries(1, get_embed_urls, dashboards)
+        self.assertEqual(set(urls), {dashboard.pk for dashboard in dashboards})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ColumnarCacheTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        self.dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+
+    def test_cache_is_built_once_and_follows_the_file_content(self):
+        first = ensure_cache(self.dataset)
+        self.assertTrue(first.exists())
+        self.assertEqual(Dataset.objects.get(pk=self.dataset.pk).file_checksum, self.dataset.file_checksum)
+        with mock.patch('data_manager.storage_utils.read_source_file') as read_source_file:
+            self.assertEqual(len(load_dataframe(self.dataset)), 50)
+        read_source_file.assert_not_called()
+
+        # Rewriting the upload changes its checksum, which retires the old cache
+        with open(self.dataset.file.path, 'w') as fh:
+            fh.write("category,value,amount\nz,1,2.5\n")
+        later = time.time() + 10
+        os.utime(self.dataset.file.path, (later, later))
+        self.assertEqual(load_dataframe(self.dataset)['category'].tolist(), ['z'])
+        self.assertNotEqual(ensure_cache(self.dataset), first)
+        self.assertFalse(first.exists())
+
+    def test_touched_file_with_same_content_keeps_its_cache(self):
+        path = ensure_cache(self.dataset)
+        later = time.time() + 10
+        os.utime(self.dataset.file.path, (later, later))
+        with mock.patch('data_manager.storage_utils.read_source_file') as read_source_file:
+            self.assertEqual(ensure_cache(self.dataset), path)
+        read_source_file.assert_not_called()
+
+    def test_deleting_a_dataset_removes_its_cache(self):
+        path = ensure_cache(self.dataset)
+        self.dataset.delete()
+        self.assertFalse(path.exists())
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES, ASYNC_CPU_WORKERS=0)
+class PreviewTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+
+    def make_dataset(self, content, file_type='CSV', name='data.csv'):
+        dataset = Dataset(name='data', file_type=file_type, owner=self.owner)
+        dataset.file.save(name, ContentFile(content.encode()))
+        return dataset
+
+    def test_preview_reads_only_the_leading_rows_of_the_upload(self):
+        dataset = self.make_dataset(CSV_CONTENT)
+        with mock.patch('data_manager.storage_utils.pd.read_csv', wraps=pd.read_csv) as read_csv:
+            preview = read_preview(dataset, nrows=3)
+        self.assertEqual(read_csv.call_args.kwargs['nrows'], 3)
+        self.assertEqual(preview['value'].tolist(), [0, 1, 2])
+        self.assertEqual(count_rows(dataset), 50)
+
+        lines = self.make_dataset("\n".join(json.dumps({'a': i}) for i in range(7)), 'JSON', 'data.jsonl')
+        self.assertEqual(read_preview(lines, nrows=2)['a'].tolist(), [0, 1])
+        self.assertEqual(count_rows(lines), 7)
+
+    def test_preview_and_row_count_come_from_the_cache_once_built(self):
+        dataset = self.make_dataset(CSV_CONTENT)
+        ensure_cache(dataset)
+        with mock.patch('data_manager.storage_utils.pd.read_csv') as read_csv:
+            self.assertEqual(len(read_preview(dataset, nrows=10)), 10)
+            self.assertEqual(count_rows(dataset), 50)
+        read_csv.assert_not_called()
+
+    def test_detail_view_stores_the_row_count(self):
+        dataset = self.make_dataset(CSV_CONTENT)
+        Dataset.objects.filter(pk=dataset.pk).update(status='READY')
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('dataset_detail', args=[dataset.pk]))
+        self.assertEqual(len(response.context['preview_data']['rows']), 10)
+        self.assertEqual(response.context['preview_data']['total_rows'], 50)
+        self.assertEqual(Dataset.objects.get(pk=dataset.pk).row_count, 50)
+
+
+class _Pool:
+    """Stands in for the worker command's process pool, running jobs in this process"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+
+    def submit(self, func, job_id):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        else:
+            future.set_result(run_job(job_id))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@override_settings(INGESTION_RUN_INLINE=False, INGESTION_MAX_ATTEMPTS=3, INGESTION_RETRY_DELAY=30,
+                   CACHES=TEST_CACHES)
+class IngestionJobTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        self.dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        self.job = enqueue_ingestion(self.dataset)
+
+    def claim(self):
+        IngestionJob.objects.filter(pk=self.job.pk).update(available_at=timezone.now())
+        return claim_next_job('test')
+
+    def test_failures_are_retried_with_backoff(self):
+        with mock.patch('data_manager.ingestion_utils.process_dataset_file', side_effect=RuntimeError("bad file")), \
+                self.assertLogs('data_manager.ingestion_utils', 'WARNING'):
+            for attempt, delay in ((1, 30), (2, 60)):
+                started = timezone.now()
+                self.assertEqual(run_job(self.claim().pk), 'QUEUED')
+                self.job.refresh_from_db()
+                self.assertEqual(self.job.attempts, attempt)
+                self.assertAlmostEqual((self.job.available_at - started).total_seconds(), delay, delta=5)
+                # Not claimable before the backoff expires
+                self.assertIsNone(claim_next_job('test'))
+            self.assertEqual(run_job(self.claim().pk), 'FAILED')
+        self.job.refresh_from_db()
+        self.assertIn('bad file', self.job.error)
+        self.assertEqual(Dataset.objects.get(pk=self.dataset.pk).status, 'FAILED')
+
+    def test_crashed_jobs_are_released_until_out_of_attempts(self):
+        for expected in ('QUEUED', 'QUEUED', 'FAILED'):
+            release_crashed_job(self.claim().pk)
+            self.job.refresh_from_db()
+            self.assertEqual(self.job.status, expected)
+        self.assertEqual(self.job.attempts, 3)
+        self.assertEqual(Dataset.objects.get(pk=self.dataset.pk).status, 'FAILED')
+
+    def test_only_jobs_without_recent_heartbeat_are_requeued(self):
+        other = enqueue_ingestion(self.dataset)
+        self.claim(), claim_next_job('test')
+        long_ago = timezone.now() - timedelta(hours=2)
+        # Both started long ago, but only the first one stopped sending heartbeats
+        IngestionJob.objects.update(started_at=long_ago, heartbeat_at=long_ago)
+        heartbeat_jobs([other.pk])
+        self.assertEqual(requeue_stale_jobs(300), 1)
+        self.assertEqual(IngestionJob.objects.get(pk=self.job.pk).status, 'QUEUED')
+        self.assertEqual(IngestionJob.objects.get(pk=other.pk).status, 'RUNNING')
+
+    def test_worker_replaces_a_broken_pool(self):
+        pools = [_Pool(broken=True), _Pool()]
+        with mock.patch.object(run_ingestion_worker.Command, 'start_pool', side_effect=pools):
+            call_command('run_ingestion_worker', '--once', '--workers=1', stdout=io.StringIO(), stderr=io.StringIO())
+        self.job.refresh_from_db()
+        # The crash cost one attempt, the second pool ran the job
+        self.assertEqual((self.job.status, self.job.attempts), ('DONE', 2))
+        self.assertEqual(Dataset.objects.get(pk=self.dataset.pk).status, 'READY')
+
+
+@override_settings(JSON_BATCH_ROWS=4, JSON_FLATTEN_DEPTH=1, CACHES=TEST_CACHES)
+class JsonIngestionTests(MediaRootMixin, TestCase):
+    def make_dataset(self, content):
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset(name='data', file_type='JSON', owner=owner)
+        dataset.file.save('data.json', ContentFile(content.encode()))
+        return dataset
+
+    def test_nested_array_is_flattened_across_batches(self):
+        records = [{'id': i, 'user': {'name': f"u{i % 2}", 'geo': {'lat': 1}}, 'tags': ['a']} for i in range(10)]
+        records[9]['id'] = 'x9'
+        records[6]['score'] = 2.5
+        dataset = self.make_dataset(json.dumps(records, indent=1))
+
+        self.assertEqual(list(read_preview(dataset, nrows=2).columns), ['id', 'user.name', 'user.geo', 'tags'])
+        process_dataset_file(dataset)
+        df = load_dataframe(dataset)
+        self.assertEqual(len(df), 10)
+        self.assertEqual(list(df.columns), ['id', 'user.name', 'user.geo', 'tags', 'score'])
+        # A late string id turns the whole column into text; a late column is filled with nulls
+        self.assertEqual(df['id'].tolist()[-2:], ['8', 'x9'])
+        self.assertEqual(str(df['user.name'].dtype), 'category')
+        self.assertEqual(df['user.geo'].iloc[0], '{"lat":1}')
+        self.assertEqual(df['score'].isna().sum(), 9)
+
+    def test_json_lines(self):
+        dataset = self.make_dataset('{"a": 1}\n{"a": 2, "b": {"c": true}}\n\n{"a": 3}\n')
+        process_dataset_file(dataset)
+        self.assertEqual(load_dataframe(dataset).to_dict('list')['b.c'][1], True)
+        self.assertEqual(dataset.row_count, 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SchemaInferenceTests(MediaRootMixin, TestCase):
+    def test_compact_dtypes(self):
+        self.assertEqual(str(optimize_series(pd.Series(['a', 'b', 'a', 'b', None])).dtype), 'category')
+        self.assertEqual(str(optimize_series(pd.Series([1, 2, 300])).dtype), 'int16')
+        self.assertEqual(str(optimize_series(pd.Series([1.0, None, 3.0])).dtype), 'Int8')
+        self.assertEqual(str(optimize_series(pd.Series([0.5, 1.25])).dtype), 'float32')
+        self.assertEqual(str(optimize_series(pd.Series([0.1, 0.2])).dtype), 'float64')
+        self.assertTrue(str(optimize_series(pd.Series(['2024-01-01', '2024-02-01'])).dtype).startswith('datetime64'))
+        # Numbers stored as text are not mistaken for dates
+        self.assertFalse(str(optimize_series(pd.Series(['2020', '2021'])).dtype).startswith('datetime64'))
+
+    def test_stored_schema_is_reused_and_queryable(self):
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        process_dataset_file(dataset)
+        schema = dict(dataset.columns.values_list('name', 'data_type'))
+        self.assertEqual(schema, {'category': 'category', 'value': 'int8', 'amount': 'float32'})
+
+        invalidate_cache(dataset)
+        df = load_dataframe(dataset)
+        self.assertEqual({column: str(dtype) for column, dtype in df.dtypes.items()}, schema)
+
+        result = run_query(dataset, {'columns': ['category'], 'order_by': ['-category'], 'limit': 1,
+                                     'filters': [{'column': 'category', 'op': 'contains', 'value': 'C'}]})
+        self.assertEqual(result.to_pylist(), [{'category': 'c4'}])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RowsApiTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        # Small row groups, so pages and filters span several of them
+        with mock.patch('data_manager.storage_utils.ROW_GROUP_SIZE', 8):
+            process_dataset_file(dataset)
+        Dataset.objects.filter(pk=dataset.pk).update(status='READY')
+        self.client.force_login(owner)
+        self.url = reverse('api_dataset_rows', args=[dataset.pk])
+
+    def pages(self, **params):
+        offset, rows = 0, []
+        while True:
+            page = self.client.get(self.url, {**params, 'offset': offset, 'limit': 7}).json()
+            rows += page['rows']
+            if not page['has_more']:
+                return rows, page
+            offset += 7
+
+    def test_pages_cover_every_row_once(self):
+        rows, page = self.pages(columns='value')
+        self.assertEqual([row[0] for row in rows], list(range(50)))
+        self.assertEqual(page['total'], 50)
+
+        rows, _ = self.pages(columns='value', sort='-amount')
+        self.assertEqual([row[0] for row in rows], list(range(49, -1, -1)))
+
+    def test_filtered_pages_and_counts(self):
+        rows, page = self.pages(columns='category,value', filter=['category:eq:c3', 'value:gte:20'], count='1')
+        self.assertEqual(rows, [['c3', value] for value in (23, 28, 33, 38, 43, 48)])
+        self.assertEqual(page['total'], 6)
+
+        response = self.client.get(self.url, {'columns': 'value', 'sort': '-value', 'filter': 'category:in:c1|c2',
+                                              'limit': 3})
+        self.assertEqual(response.json()['rows'], [[47], [46], [42]])
+        self.assertEqual(self.client.get(self.url, {'limit': 5000}).json()['limit'], 1000)
+        self.assertEqual(self.client.get(self.url, {'filter': 'missing:eq:1'}).status_code, 400)
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES)
+class QueryApiTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        self.dataset.file.save('data.csv', ContentFile(
+            ("day," + CSV_CONTENT.replace("\n", "\n2024-01-01,")).encode()))
+        process_dataset_file(self.dataset)
+        Dataset.objects.filter(pk=self.dataset.pk).update(status='READY')
+        self.client.force_login(owner)
+        self.url = reverse('api_dataset_query', args=[self.dataset.pk])
+
+    def query(self, spec):
+        return self.client.post(self.url, spec, content_type='application/json')
+
+    def assertRejected(self, spec, message):
+        response = self.query(spec)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json()['error'])
+
+    def test_identical_aggregates_under_different_names(self):
+        response = self.query({'group_by': ['category'], 'order_by': ['category'], 'limit': 1, 'aggregates': [
+            {'column': 'value', 'func': 'sum', 'as': 'total'},
+            {'column': 'value', 'func': 'sum', 'as': 'again'},
+            {'func': 'count'},
+        ]})
+        self.assertEqual(response.json()['columns'], ['category', 'total', 'again', 'count'])
+        self.assertEqual(response.json()['rows'], [['c0', 225, 225, 10]])
+
+    def test_group_key_can_also_be_aggregated(self):
+        response = self.query({'group_by': ['value'], 'aggregates': [{'column': 'value', 'func': 'count'}],
+                               'order_by': ['-value'], 'limit': 1})
+        self.assertEqual(response.json()['rows'], [[49, 1]])
+
+    def test_duplicate_output_names(self):
+        self.assertRejected({'group_by': ['category'],
+                             'aggregates': [{'column': 'value', 'func': 'sum', 'as': 'category'}]}, 'category')
+        self.assertRejected({'aggregates': [{'column': 'value', 'func': 'sum'}, {'column': 'value', 'func': 'sum'}]},
+                            'value_sum')
+        self.assertRejected({'columns': ['value', 'value']}, 'Duplicate')
+
+    def test_filter_values(self):
+        self.assertRejected({'columns': ['value'], 'filters': [{'column': 'value', 'op': 'gt'}]}, 'needs a value')
+        self.assertRejected({'columns': ['value'], 'filters': [{'column': 'category', 'op': 'in', 'value': 'c1'}]},
+                            'list')
+        self.assertRejected({'columns': ['value'], 'filters': [{'column': 'value', 'op': 'like', 'value': 1}]},
+                            'must be one of')
+        response = self.query({'aggregates': [{'func': 'count'}],
+                               'filters': [{'column': 'value', 'op': 'notnull'},
+                                           {'column': 'category', 'op': 'in', 'value': ['c1', 'c2']}]})
+        self.assertEqual(response.json()['rows'], [[20]])
+
+    def test_aggregate_and_bucket_types(self):
+        self.assertRejected({'aggregates': [{'column': 'category', 'func': 'mean'}]}, "Cannot mean column 'category'")
+        self.assertRejected({'time_bucket': {'column': 'value', 'unit': 'month'}, 'aggregates': [{'func': 'count'}]},
+                            "Cannot bucket column 'value'")
+        response = self.query({'time_bucket': {'column': 'day', 'unit': 'month'}, 'aggregates': [{'func': 'count'}]})
+        self.assertEqual(response.json()['rows'], [['2024-01-01T00:00:00', 50]])
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES, ASYNC_CPU_WORKERS=0)
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir, ignore_errors=True)
+        self.output = os.path.join(work_dir, 'results.json')
+
+    def benchmark(self, *args):
+        call_command('benchmark', '--rows=200', '--columns=4', '--formats=CSV', '--repeat=1', *args,
+                     stdout=io.StringIO())
+
+    def test_results_are_recorded_and_compared_with_a_baseline(self):
+        self.benchmark('--output', self.output)
+        results = load_results(self.output)
+        self.assertEqual(sorted(results), [f"{scenario}/csv/200x4" for scenario in
+                                           ('analyze_cold', 'analyze_warm', 'detail', 'ingest', 'list')])
+        self.assertGreater(results['ingest/csv/200x4']['median_s'], 0)
+        self.assertFalse(Dataset.objects.exists())
+
+        # A baseline that was much faster and ran fewer queries
+        for result in results.values():
+            result['median_s'] /= 100
+            result['queries'] = max(result['queries'] - 1, 0)
+        save_results(self.output, results)
+        with self.assertRaisesMessage(CommandError, 'regression'):
+            self.benchmark('--scenarios=ingest', '--baseline', self.output, '--fail-on-regression')
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES, ASYNC_CPU_WORKERS=0, PROFILING_ENABLED=True,
+                   PROFILING_SAMPLE_RATE=0.0)
+class ProfilingMiddlewareTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset(name='data', file_type='CSV', owner=self.user)
+        self.dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        process_dataset_file(self.dataset)
+        Dataset.objects.filter(pk=self.dataset.pk).update(status='READY')
+        self.client.force_login(self.user)
+        self.url = reverse('dataset_detail', args=[self.dataset.pk])
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+
+    def test_phases_are_reported_and_logged(self):
+        with self.assertLogs('data_manager.profiling', 'INFO') as logs:
+            response = self.client.get(self.url)
+        phases = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertIn('load', phases)
+        self.assertIn('db', phases)
+        self.assertEqual(phases[-1], 'total')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['path'], record['status']), (self.url, 200))
+        self.assertIn('load', record['phases'])
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_staff_can_request_a_cprofile_dump(self):
+        with override_settings(PROFILING_OUTPUT_DIR=self.output_dir), \
+                self.assertLogs('data_manager.profiling', 'INFO'):
+            self.assertNotIn('X-Profile-Id', self.client.get(self.url, HTTP_X_PROFILE='1'))
+            User.objects.filter(pk=self.user.pk).update(is_staff=True)
+            response = self.client.get(self.url, HTTP_X_PROFILE='1')
+        (dump,) = os.listdir(self.output_dir)
+        self.assertTrue(dump.endswith(f"{response['X-Profile-Id']}.prof"))
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_middleware_adds_nothing(self):
+        self.assertNotIn('Server-Timing', self.client.get(self.url))
+
+
+class ChartDownsamplingTests(TestCase):
+    def test_scatter_keeps_extremes_within_the_budget(self):
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame({'x': rng.normal(size=10_000), 'y': rng.normal(size=10_000)})
+        df.loc[:10, 'y'] = None
+        payload = build_scatter(df, 'x', 'y', max_points=500)
+        self.assertTrue(payload['sampled'])
+        self.assertEqual(payload['total_points'], 10_000 - 11)
+        self.assertLessEqual(len(payload['data']), 500)
+        xs = [point['x'] for point in payload['data']]
+        complete = df.dropna()
+        self.assertEqual((min(xs), max(xs)), (complete['x'].min(), complete['x'].max()))
+
+        small = build_scatter(df.iloc[20:30], 'x', 'y', max_points=500)
+        self.assertFalse(small['sampled'])
+        self.assertEqual(len(small['data']), 10)
+
+    def test_line_keeps_endpoints_and_peaks(self):
+        x = np.arange(5000)
+        y = np.sin(x / 100.0)
+        y[2500] = 50
+        indices = lttb_indices(x, y, 200)
+        self.assertEqual(len(indices), 200)
+        self.assertEqual((indices[0], indices[-1]), (0, 4999))
+        self.assertIn(2500, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+        payload = build_line(pd.DataFrame({'x': x, 'y': y}), 'x', 'y', max_points=200)
+        self.assertTrue(payload['sampled'])
+        self.assertEqual(len(payload['values']), 200)
+        self.assertEqual(max(payload['values']), 50)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ChartPlanTests(MediaRootMixin, TestCase):
+    def test_charts_follow_column_kinds(self):
+        columns = [DataColumn(name=name, kind=kind) for name, kind in [
+            ('country', 'CATEGORICAL'), ('continent', 'CATEGORICAL'), ('date', 'DATETIME'),
+            ('total_cases', 'NUMERIC'), ('total_deaths', 'NUMERIC'),
+        ]]
+        charts = plan_charts(columns)
+        self.assertEqual(set(charts), {'bar', 'breakdown', 'scatter', 'timeseries'})
+        self.assertEqual(charts['breakdown']['query']['group_by'], ['continent'])
+        self.assertEqual((charts['scatter']['x'], charts['scatter']['y'], charts['scatter']['point_label']),
+                         ('total_cases', 'total_deaths', 'country'))
+        self.assertEqual(set(plan_charts(columns[3:])), {'scatter'})
+
+    def test_breakdown_of_a_high_cardinality_column_is_capped(self):
+        owner = User.objects.create_user('owner', password='pw')
+        content = "category,order_id,value\n" + "\n".join(f"c{i % 3},order-{i},{i}" for i in range(500))
+        dataset = Dataset(name='orders', file_type='CSV', owner=owner)
+        dataset.file.save('orders.csv', ContentFile(content.encode()))
+        process_dataset_file(dataset)
+
+        breakdown = build_analysis(dataset)['chart_data']['breakdown']
+        self.assertEqual(breakdown['labels'], [f"order-{i}" for i in range(499, 489, -1)])
+        self.assertEqual(breakdown['values'], list(range(499, 489, -1)))
+
+    @override_settings(ACTIVITY_LOG_ASYNC=False)
+    def test_user_values_reach_the_page_as_json(self):
+        owner = User.objects.create_user('owner', password='pw')
+        label = '</script><script>alert(1)</script>'
+        content = f"category,value,amount\n{label},,1\nplain,,2\nplain,5,6\n,3,4\n"
+        dataset = Dataset(name='hostile', file_type='CSV', owner=owner, status='READY')
+        dataset.file.save('hostile.csv', ContentFile(content.encode()))
+        process_dataset_file(dataset)
+
+        self.client.force_login(owner)
+        response = self.client.get(reverse('analyze_dataset', args=[dataset.pk]))
+        self.assertNotContains(response, label)
+        script = response.content.decode().split('<script id="chart-data" type="application/json">')[1]
+
+        def reject(constant):
+            raise ValueError(f"{constant} is not valid JSON")
+
+        chart_data = json.loads(script.split('</script>')[0], parse_constant=reject)
+        self.assertEqual(dict(zip(chart_data['bar']['labels'], chart_data['bar']['values'])),
+                         {label: None, 'plain': 5})
+        self.assertEqual(chart_data['scatter']['data'],
+                         [{'x': 5.0, 'y': 6.0, 'label': 'plain'}, {'x': 3.0, 'y': 4.0, 'label': ''}])
+
+    def test_scatter_points_carry_their_label(self):
+        df = pd.DataFrame({'x': [1, 2, np.inf], 'y': [3, 4, 5], 'name': ['a', None, 'c']})
+        self.assertEqual(build_scatter(df, 'x', 'y', label_col='name')['data'],
+                         [{'x': 1.0, 'y': 3.0, 'label': 'a'}, {'x': 2.0, 'y': 4.0, 'label': ''}])
+
+    def test_non_finite_values_become_gaps(self):
+        df = pd.DataFrame({'label': ['a', None, 'c'], 'value': [np.nan, 2.0, -np.inf]})
+        self.assertEqual(build_bar(df, 'label', 'value'), {'labels': ['a', None, 'c'], 'values': [None, 2.0, None]})
+        self.assertEqual(build_line(df.assign(x=[1, 2, 3]), 'x', 'value')['values'], [2.0])
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, INGESTION_RUN_INLINE=False, CHUNKED_UPLOAD_CHUNK_SIZE=16,
+                   MAX_UPLOAD_SIZE=64)
+class ChunkedUploadTests(MediaRootMixin, TestCase):
+    content = CSV_CONTENT.encode()[:40]
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.owner)
+
+    def start(self, size=None):
+        body = {'name': 'big', 'filename': 'big.csv', 'file_type': 'CSV', 'size': size or len(self.content)}
+        return self.client.post(reverse('upload_init'), json.dumps(body), content_type='application/json')
+
+    def put_chunk(self, upload_id, index):
+        body = self.content[index * 16:(index + 1) * 16]
+        return self.client.put(reverse('upload_chunk', args=[upload_id, index]), body,
+                               content_type='application/octet-stream')
+
+    def test_interrupted_upload_resumes_and_completes(self):
+        state = self.start().json()
+        upload_id = state['upload_id']
+        self.assertEqual((state['total_chunks'], state['missing_chunks']), (3, [0, 1, 2]))
+        self.assertEqual(self.put_chunk(upload_id, 2).status_code, 200)
+        self.assertEqual(self.put_chunk(upload_id, 0).status_code, 200)
+
+        complete_url = reverse('upload_complete', args=[upload_id])
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing_chunks'], [1])
+        self.assertFalse(IngestionJob.objects.exists())
+
+        # After a disconnect the client asks which chunks are still missing
+        status = self.client.get(reverse('upload_session_status', args=[upload_id])).json()
+        for index in status['missing_chunks']:
+            self.put_chunk(upload_id, index)
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, 200)
+        dataset = Dataset.objects.get(pk=response.json()['dataset_id'])
+        with dataset.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertEqual(IngestionJob.objects.get().dataset, dataset)
+
+        # Completing again returns the same dataset without queueing it twice
+        self.assertEqual(self.client.post(complete_url).json()['dataset_id'], dataset.pk)
+        self.assertEqual(IngestionJob.objects.count(), 1)
+
+    def test_failed_resend_marks_the_chunk_missing_again(self):
+        upload_id = self.start().json()['upload_id']
+        for index in range(3):
+            self.put_chunk(upload_id, index)
+        response = self.client.put(reverse('upload_chunk', args=[upload_id, 1]), b'short',
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+        complete_url = reverse('upload_complete', args=[upload_id])
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing_chunks'], [1])
+        self.assertFalse(Dataset.objects.exists())
+
+        self.put_chunk(upload_id, 1)
+        dataset = Dataset.objects.get(pk=self.client.post(complete_url).json()['dataset_id'])
+        with dataset.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_truncated_part_file_is_not_ingested(self):
+        upload_id = self.start().json()['upload_id']
+        for index in range(3):
+            self.put_chunk(upload_id, index)
+        session = UploadSession.objects.get(pk=upload_id)
+        with open(get_part_path(session), 'r+b') as fh:
+            fh.truncate(10)
+        response = self.client.post(reverse('upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Dataset.objects.exists())
+
+    def test_oversized_or_unallocatable_uploads_are_rejected(self):
+        response = self.start(size=65)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('larger than 64 bytes', response.json()['error'])
+
+        with mock.patch('data_manager.upload_utils.open', side_effect=OSError(28, 'No space left on device'),
+                        create=True), self.assertLogs('data_manager.upload_utils', 'WARNING'):
+            response = self.start()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES)
+class DownloadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset(name='My Data', file_type='CSV', owner=self.owner)
+        self.dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        process_dataset_file(self.dataset)
+        Dataset.objects.filter(pk=self.dataset.pk).update(status='READY')
+        self.client.login(username='owner', password='pw')
+        self.url = reverse('download_dataset', args=[self.dataset.pk])
+
+    def test_formats_and_filters(self):
+        response = self.client.get(self.url, {'format': 'jsonl', 'compression': 'gzip',
+                                               'columns': 'value', 'filter': 'value:lt:2'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="my-data.jsonl.gz"')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'{"value":0}\n{"value":1}\n')
+
+        response = self.client.get(self.url, {'format': 'parquet'})
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 50)
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(UserActivity.objects.filter(action='DOWNLOAD').count(), 2)
+
+    def test_conditional_and_range_requests(self):
+        response = self.client.get(self.url)
+        body = b''.join(response.streaming_content)
+        self.assertTrue(body.startswith(b'"category","value","amount"\n'))
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 10-19/{len(body)}")
+        self.assertEqual(b''.join(response.streaming_content), body[10:20])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f"bytes={len(body)}-").status_code, 416)
+        # The resumed transfer is not counted as another download
+        self.assertEqual(UserActivity.objects.filter(action='DOWNLOAD').count(), 1)
+
+    def test_only_resumed_downloads_are_stored_and_capped(self):
+        exports = {format: DatasetExport(self.dataset, format=format) for format in ('csv', 'jsonl', 'parquet')}
+        for export in exports.values():
+            export.path.unlink(missing_ok=True)
+        b''.join(self.client.get(self.url).streaming_content)
+        self.assertFalse(exports['csv'].is_stored())
+
+        for format in ('csv', 'jsonl'):
+            b''.join(self.client.get(self.url, {'format': format}, HTTP_RANGE='bytes=0-9').streaming_content)
+        # Reading the CSV export again makes the JSON lines one the least recently used
+        past = time.time() - 60
+        os.utime(exports['jsonl'].path, (past, past))
+        b''.join(self.client.get(self.url, HTTP_RANGE='bytes=0-9').streaming_content)
+
+        # Room for the CSV and Parquet exports only
+        cap = exports['csv'].size() + len(b''.join(exports['parquet'].generate()))
+        with override_settings(EXPORT_STORE_MAX_BYTES=cap):
+            response = self.client.get(self.url, {'format': 'parquet'}, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual([format for format, export in exports.items() if export.is_stored()], ['csv', 'parquet'])
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=False, CACHES=TEST_CACHES)
+class SearchTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+
+    def make_dataset(self, name, owner, **kwargs):
+        return Dataset.objects.create(name=name, file='datasets/data.csv', file_type='CSV', owner=owner, **kwargs)
+
+    def test_ranked_prefix_search_respects_permissions(self):
+        # The index is written when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            weather = self.make_dataset('Weather stations', self.owner)
+            self.make_dataset('Sales', self.owner, description='Monthly weather-adjusted revenue')
+            self.make_dataset('Private weather', self.other)
+            public = self.make_dataset('Public climate', self.other, is_public=True)
+            DataColumn.objects.create(dataset=public, name='temperature', kind='CATEGORICAL',
+                                      top_values=[['Reykjavik', 3]])
+
+        self.client.login(username='owner', password='pw')
+        names = [result['name'] for result in self.client.get(reverse('api_search'), {'q': 'weath'}).json()['results']]
+        # Name matches outrank description matches; other users' private datasets are hidden
+        self.assertEqual(names, ['Weather stations', 'Sales'])
+        results = self.client.get(reverse('api_search'), {'q': 'reykj temp'}).json()['results']
+        self.assertEqual([result['id'] for result in results], [public.pk])
+        self.assertEqual(self.client.get(reverse('api_search'), {'q': '"*) OR'}).json()['results'], [])
+        self.assertEqual(UserActivity.objects.filter(action='SEARCH').count(), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            weather.name = 'Rainfall'
+            weather.save()
+            public.delete()
+        response = self.client.get(reverse('dataset_search'), {'q': 'rain'})
+        self.assertContains(response, 'Rainfall')
+        self.assertEqual(self.client.get(reverse('api_search'), {'q': 'reykj'}).json()['results'], [])
+
+    def test_replacing_columns_deletes_in_one_statement_and_reindexes_once(self):
+        dataset = self.make_dataset('Stations', self.owner)
+        DataColumn.objects.bulk_create(
+            [DataColumn(dataset=dataset, name=f'old{i}', kind='NUMERIC') for i in range(20)]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            dataset.columns.all().delete()
+        self.assertEqual([q['sql'].split()[0] for q in queries.captured_queries], ['DELETE'])
+
+        df = pd.DataFrame({'humidity': [1, 2], 'station': ['north', 'south']})
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            store_column_profiles(dataset, df)
+            store_column_profiles(dataset, df)
+        self.assertTrue(callbacks)
+
+        self.client.login(username='owner', password='pw')
+        results = self.client.get(reverse('api_search'), {'q': 'humid'}).json()['results']
+        self.assertEqual([result['id'] for result in results], [dataset.pk])
+        self.assertEqual(self.client.get(reverse('api_search'), {'q': 'old1'}).json()['results'], [])
+
+
+class ProfileTests(TestCase):
+    def test_fused_numeric_profile_matches_numpy(self):
+        values = pd.Series([3, 1, 2, 3, None, 3, 7, 1], dtype='Int8')
+        df = pd.DataFrame({'n': values, 'c': list('abcabcaa')})
+        profiles = profile_dataframe(df, workers=2)
+        self.assertEqual(profiles, profile_dataframe(df, workers=1))
+
+        numeric, text = profiles
+        array = values.dropna().to_numpy(dtype=float)
+        counts, edges = np.histogram(array, bins=20)
+        self.assertEqual((numeric['min_value'], numeric['max_value'], numeric['distinct_count']), (1.0, 7.0, 4))
+        self.assertEqual(numeric['top_values'], [[3, 3], [1, 2], [2, 1], [7, 1]])
+        self.assertEqual(numeric['quantiles'], {str(q): float(np.quantile(array, q)) for q in (0.25, 0.5, 0.75)})
+        self.assertEqual(numeric['histogram']['counts'], counts.tolist())
+        self.assertAlmostEqual(numeric['std'], array.std(ddof=1))
+        self.assertEqual(text['top_values'][0], ['a', 4])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StoredProfileTests(MediaRootMixin, TestCase):
+    def test_analysis_is_served_from_profiles_stored_at_upload(self):
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        process_dataset_file(dataset)
+
+        category, value, amount = dataset.columns.all()
+        self.assertEqual((category.kind, value.kind, amount.kind), ('CATEGORICAL', 'NUMERIC', 'NUMERIC'))
+        self.assertEqual((value.count, value.null_count, value.min_value, value.max_value), (50, 0, 0, 49))
+        self.assertEqual(value.mean, 24.5)
+        self.assertEqual(category.distinct_count, 5)
+        self.assertEqual(category.top_values[0], ['c0', 10])
+
+        with mock.patch('data_manager.analysis_utils.load_dataframe') as load:
+            payload = build_analysis(dataset)
+        load.assert_not_called()
+        self.assertEqual(payload['stats']['value'], {'mean': 24.5, 'min': 0, 'max': 49})
+        self.assertEqual(payload['chart_data']['distribution']['stats']['value']['median'], 24.5)
+
+
+class AnalysisCacheTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        location = os.path.join(self._media_root, 'analysis')
+        cache_settings = self.settings(CACHES={
+            **TEST_CACHES,
+            'analysis': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        })
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        for cache in caches.all():
+            cache.clear()
+        reset_cache_stats()
+        owner = User.objects.create_user('owner', password='pw')
+        self.dataset = Dataset(name='data', file_type='CSV', owner=owner)
+        self.dataset.file.save('data.csv', ContentFile(CSV_CONTENT.encode()))
+        process_dataset_file(self.dataset)
+
+    def test_file_tier_hits_are_promoted_to_memory(self):
+        payload = get_analysis(self.dataset)
+        caches['analysis_memory'].clear()
+        self.assertEqual(get_analysis(self.dataset), payload)
+        self.assertEqual(get_analysis(self.dataset), payload)
+        stats = get_cache_stats()
+        self.assertEqual((stats['misses'], stats['file_hits'], stats['memory_hits']), (1, 1, 1))
+
+    def test_invalidation_reaches_payloads_cached_by_other_processes(self):
+        get_analysis(self.dataset)
+        stale_key = analysis_cache_key(self.dataset)
+        stale_payload = get_cached_analysis(self.dataset)
+
+        invalidate_analysis(Dataset.objects.get(pk=self.dataset.pk))
+        # Another process' memory tier still holds the old entry
+        caches['analysis_memory'].set(stale_key, stale_payload)
+        dataset = Dataset.objects.get(pk=self.dataset.pk)
+        self.assertNotEqual(analysis_cache_key(dataset), stale_key)
+        self.assertIsNone(get_cached_analysis(dataset))
+        self.assertIsNone(caches['analysis'].get(stale_key))
+
+        # Saving the dataset expires the analysis too
+        get_analysis(dataset)
+        dataset.name = 'renamed'
+        dataset.save()
+        self.assertIsNone(get_cached_analysis(Dataset.objects.get(pk=dataset.pk)))
+
+
+@override_settings(CACHES=TEST_CACHES, PROFILE_WORKERS=1)
+class ColumnMetadataTests(QueryBudgetMixin, TestCase):
+    def test_columns_are_bulk_inserted_and_replaced(self):
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset.objects.create(name='wide', file_type='CSV', owner=owner)
+        narrow = pd.DataFrame({f"c{i}": range(3) for i in range(3)})
+        wide = pd.DataFrame({f"c{i}": range(3) for i in range(300)})
+        store_column_profiles(dataset, narrow)
+
+        # One INSERT per batch of rows, not one per column
+        self.assertLess(self.count_queries(store_column_profiles, dataset, wide), 300 // 10)
+        self.assertEqual(dataset.columns.count(), 300)
+        self.assertEqual(list(dataset.columns.values_list('position', flat=True)[:3]), [0, 1, 2])
+
+        store_column_profiles(dataset, narrow)
+        self.assertEqual(list(dataset.columns.values_list('name', flat=True)), ['c0', 'c1', 'c2'])
+
+
+@override_settings(EXCEL_SHEET_WORKERS=1, CACHES=TEST_CACHES)
+class ExcelSheetTests(MediaRootMixin, TestCase):
+    def test_every_sheet_becomes_a_table(self):
+        workbook = Workbook()
+        workbook.active.title = 'Totals'
+        workbook.active.append(['region', 'total'])
+        workbook.active.append(['north', 10])
+        orders = workbook.create_sheet('Orders')
+        orders.append(['order', 'amount', None])
+        for i in range(5):
+            orders.append([i, i * 2.5, 'x' if i == 3 else None])
+        orders.append([None, None, None])
+        path = f"{self._media_root}/book.xlsx"
+        workbook.save(path)
+
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset.objects.create(name='book', file='book.xlsx', file_type='EXCEL', owner=owner,
+                                         status='READY')
+        messages = []
+        process_dataset_file(dataset, progress=lambda percent, message: messages.append(message))
+
+        sheets = list(DatasetSheet.objects.filter(dataset=dataset).values_list('name', 'row_count'))
+        self.assertEqual(sheets, [('Totals', 1), ('Orders', 5)])
+        self.assertIn("Parsed sheet 2 of 2 (Orders: 5 rows)", messages)
+        self.assertEqual(dataset.row_count, 1)
+
+        self.client.force_login(owner)
+        response = self.client.get(reverse('api_dataset_rows', args=[dataset.pk]),
+                                   {'sheet': 1, 'sort': '-amount', 'limit': 2})
+        self.assertEqual(response.json()['columns'], ['order', 'amount', 'Unnamed: 2'])
+        self.assertEqual(response.json()['rows'], [[4, 10.0, None], [3, 7.5, 'x']])
+        response = self.client.get(reverse('api_dataset_rows', args=[dataset.pk]), {'sheet': 2})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('data_manager.excel_utils.SHEET_BATCH_ROWS', 3)
+    def test_sheets_are_streamed_in_batches(self):
+        workbook = Workbook()
+        workbook.active.append(['id', 'score', 'note', 'grade'])
+        for i in range(7):
+            workbook.active.append([i, i + 0.5 if i == 5 else i, None, 'ab'[i % 2]])
+        workbook.active.append([7, 8, 'late', 'c', 'extra'])
+        path = f"{self._media_root}/batches.xlsx"
+        workbook.save(path)
+
+        owner = User.objects.create_user('owner', password='pw')
+        dataset = Dataset.objects.create(name='batches', file='batches.xlsx', file_type='EXCEL', owner=owner,
+                                         status='READY')
+        with mock.patch('data_manager.storage_utils.write_batches', wraps=write_batches) as write:
+            process_dataset_file(dataset)
+        self.assertEqual(write.call_count, 1)
+
+        expected = pd.DataFrame({
+            'id': range(8),
+            'score': [0, 1, 2, 3, 4, 5.5, 6, 8],
+            'note': [None] * 7 + ['late'],
+            'grade': list('abababac'),
+            'Unnamed: 4': [None] * 7 + ['extra'],
+        })
+        df = load_dataframe(dataset)
+        pd.testing.assert_frame_equal(df.astype(object), expected.astype(object), check_dtype=False)
+        self.assertEqual((str(df['id'].dtype), str(df['grade'].dtype)), ('int8', 'category'))
+
+        # Rebuilding for the same content reuses the stored schema
+        invalidate_cache(dataset)
+        with mock.patch('data_manager.storage_utils.write_inferred') as write_inferred:
+            ensure_cache(dataset)
+        write_inferred.assert_not_called()
+        pd.testing.assert_frame_equal(load_dataframe(dataset), df)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AdmissionTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        content = "category,value\n" + "\n".join(f"c{i % 7},{i}" for i in range(5000))
+        self.dataset = Dataset(name='big', file_type='CSV', owner=owner)
+        self.dataset.file.save('big.csv', ContentFile(content.encode()))
+        process_dataset_file(self.dataset)
+        for cache in caches.all():
+            cache.clear()
+        reset_admission_stats()
+
+    def test_over_budget_analysis_runs_on_a_sample(self):
+        estimate = estimate_analysis_memory(self.dataset, list(self.dataset.columns.all()))
+        with override_settings(ANALYSIS_MEMORY_BUDGET=estimate // 4):
+            payload = get_analysis(self.dataset, user_id=1)
+        self.assertEqual(payload['sample'], {'rows': 1250, 'total_rows': 5000})
+        sampled = np.linspace(0, 4999, 1250).astype(int)
+        self.assertEqual(sum(payload['chart_data']['bar']['values']), sampled.sum())
+        stats = get_admission_stats()
+        self.assertEqual((stats['admitted'], stats['sampled'], stats['reserved_bytes']), (1, 1, 0))
+        # Sampled payloads are not cached; with memory to spare the analysis is exact
+        self.assertIsNone(get_analysis(self.dataset, user_id=1)['sample'])
+
+    @override_settings(ANALYSIS_MAX_PER_USER=1, ANALYSIS_QUEUE_TIMEOUT=0)
+    def test_per_user_limit(self):
+        admission = controller.acquire(1, 100)
+        with self.assertRaises(AdmissionRejected) as context:
+            controller.acquire(1, 100)
+        self.assertEqual(context.exception.reason, 'user_limit')
+        controller.release(controller.acquire(2, 100))
+        controller.release(admission)
+        controller.release(controller.acquire(1, 100))
+        stats = get_admission_stats()
+        self.assertEqual((stats['admitted'], stats['queued_total'], stats['rejected_user_limit']), (3, 1, 1))
+
+    def test_read_sample_is_evenly_spaced(self):
+        parquet_file = pq.ParquetFile(ensure_cache(self.dataset))
+        self.assertEqual(read_sample(parquet_file, 5, ['value']).column('value').to_pylist(),
+                         [0, 1249, 2499, 3749, 4999])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SketchTests(MediaRootMixin, TestCase):
+    def test_merged_sketches_stay_within_their_bounds(self):
+        rng = np.random.default_rng(0)
+        values = pd.Series(np.concatenate([rng.normal(size=150_000), np.full(50_000, 7.0)]))
+        chunks = np.array_split(rng.permutation(len(values)), 8)
+        sketch = ColumnSketch('NUMERIC')
+        for seed, chunk in enumerate(chunks):
+            part = ColumnSketch('NUMERIC', seed=seed)
+            part.update(values.iloc[chunk])
+            sketch.merge(part)
+        profile, exact = sketch.profile(), profile_dataframe(values.to_frame('x'))[0]
+
+        bounds = profile['error_bounds']
+        self.assertEqual((profile['count'], profile['max_value']), (exact['count'], exact['max_value']))
+        self.assertAlmostEqual(profile['std'], exact['std'])
+        ordered = np.sort(values.to_numpy())
+        for q, value in profile['quantiles'].items():
+            rank = np.searchsorted(ordered, value) / len(ordered)
+            self.assertLess(abs(rank - float(q)), bounds['rank'])
+        self.assertLess(abs(profile['distinct_count'] / exact['distinct_count'] - 1), bounds['distinct'])
+        self.assertEqual(profile['top_values'][0][0], 7.0)
+        self.assertLessEqual(profile['top_values'][0][1] - 50_000, bounds['top_count'])
+
+    @override_settings(APPROX_MIN_ROWS=1000, APPROX_SAMPLE_ROWS=500)
+    def test_large_datasets_are_analyzed_approximately_unless_exact(self):
+        owner = User.objects.create_user('owner', password='pw')
+        content = "category,value\n" + "\n".join(f"c{i % 4},{i % 100}" for i in range(5000))
+        dataset = Dataset(name='big', file_type='CSV', owner=owner)
+        dataset.file.save('big.csv', ContentFile(content.encode()))
+        process_dataset_file(dataset)
+        self.assertTrue(all(column.is_approximate for column in dataset.columns.all()))
+
+        payload = get_analysis(dataset)
+        self.assertEqual(payload['approximate']['sample_rows'], 500)
+        self.assertTrue(payload['approximate_profiles'])
+        exact = {'c0': 60_000, 'c1': 61_250, 'c2': 62_500, 'c3': 63_750}
+        bar = payload['chart_data']['bar']
+        # Totals of the sample are scaled up to the whole table
+        for label, total in zip(bar['labels'], bar['values']):
+            self.assertAlmostEqual(total / exact[label], 1, delta=0.2)
+
+        payload = get_analysis(dataset, exact=True)
+        self.assertIsNone(payload['approximate'])
+        bar = payload['chart_data']['bar']
+        self.assertEqual(dict(zip(bar['labels'], bar['values'])), exact)
+        self.assertFalse(any(column.is_approximate for column in dataset.columns.all()))
@@ -0,0 +1,72 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Accumulated duration and call count of each named phase of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def add(self, name, seconds, count=1):
+        total, calls = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + seconds, calls + count)
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Phase durations in milliseconds, for structured logs"""
+        return {name: {'ms': round(seconds * 1000, 2), 'count': count}
+                for name, (seconds, count) in self.phases.items()}
+
+    def server_timing(self):
+        """Value for the Server-Timing response header"""
+        entries = [f'{name};dur={seconds * 1000:.1f};desc="{count}x"'
+                   for name, (seconds, count) in self.phases.items()]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ', '.join(entries)
+
+
+def start_request_timings():
+    """
+    Begin collecting phase timings for the current request
+
+    Returns:
+        (timings, token); pass the token to stop_request_timings()
+    """
+    timings = RequestTimings()
+    return timings, _timings.set(timings)
+
+
+def stop_request_timings(token):
+    _timings.reset(token)
+
+
+def current_timings():
+    return _timings.get()
+
+
+@contextmanager
+def phase(name):
+    """
+    Time a block as one phase of the current request
+
+    Does nothing beyond a context-variable lookup unless the profiling
+    middleware is collecting timings for this request. Repeated phases with
+    the same name are summed.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from .upload_utils import get_upload_dir
+
+
+class IncomingUploadedFile(TemporaryUploadedFile):
+    """Temporary upload stored next to MEDIA_ROOT/datasets/ rather than in /tmp"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=get_upload_dir())
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+class DatasetFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream every multipart upload straight to disk
+
+    Replaces Django's default pair of handlers so even small files never sit
+    in memory. Because the temporary file lives on the same filesystem as
+    MEDIA_ROOT, saving the Dataset moves it with a rename instead of a copy.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = IncomingUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import Dataset, UploadChunk, UploadSession
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_UPLOAD_SIZE = 10 * 1024 ** 3
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Raised when a chunked upload cannot be started or completed"""
+
+
+class ChunkError(UploadError):
+    """Raised when an uploaded chunk cannot be accepted"""
+
+
+def get_upload_dir():
+    """Directory of in-progress uploads, on the same filesystem as MEDIA_ROOT/datasets/"""
+    upload_dir = Path(settings.MEDIA_ROOT) / 'datasets' / '.uploads'
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    return upload_dir
+
+
+def get_part_path(session):
+    return get_upload_dir() / f"{session.pk}.part"
+
+
+def create_session(owner, filename, total_size, name, file_type, description='', is_public=False,
+                   chunk_size=None):
+    """
+    Start a chunked upload and pre-size its part file
+
+    Returns:
+        The new UploadSession
+
+    Raises:
+        UploadError: if the file is larger than ``MAX_UPLOAD_SIZE`` or its
+            part file cannot be allocated
+    """
+    max_size = getattr(settings, 'MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+    if max_size and total_size > max_size:
+        raise UploadError(f"Files larger than {max_size} bytes cannot be uploaded.")
+    chunk_size = chunk_size or getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    session = UploadSession.objects.create(
+        owner=owner,
+        filename=get_valid_filename(os.path.basename(filename)) or 'upload',
+        total_size=total_size,
+        chunk_size=chunk_size,
+        name=name,
+        description=description,
+        file_type=file_type,
+        is_public=is_public,
+    )
+    part_path = get_part_path(session)
+    try:
+        with open(part_path, 'wb') as fh:
+            fh.truncate(total_size)
+    except OSError as e:
+        logger.warning("Cannot allocate %s bytes for upload %s: %s", total_size, session.pk, e)
+        part_path.unlink(missing_ok=True)
+        session.delete()
+        raise UploadError("There is not enough space to store this file.") from e
+    return session
+
+
+def _write_slot(session, index, stream):
+    """Copy up to one chunk of ``stream`` into its slot; returns (bytes written, SHA-256 hex digest)"""
+    expected_size = session.expected_chunk_size(index)
+    digest = hashlib.sha256()
+    written = 0
+    with open(get_part_path(session), 'r+b') as fh:
+        fh.seek(index * session.chunk_size)
+        while written < expected_size:
+            block = stream.read(min(STREAM_BLOCK_SIZE, expected_size - written))
+            if not block:
+                break
+            fh.write(block)
+            digest.update(block)
+            written += len(block)
+    return written, digest.hexdigest()
+
+
+def write_chunk(session, index, stream, expected_checksum=None):
+    """
+    Stream one chunk from the request body into its slot in the part file
+
+    The body is copied in small blocks so memory use does not depend on the
+    chunk size. Chunks may arrive in any order and be re-sent after a
+    disconnect; a re-sent chunk overwrites its slot. A re-send that fails
+    part way or does not verify leaves the chunk missing, so the corrupted
+    slot is never assembled into a dataset.
+
+    Args:
+        session: Active UploadSession
+        index: Zero-based chunk number
+        stream: File-like request body
+        expected_checksum: Optional SHA-256 hex digest sent by the client
+
+    Returns:
+        The UploadChunk record
+
+    Raises:
+        ChunkError: if the index, size or checksum is wrong
+    """
+    if session.status != 'ACTIVE':
+        raise ChunkError("This upload is already complete.")
+    if not 0 <= index < session.total_chunks:
+        raise ChunkError(f"Chunk index {index} is out of range.")
+
+    # The slot is overwritten in place, so until the new bytes verify the
+    # chunk counts as missing and the upload cannot be completed
+    UploadChunk.objects.filter(session=session, index=index).delete()
+    written, checksum = _write_slot(session, index, stream)
+    expected_size = session.expected_chunk_size(index)
+    if written != expected_size or stream.read(1):
+        raise ChunkError(f"Chunk {index} must be exactly {expected_size} bytes.")
+    if expected_checksum and expected_checksum.lower() != checksum:
+        raise ChunkError(f"Checksum mismatch for chunk {index}.")
+
+    chunk, _ = UploadChunk.objects.update_or_create(
+        session=session, index=index, defaults={'size': written, 'checksum': checksum}
+    )
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return chunk
+
+
+def get_missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.total_chunks) if index not in received]
+
+
+async def aget_missing_chunks(session):
+    received = {index async for index in session.chunks.values_list('index', flat=True)}
+    return [index for index in range(session.total_chunks) if index not in received]
+
+
+def complete_session(session):
+    """
+    Move the assembled part file into MEDIA_ROOT/datasets/ and create the Dataset
+
+    The part file is renamed rather than copied, so completion takes the
+    same time for any file size. It is only accepted once every chunk has
+    been received and the assembled file has the announced size.
+
+    Returns:
+        The new Dataset
+
+    Raises:
+        ChunkError: if chunks are still missing or the sizes do not add up
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == 'COMPLETE':
+            return session.dataset
+
+        missing = get_missing_chunks(session)
+        if missing:
+            raise ChunkError(f"{len(missing)} chunk(s) have not been received.")
+        received = session.chunks.aggregate(total=Sum('size'))['total']
+        try:
+            assembled = os.path.getsize(get_part_path(session))
+        except FileNotFoundError:
+            assembled = None
+        if received != session.total_size or assembled != session.total_size:
+            raise ChunkError(f"The assembled file is not {session.total_size} bytes long.")
+
+        file_name = default_storage.get_available_name(f"datasets/{session.filename}")
+        os.replace(get_part_path(session), default_storage.path(file_name))
+        dataset = Dataset.objects.create(
+            name=session.name,
+            description=session.description,
+            file=file_name,
+            file_type=session.file_type,
+            is_public=session.is_public,
+            owner=session.owner,
+        )
+        session.status = 'COMPLETE'
+        session.dataset = dataset
+        session.save(update_fields=['status', 'dataset', 'updated_at'])
+        session.chunks.all().delete()
+    return dataset
+
+
+def cleanup_stale_sessions(max_age):
+    """
+    Delete active uploads not touched for ``max_age`` seconds, with their part files
+
+    Returns:
+        Number of sessions removed
+    """
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    stale = list(UploadSession.objects.filter(status='ACTIVE', updated_at__lt=cutoff))
+    for session in stale:
+        try:
+            get_part_path(session).unlink()
+        except FileNotFoundError:
+            pass
+        session.delete()
+    return len(stale)
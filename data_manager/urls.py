@@ -2,14 +2,29 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('datasets/', views.dataset_list, name='dataset_list'),
+    path('datasets/search/', views.dataset_search, name='dataset_search'),
     path('accounts/', include('django.contrib.auth.urls')),  
     path('datasets/upload/', views.upload_dataset, name='upload_dataset'),
+    path('uploads/', views.upload_init, name='upload_init'),
+    path('uploads/<uuid:upload_id>/', views.upload_session_status, name='upload_session_status'),
+    path('uploads/<uuid:upload_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_complete, name='upload_complete'),
     path('datasets/<int:pk>/', views.dataset_detail, name='dataset_detail'),
+    path('datasets/<int:pk>/status/', views.dataset_status, name='dataset_status'),
+    path('datasets/<int:pk>/download/', views.download_dataset, name='download_dataset'),
     path('datasets/<int:dataset_id>/analyze/', views.analyze_dataset, name='analyze_dataset'),
     path('dashboards/<int:pk>/', views.view_dashboard, name='view_dashboard'),
+    path('activity/', views.activity_dashboard, name='activity_dashboard'),
+    path('api/datasets/<int:pk>/rows/', api.dataset_rows, name='api_dataset_rows'),
+    path('api/datasets/<int:pk>/query/', api.dataset_query, name='api_dataset_query'),
+    path('api/datasets/<int:pk>/sheets/', api.dataset_sheets, name='api_dataset_sheets'),
+    path('api/datasets/<int:pk>/dashboards/', api.dataset_dashboards, name='api_dataset_dashboards'),
+    path('api/search/', api.search, name='api_search'),
+    path('api/cache/stats/', api.cache_stats, name='api_cache_stats'),
+    path('api/admission/stats/', api.admission_stats, name='api_admission_stats'),
 ]   + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,64 +1,222 @@
-import pandas as pd
-from django.shortcuts import render, redirect, get_object_or_404
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Dataset, DataColumn, MetabaseConfig, MetabaseDashboard
+from django.db.models import Count
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import require_GET, require_POST, require_http_methods, require_safe
+from .models import Dataset, MetabaseConfig, MetabaseDashboard, UploadSession, UserActivity
 from .forms import DatasetUploadForm
-from .metabase_utils import generate_metabase_url
-from .activity_utils import track_activity
+from .metabase_utils import get_active_config, get_embed_url
+from .pagination_utils import akeyset_page
+from .activity_utils import atrack_activity, get_activity_summary, track_activity
+from .admission_utils import AdmissionRejected
+from .analysis_utils import get_analysis
+from .async_utils import aget_user, arender, run_cpu_bound, streaming_body
+from .export_utils import DatasetExport, parse_range
+from .ingestion_utils import aget_ingestion_status, enqueue_ingestion
+from .query_utils import QueryError, parse_filter_param
+from .search_utils import search_datasets
+from .storage_utils import count_rows, read_preview
+from .timing_utils import phase
+from .upload_utils import (
+    ChunkError, UploadError, aget_missing_chunks, complete_session, create_session, get_missing_chunks, write_chunk,
+)
 
 @login_required
-def dataset_list(request):
+async def dataset_list(request):
     """View to list all datasets owned by the user"""
-    # Get user's datasets and public datasets
-    user_datasets = Dataset.objects.filter(owner=request.user).order_by('-upload_date')
-    public_datasets = Dataset.objects.filter(is_public=True).exclude(owner=request.user).order_by('-upload_date')
+    user = await aget_user(request)
+    # Get user's datasets and public datasets, one keyset page of each
+    page_size = getattr(settings, 'DATASET_LIST_PAGE_SIZE', 24)
+    user_datasets, next_cursor = await akeyset_page(
+        Dataset.objects.filter(owner=user).annotate(column_count=Count('columns')),
+        request.GET.get('cursor'),
+        page_size,
+    )
+    public_datasets, next_public_cursor = await akeyset_page(
+        Dataset.objects.filter(is_public=True).exclude(owner=user)
+        .select_related('owner').annotate(column_count=Count('columns')),
+        request.GET.get('public_cursor'),
+        page_size,
+    )
     
-    return render(request, 'data_manager/dataset_list.html', {
-        'user_datasets': user_datasets,
-        'public_datasets': public_datasets
-    })
+    with phase('render'):
+        response = await arender(request, 'data_manager/dataset_list.html', {
+            'user_datasets': user_datasets,
+            'public_datasets': public_datasets,
+            'next_cursor': next_cursor,
+            'next_public_cursor': next_public_cursor,
+            'cursor': request.GET.get('cursor', ''),
+            'public_cursor': request.GET.get('public_cursor', ''),
+        })
+    return response
 
 @login_required
-def dataset_detail(request, pk):
+def dataset_search(request):
+    """Search page over the datasets the user may read"""
+    query = request.GET.get('q', '').strip()
+    results = []
+    if query:
+        with phase('search'):
+            results = [dataset for dataset, _ in search_datasets(request.user, query)]
+        track_activity(request.user, 'SEARCH', query=query[:200], results=len(results))
+    with phase('render'):
+        response = render(request, 'data_manager/dataset_search.html', {
+            'query': query,
+            'results': results,
+        })
+    return response
+
+@login_required
+async def dataset_detail(request, pk):
     """View to display dataset details"""
-    dataset = get_object_or_404(Dataset, pk=pk)
+    dataset = await aget_object_or_404(Dataset.objects.select_related('owner'), pk=pk)
+    user = await aget_user(request)
     
     # Check permissions
-    if dataset.owner != request.user and not dataset.is_public:
+    if dataset.owner_id != user.id and not dataset.is_public:
         messages.error(request, "You don't have permission to view this dataset.")
         return redirect('dataset_list')
     
     # Track this view
-    track_activity(request.user, 'VIEW', dataset=dataset)
+    await atrack_activity(user, 'VIEW', dataset=dataset)
     
     # Load the data for preview
     preview_data = None
     try:
-        if dataset.file_type == 'CSV':
-            df = pd.read_csv(dataset.file.path)
-        elif dataset.file_type == 'EXCEL':
-            df = pd.read_excel(dataset.file.path)
-        elif dataset.file_type == 'JSON':
-            df = pd.read_json(dataset.file.path)
+        # Only the first 10 rows are read; the total comes from the Dataset row.
+        # File parsing runs in the CPU worker pool, off the event loop.
+        with phase('load'):
+            df = await run_cpu_bound(read_preview, dataset, nrows=10)
+        if dataset.row_count is None and dataset.status == 'READY':
+            dataset.row_count = await run_cpu_bound(count_rows, dataset)
+            await Dataset.objects.filter(pk=dataset.pk).aupdate(row_count=dataset.row_count)
         
-        # Get a preview of the first 10 rows
         preview_data = {
             'columns': df.columns.tolist(),
-            'rows': df.head(10).values.tolist(),
-            'total_rows': len(df)
+            'rows': df.values.tolist(),
+            'total_rows': dataset.row_count
         }
     except Exception as e:
         messages.error(request, f"Error loading data preview: {str(e)}")
     
     # Get associated dashboards
-    dashboards = dataset.dashboards.all() if hasattr(dataset, 'dashboards') else []
+    dashboards = [dashboard async for dashboard in dataset.dashboards.all()]
     
-    return render(request, 'data_manager/dataset_detail.html', {
-        'dataset': dataset,
-        'preview_data': preview_data,
-        'dashboards': dashboards
-    })
+    # Column metadata for the paginated data grid
+    grid_columns = [column async for column in dataset.columns.values('name', 'kind')] if dataset.status == 'READY' else []
+    
+    # Worksheets of Excel workbooks, each stored as its own table
+    sheets = [sheet async for sheet in dataset.sheets.all()] if dataset.file_type == 'EXCEL' else []
+    
+    with phase('render'):
+        response = await arender(request, 'data_manager/dataset_detail.html', {
+            'dataset': dataset,
+            'preview_data': preview_data,
+            'dashboards': dashboards,
+            'grid_columns': grid_columns,
+            'sheets': sheets,
+        })
+    return response
+
+@login_required
+async def dataset_status(request, pk):
+    """JSON processing status of a dataset, polled while ingestion runs"""
+    dataset = await aget_object_or_404(Dataset, pk=pk)
+    user = await aget_user(request)
+    
+    # Check permissions
+    if dataset.owner_id != user.id and not dataset.is_public:
+        return JsonResponse({'error': "You don't have permission to view this dataset."}, status=403)
+    
+    return JsonResponse(await aget_ingestion_status(dataset))
+
+@login_required
+@require_safe
+async def download_dataset(request, pk):
+    """
+    Stream a dataset, or a filtered projection of it, as a file
+
+    Query parameters:
+        format: csv (default), jsonl or parquet
+        compression: none (default), gzip or zstd (when zstandard is installed)
+        columns: Comma-separated projection
+        filter: Repeatable ``column:op:value``, as for the rows API
+        sheet: Worksheet position of an Excel dataset (default 0)
+
+    Responses carry an ETag, honour If-None-Match and support single
+    byte ranges so interrupted downloads can resume.
+    """
+    dataset = await aget_object_or_404(Dataset, pk=pk)
+    user = await aget_user(request)
+
+    # Check permissions
+    if dataset.owner_id != user.id and not dataset.is_public:
+        messages.error(request, "You don't have permission to download this dataset.")
+        return redirect('dataset_list')
+
+    if dataset.status != 'READY':
+        messages.info(request, "This dataset is still being processed. It can be downloaded once it is ready.")
+        return redirect('dataset_detail', pk=pk)
+
+    params = request.GET
+    columns = [column for column in params.get('columns', '').split(',') if column]
+    try:
+        sheet = int(params.get('sheet', 0))
+        # May build the columnar cache, which also updates the dataset row
+        export = await sync_to_async(DatasetExport)(
+            dataset,
+            format=params.get('format', 'csv'),
+            compression=params.get('compression', 'none'),
+            columns=columns or None,
+            filters=[parse_filter_param(param) for param in params.getlist('filter')],
+            sheet=sheet,
+        )
+    except (QueryError, ValueError) as e:
+        return HttpResponseBadRequest(str(e))
+
+    response = get_conditional_response(request, etag=export.etag)
+    if response is not None:
+        return response
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', export.etag) == export.etag:
+        # Resuming needs the exact bytes sent before, so serve the stored export
+        await sync_to_async(export.store, thread_sensitive=False)()
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], export.size())
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{export.size()}"
+            return response
+
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(streaming_body(request, export.read(start, end)), status=206,
+                                         content_type=export.content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{export.size()}"
+        response['Content-Length'] = end - start + 1
+    elif export.is_stored():
+        response = StreamingHttpResponse(streaming_body(request, export.read()), content_type=export.content_type)
+        response['Content-Length'] = export.size()
+    else:
+        response = StreamingHttpResponse(streaming_body(request, export.generate()), content_type=export.content_type)
+    response['ETag'] = export.etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(True, export.filename)
+
+    # Resumed transfers continue a download that was already recorded
+    if not byte_range or byte_range[0] == 0:
+        await atrack_activity(user, 'DOWNLOAD', dataset=dataset, format=export.format,
+                              compression=export.compression, filtered=bool(export.filters), sheet=sheet)
+    return response
 
 @login_required
 def upload_dataset(request):
@@ -70,59 +228,120 @@ def upload_dataset(request):
             dataset.owner = request.user
             dataset.save()
             
-            # Process the uploaded file
-            process_dataset_file(dataset)
+            # Parsing happens in the ingestion worker, not in this request
+            enqueue_ingestion(dataset)
             
             # Track upload activity
             track_activity(request.user, 'UPLOAD', dataset=dataset)
             
-            messages.success(request, f"Dataset '{dataset.name}' uploaded successfully!")
+            messages.success(request, f"Dataset '{dataset.name}' uploaded successfully! It is being processed.")
             return redirect('dataset_detail', pk=dataset.pk)
     else:
         form = DatasetUploadForm()
     
-    return render(request, 'data_manager/upload.html', {'form': form})
+    return render(request, 'data_manager/upload.html', {
+        'form': form,
+        'chunked_upload_threshold': settings.CHUNKED_UPLOAD_THRESHOLD
+    })
+
+def _upload_session_state(session, missing_chunks=None):
+    if missing_chunks is None:
+        missing_chunks = get_missing_chunks(session) if session.status == 'ACTIVE' else []
+    return {
+        'upload_id': str(session.pk),
+        'status': session.status,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'missing_chunks': missing_chunks,
+    }
 
-def process_dataset_file(dataset):
-    """Extract column information from uploaded file"""
-    file_path = dataset.file.path
+@login_required
+@require_POST
+def upload_init(request):
+    """Start a chunked upload; expects a JSON body with the dataset fields and file size"""
+    try:
+        data = json.loads(request.body)
+        total_size = int(data['size'])
+        filename = str(data['filename'])
+        name = str(data['name']).strip()
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "Expected JSON with name, filename and size."}, status=400)
+    
+    file_type = data.get('file_type')
+    if file_type not in dict(Dataset.FILE_TYPES):
+        return JsonResponse({'error': "Unsupported file type."}, status=400)
+    if not name or total_size <= 0:
+        return JsonResponse({'error': "A dataset name and a non-empty file are required."}, status=400)
     
-    # Different parsing based on file type
     try:
-        if dataset.file_type == 'CSV':
-            df = pd.read_csv(file_path)
-        elif dataset.file_type == 'EXCEL':
-            df = pd.read_excel(file_path)
-        elif dataset.file_type == 'JSON':
-            df = pd.read_json(file_path)
-        else:
-            # Default to CSV if file_type is not specified
-            df = pd.read_csv(file_path)
-        
-        # Create column entries for each column in the dataset
-        for column in df.columns:
-            DataColumn.objects.create(
-                dataset=dataset,
-                name=column,
-                data_type=str(df[column].dtype)
-            )
-    except Exception as e:
-        # Log the error, but don't crash
-        print(f"Error processing dataset file: {str(e)}")
+        session = create_session(
+            request.user,
+            filename=filename,
+            total_size=total_size,
+            name=name[:200],
+            file_type=file_type,
+            description=str(data.get('description', '')),
+            is_public=bool(data.get('is_public', False)),
+        )
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_session_state(session), status=201)
+
+@login_required
+@require_GET
+async def upload_session_status(request, upload_id):
+    """State of a chunked upload, used by the client to resume after a disconnect"""
+    session = await aget_object_or_404(UploadSession, pk=upload_id, owner=await aget_user(request))
+    missing_chunks = await aget_missing_chunks(session) if session.status == 'ACTIVE' else []
+    return JsonResponse(_upload_session_state(session, missing_chunks))
 
 @login_required
-def view_dashboard(request, pk):
+@require_http_methods(['PUT'])
+def upload_chunk(request, upload_id, index):
+    """Receive one chunk as the raw request body, verified against X-Chunk-Checksum"""
+    session = get_object_or_404(UploadSession, pk=upload_id, owner=request.user)
+    try:
+        chunk = write_chunk(session, index, request, request.headers.get('X-Chunk-Checksum'))
+    except ChunkError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'index': chunk.index, 'size': chunk.size, 'checksum': chunk.checksum})
+
+@login_required
+@require_POST
+def upload_complete(request, upload_id):
+    """Assemble a chunked upload into a Dataset and queue it for processing"""
+    session = get_object_or_404(UploadSession, pk=upload_id, owner=request.user)
+    already_complete = session.status == 'COMPLETE'
+    try:
+        dataset = complete_session(session)
+    except ChunkError as e:
+        return JsonResponse({'error': str(e), **_upload_session_state(session)}, status=400)
+    
+    if not already_complete:
+        enqueue_ingestion(dataset)
+        track_activity(request.user, 'UPLOAD', dataset=dataset, chunked=True)
+        messages.success(request, f"Dataset '{dataset.name}' uploaded successfully! It is being processed.")
+    
+    return JsonResponse({
+        'dataset_id': dataset.pk,
+        'detail_url': reverse('dataset_detail', args=[dataset.pk]),
+        'status_url': reverse('dataset_status', args=[dataset.pk]),
+    })
+
+@login_required
+async def view_dashboard(request, pk):
     """View to display an embedded Metabase dashboard"""
-    dashboard = get_object_or_404(MetabaseDashboard, pk=pk)
+    dashboard = await aget_object_or_404(MetabaseDashboard.objects.select_related('dataset'), pk=pk)
+    user = await aget_user(request)
     
     # Check permissions
-    if dashboard.dataset.owner != request.user and not dashboard.dataset.is_public:
+    if dashboard.dataset.owner_id != user.id and not dashboard.dataset.is_public:
         messages.error(request, "You don't have permission to view this dashboard.")
         return redirect('dataset_list')
     
     # Track this dashboard view
-    track_activity(
-        request.user, 
+    await atrack_activity(
+        user, 
         'DASHBOARD', 
         dataset=dashboard.dataset, 
         dashboard=dashboard
@@ -130,140 +349,70 @@ def view_dashboard(request, pk):
     
     # Get active Metabase config
     try:
-        metabase_config = MetabaseConfig.objects.get(is_active=True)
-        embed_url = generate_metabase_url(metabase_config, dashboard.dashboard_id)
+        metabase_config = await sync_to_async(get_active_config)()
+        embed_url = get_embed_url(metabase_config, dashboard.dashboard_id)
         metabase_available = True
     except MetabaseConfig.DoesNotExist:
         messages.error(request, "Metabase integration is not configured.")
         metabase_available = False
         embed_url = None
     
-    return render(request, 'data_manager/view_dashboard.html', {
-        'dashboard': dashboard,
-        'embed_url': embed_url,
-        'metabase_available': metabase_available
-    })
+    with phase('render'):
+        response = await arender(request, 'data_manager/view_dashboard.html', {
+            'dashboard': dashboard,
+            'embed_url': embed_url,
+            'metabase_available': metabase_available
+        })
+    return response
 
 def home(request):
     """View for home page"""
     return render(request, 'data_manager/home.html')
 
+@login_required
+def activity_dashboard(request):
+    """Activity on the user's datasets, read from the daily rollups only"""
+    everyone = request.user.is_staff and request.GET.get('scope') == 'all'
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 365)
+    except ValueError:
+        days = 30
+    summary = get_activity_summary(request.user, days=days, everyone=everyone)
+    action_labels = dict(UserActivity.ACTION_CHOICES)
+    with phase('render'):
+        response = render(request, 'data_manager/activity_dashboard.html', {
+            'summary': summary,
+            'days': days,
+            'everyone': everyone,
+            'action_labels': action_labels,
+            'own_actions': [(action_labels.get(action, action), total) for action, total in summary['own_actions'].items()],
+        })
+    return response
+
 @login_required
 def analyze_dataset(request, dataset_id):
-    dataset = get_object_or_404(Dataset, pk=dataset_id)
+    dataset = get_object_or_404(Dataset.objects.select_related('owner'), pk=dataset_id)
     
     # Check permissions
-    if dataset.owner != request.user and not dataset.is_public:
+    if dataset.owner_id != request.user.id and not dataset.is_public:
         messages.error(request, "You don't have permission to view this dashboard.")
         return redirect('dataset_list')
     
-    # Load the data
+    if dataset.status != 'READY':
+        messages.info(request, "This dataset is still being processed. Analysis will be available once it is ready.")
+        return redirect('dataset_detail', pk=dataset_id)
+    
     try:
-        if dataset.file_type == 'CSV':
-            df = pd.read_csv(dataset.file.path)
-        elif dataset.file_type == 'EXCEL':
-            df = pd.read_excel(dataset.file.path)
-        elif dataset.file_type == 'JSON':
-            df = pd.read_json(dataset.file.path)
-        else:
-            # Default to CSV
-            df = pd.read_csv(dataset.file.path)
-        
-        # Basic dataset info
-        column_types = {col: str(dtype) for col, dtype in zip(df.columns, df.dtypes)}
-        numeric_columns = df.select_dtypes(include=['int64', 'float64']).columns.tolist()
-        categorical_columns = df.select_dtypes(include=['object']).columns.tolist()
-        
-        # Summary statistics for numeric columns
-        stats = {}
-        for col in numeric_columns:
-            stats[col] = {
-                'mean': float(df[col].mean()) if not df[col].isnull().all() else 0,
-                'min': float(df[col].min()) if not df[col].isnull().all() else 0,
-                'max': float(df[col].max()) if not df[col].isnull().all() else 0,
-            }
-        
-        # Prepare data for charts
-        chart_data = {}
-        
-        # For COVID data specifically
-        is_covid_data = ('country' in df.columns and 'total_cases' in df.columns)
-        
-        if is_covid_data:
-            # Top countries by cases
-            top_cases = df.sort_values('total_cases', ascending=False).head(10)
-            chart_data['top_cases'] = {
-                'labels': top_cases['country'].tolist(),
-                'values': top_cases['total_cases'].tolist()
-            }
-            
-            # Cases vs deaths scatter plot
-            if 'total_deaths' in df.columns:
-                scatter_data = []
-                for _, row in df.iterrows():
-                    if pd.notna(row['total_cases']) and pd.notna(row['total_deaths']):
-                        scatter_data.append({
-                            'x': float(row['total_cases']),
-                            'y': float(row['total_deaths']),
-                            'country': row['country']
-                        })
-                
-                chart_data['scatter'] = {
-                    'data': scatter_data,
-                    'x_label': 'Total Cases',
-                    'y_label': 'Total Deaths'
-                }
-            
-            # Continent breakdown
-            if 'continent' in df.columns:
-                continent_data = df.groupby('continent')['total_cases'].sum().sort_values(ascending=False)
-                chart_data['continent'] = {
-                    'labels': continent_data.index.tolist(),
-                    'values': continent_data.values.tolist()
-                }
-        
-        # Generic charts for any dataset
+        analysis = get_analysis(dataset, user_id=request.user.id, exact=request.GET.get('exact') == '1')
+        with phase('render'):
+            return render(request, 'data_manager/analyze_dataset.html', dict(analysis, dataset=dataset))
+
+    except AdmissionRejected as e:
+        if e.reason == 'user_limit':
+            messages.warning(request, "You already have analyses running. Please try again once they finish.")
         else:
-            # If we have categorical and numeric columns, create bar chart
-            if categorical_columns and numeric_columns:
-                category_col = categorical_columns[0]  # Use first categorical column
-                value_col = numeric_columns[0]  # Use first numeric column
-                
-                # Get top 10 categories by value
-                top_categories = df.groupby(category_col)[value_col].sum().sort_values(ascending=False).head(10)
-                
-                chart_data['bar'] = {
-                    'labels': top_categories.index.tolist(),
-                    'values': top_categories.values.tolist(),
-                    'category_col': category_col,
-                    'value_col': value_col
-                }
-            
-            # If we have multiple numeric columns, create a distribution chart
-            if len(numeric_columns) >= 2:
-                chart_data['distribution'] = {
-                    'labels': numeric_columns[:5],  # First 5 numeric columns
-                    'stats': {
-                        col: {
-                            'min': float(df[col].min()),
-                            'q1': float(df[col].quantile(0.25)),
-                            'median': float(df[col].median()),
-                            'q3': float(df[col].quantile(0.75)),
-                            'max': float(df[col].max())
-                        } for col in numeric_columns[:5] if not df[col].isnull().all()
-                    }
-                }
-        
-        return render(request, 'data_manager/analyze_dataset.html', {
-            'dataset': dataset,
-            'column_types': column_types,
-            'numeric_columns': numeric_columns,
-            'categorical_columns': categorical_columns,
-            'stats': stats,
-            'chart_data': chart_data,
-            'is_covid_data': is_covid_data
-        })
-        
+            messages.warning(request, "The server is busy analyzing other datasets. Please try again in a minute.")
+        return redirect('dataset_detail', pk=dataset_id)
     except Exception as e:
         messages.error(request, f"Error analyzing dataset: {str(e)}")
         return redirect('dataset_detail', pk=dataset_id)
\ No newline at end of file